@@ -0,0 +1,214 @@
+"""
+Line identification of many spectra at once. The wavelength ranges of the spectra are read first (only the first and
+last wavelength of each), then the linelist is trimmed (or, for a binary linelist folder, read from its columns) and
+indexed only once for the ranges of all spectra, and the lines of each spectrum are found in that one index in memory.
+The lines of each spectrum are then matched against it (see line_matching.match_lines) in parallel. Nothing is written
+to disk (unless cache is True, see file_processor.load_spectrum).
+
+    python batch_processor.py /path/to/linelists spectra/*.norm --loggf-threshold -1 --species "Fe I" "Fe II" --workers 8 \
+        --window-half-width 0.5
+"""
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from file_processor import load_spectrum, read_spectrum_range
+from line_matching import LineMatches, match_lines
+from line_table import LineTable, LineQuery, read_line_table, find_element_in_table
+from linelist_binary import read_binary_line_table
+from linelist_index import load_linelist_order
+from trimmer import trim_and_combine_linelists
+
+
+class StarLines:
+    """
+    Lines found within the wavelengths of one spectrum
+    """
+    __slots__ = ("spectrum_path", "left_wavelength", "right_wavelength", "lines", "species_lines", "matches")
+
+    def __init__(self, spectrum_path: str, left_wavelength: float, right_wavelength: float, lines: LineTable,
+                 species_lines: dict, matches: LineMatches = None):
+        self.spectrum_path: str = spectrum_path
+        # first and last wavelength of the spectrum
+        self.left_wavelength: float = left_wavelength
+        self.right_wavelength: float = right_wavelength
+        # lines within the wavelengths with loggf above the threshold, sorted by wavelength
+        self.lines: LineTable = lines
+        # element name like 'Fe II': its lines out of lines
+        self.species_lines: dict[str, LineTable] = species_lines
+        # lines matched against the spectrum, None if they were not matched
+        self.matches: LineMatches = matches
+
+    def __repr__(self) -> str:
+        return f"StarLines({self.spectrum_path}, {self.left_wavelength}-{self.right_wavelength}, {len(self.lines)} lines)"
+
+
+def get_spectrum_ranges(spectrum_paths: list[str], workers: int = 1) -> np.ndarray:
+    """
+    Wavelength ranges of the spectra (read in parallel if workers > 1), only the first and last data line of each
+    spectrum is read
+    :param spectrum_paths: Paths to the spectra
+    :param workers: Number of processes reading the spectra
+    :return: Array of shape (number of spectra, 2) with the first and last wavelength of each spectrum
+    """
+    if workers > 1 and len(spectrum_paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(spectrum_paths))) as executor:
+            spectrum_ranges: list = list(executor.map(read_spectrum_range, spectrum_paths))
+    else:
+        spectrum_ranges: list = [read_spectrum_range(spectrum_path) for spectrum_path in spectrum_paths]
+    return np.asarray(spectrum_ranges, dtype=np.float64).reshape(len(spectrum_paths), 2)
+
+
+def merge_segments(seg_begins: np.ndarray, seg_ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merges overlapping segments, so that no line is trimmed twice
+    :param seg_begins: Array of segment beginnings
+    :param seg_ends: Array of segment ends
+    :return: Beginnings and ends of the merged segments, sorted
+    """
+    segment_order: np.ndarray = np.argsort(seg_begins, kind="stable")
+    seg_begins, seg_ends = np.asarray(seg_begins, dtype=np.float64)[segment_order], \
+        np.asarray(seg_ends, dtype=np.float64)[segment_order]
+    furthest_ends: np.ndarray = np.maximum.accumulate(seg_ends)
+    # a segment starts a new merged segment if it begins after all segments before it end
+    starts_new: np.ndarray = np.concatenate(([True], seg_begins[1:] > furthest_ends[:-1]))
+    merged_ends: np.ndarray = furthest_ends[np.concatenate((np.flatnonzero(starts_new)[1:] - 1, [len(seg_ends) - 1]))]
+    return seg_begins[starts_new], merged_ends
+
+
+def build_line_query(line_list_path: str, left_wavelengths: np.ndarray, right_wavelengths: np.ndarray,
+                     molecules_flag: bool, reader: str = "readlines", use_manifest: bool = False) -> LineQuery:
+    """
+    Reads the lines of the linelist folder within the wavelength ranges once and indexes them. Each range is its own
+    segment (overlapping ones are merged), so that the gaps between the spectra are not read. A binary linelist folder
+    (see linelist_binary) is read from its columns, other folders are trimmed straight into memory.
+    Hydrogen is always included (like the other files, only its lines within the ranges).
+    :param line_list_path: Path to the folder with the linelists
+    :param left_wavelengths: Minimum wavelength of each range (or one value)
+    :param right_wavelengths: Maximum wavelength of each range (or one value)
+    :param molecules_flag: If True, then the molecules are included
+    :param reader: How the linelists are read, see create_window_linelist
+    :param use_manifest: See create_window_linelist
+    :return: Index of the lines
+    """
+    seg_begins, seg_ends = merge_segments(np.atleast_1d(left_wavelengths), np.atleast_1d(right_wavelengths))
+    if load_linelist_order(line_list_path) is not None:
+        line_table: LineTable = read_binary_line_table(line_list_path, molecules_flag, do_hydrogen=True)
+        segment_indices: np.ndarray = np.searchsorted(seg_begins, line_table.wavelengths, side="right") - 1
+        line_table = line_table[(segment_indices >= 0) &
+                                (line_table.wavelengths <= seg_ends[np.maximum(segment_indices, 0)])]
+    else:
+        # without do_hydrogen, hydrogen is trimmed like any other file instead of being copied whole
+        linelist_elements = trim_and_combine_linelists(seg_begins, seg_ends, line_list_path, molecules_flag,
+                                                       do_hydrogen=False, reader=reader, use_manifest=use_manifest)
+        line_table: LineTable = read_line_table(linelist_elements)
+    return LineQuery(line_table, species_index=False)
+
+
+def identify_star_lines(spectrum_path: str, left_wavelength: float, right_wavelength: float, lines: LineTable,
+                        species: list[str] = (), window_half_width: float = None, cache: bool = False,
+                        use_float32: bool = False) -> StarLines:
+    """
+    Splits the lines of one spectrum by species and matches them against the spectrum
+    :param spectrum_path: Path to the spectrum
+    :param left_wavelength: First wavelength of the spectrum
+    :param right_wavelength: Last wavelength of the spectrum
+    :param lines: Lines within the wavelengths of the spectrum
+    :param species: Element names like 'Fe II', whose lines are also given separately
+    :param window_half_width: Passed to match_lines. If None, then the spectrum is not loaded and nothing is matched
+    :param cache: Passed to load_spectrum
+    :param use_float32: Passed to load_spectrum
+    :return: Lines of the spectrum
+    """
+    matches: LineMatches = None
+    if window_half_width is not None:
+        spectrum: np.ndarray = load_spectrum(spectrum_path, cache=cache, use_float32=use_float32)
+        matches = match_lines(lines, spectrum, window_half_width)
+    return StarLines(spectrum_path, left_wavelength, right_wavelength, lines,
+                     {element_name: find_element_in_table(lines, element_name) for element_name in species}, matches)
+
+
+def identify_lines(line_query: LineQuery, spectrum_paths: list[str], spectrum_ranges: np.ndarray,
+                   loggf_threshold: float, species: list[str] = (), window_half_width: float = None, workers: int = 1,
+                   cache: bool = False, use_float32: bool = False) -> list[StarLines]:
+    """
+    Finds the lines of each spectrum in the shared index, all windows with one search, then splits and matches them
+    for each spectrum (in parallel if workers > 1), see identify_star_lines
+    :param line_query: Index of the lines
+    :param spectrum_paths: Paths to the spectra
+    :param spectrum_ranges: First and last wavelength of each spectrum, see get_spectrum_ranges
+    :param loggf_threshold: Minimum loggf
+    :param species: Element names like 'Fe II', whose lines are also given separately
+    :param window_half_width: Passed to match_lines. If None, then the spectra are not loaded and nothing is matched
+    :param workers: Number of processes
+    :param cache: Passed to load_spectrum
+    :param use_float32: Passed to load_spectrum
+    :return: Lines of each spectrum, in the order of spectrum_paths
+    """
+    lines_in_windows: list[LineTable] = line_query.query_windows(spectrum_ranges[:, 0], spectrum_ranges[:, 1],
+                                                                 loggf_threshold)
+    number_of_spectra: int = len(spectrum_paths)
+    star_arguments: tuple = (spectrum_paths, spectrum_ranges[:, 0].tolist(), spectrum_ranges[:, 1].tolist(),
+                             lines_in_windows, [species] * number_of_spectra, [window_half_width] * number_of_spectra,
+                             [cache] * number_of_spectra, [use_float32] * number_of_spectra)
+    if workers > 1 and number_of_spectra > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, number_of_spectra)) as executor:
+            return list(executor.map(identify_star_lines, *star_arguments))
+    return list(map(identify_star_lines, *star_arguments))
+
+
+def process_spectra(spectrum_paths: list[str], line_list_path: str, molecules_flag: bool = True,
+                    loggf_threshold: float = -1, species: list[str] = (), workers: int = 1, reader: str = "readlines",
+                    use_manifest: bool = False, cache: bool = False, use_float32: bool = False,
+                    line_query: LineQuery = None, window_half_width: float = None) -> list[StarLines]:
+    """
+    Finds the lines within the wavelengths of each spectrum. The linelist is read and indexed only once, for the
+    wavelengths of all spectra together, instead of being trimmed and parsed again for each spectrum.
+    :param spectrum_paths: Paths to the spectra
+    :param line_list_path: Path to the folder with the linelists (text or binary)
+    :param molecules_flag: If True, then the molecules are included
+    :param loggf_threshold: Minimum loggf
+    :param species: Element names like 'Fe II', whose lines are also given separately
+    :param workers: Number of processes reading and matching the spectra
+    :param reader: How the linelists are read, see create_window_linelist
+    :param use_manifest: See create_window_linelist
+    :param cache: Passed to load_spectrum. Off by default, so that nothing is written next to the spectra
+    :param use_float32: Passed to load_spectrum
+    :param line_query: Index from an earlier build_line_query covering all spectra. If given, then the linelist is not
+    read at all
+    :param window_half_width: Passed to match_lines. If None, then the spectra are not loaded and nothing is matched
+    :return: Lines of each spectrum, in the order of spectrum_paths
+    """
+    spectrum_paths = list(spectrum_paths)
+    if not spectrum_paths:
+        return []
+    spectrum_ranges: np.ndarray = get_spectrum_ranges(spectrum_paths, workers)
+    if line_query is None:
+        line_query = build_line_query(line_list_path, spectrum_ranges[:, 0], spectrum_ranges[:, 1], molecules_flag,
+                                      reader, use_manifest)
+    return identify_lines(line_query, spectrum_paths, spectrum_ranges, loggf_threshold, species, window_half_width,
+                          workers, cache, use_float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finds the lines of the linelist within many spectra")
+    parser.add_argument("line_list_path", help="folder with the linelists (text or binary)")
+    parser.add_argument("spectra", nargs="+", help="paths to the spectra")
+    parser.add_argument("--loggf-threshold", type=float, default=-1, help="minimum loggf")
+    parser.add_argument("--species", nargs="*", default=[], help="element names like 'Fe II' to list separately")
+    parser.add_argument("--no-molecules", action="store_true", help="leave out the molecules")
+    parser.add_argument("--workers", type=int, default=1, help="processes reading and matching the spectra")
+    parser.add_argument("--reader", default="readlines", help="linelist reader, see create_window_linelist")
+    parser.add_argument("--window-half-width", type=float, default=None,
+                        help="match the lines against the spectra with windows of this half width")
+    parser.add_argument("--cache", action="store_true", help="keep binary copies of the spectra next to them")
+    arguments = parser.parse_args()
+
+    for star_lines in process_spectra(arguments.spectra, arguments.line_list_path, not arguments.no_molecules,
+                                      arguments.loggf_threshold, arguments.species, arguments.workers,
+                                      arguments.reader, cache=arguments.cache,
+                                      window_half_width=arguments.window_half_width):
+        print(star_lines)
+        if star_lines.matches is not None:
+            print(f"    {star_lines.matches}")
+        for element_name, element_lines in star_lines.species_lines.items():
+            print(f"    {element_name}: {len(element_lines)} lines")
@@ -0,0 +1,307 @@
+"""
+Benchmarks of the trimming pipeline on synthetic Turbospectrum linelists and spectra, so that it can be run anywhere
+without the real linelists. Each stage is timed for a sweep of linelist sizes and numbers of segments, with the
+throughput and the peak memory (of Python and numpy allocations, measured with tracemalloc).
+
+    python benchmark.py --lines 1000 10000 --segments 1 10 100 --repeat 3 --output benchmark.json
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from file_processor import synt_grab, load_spectrum
+from trimmer import create_window_linelist, combine_linelists, read_element_data, find_elements, write_lines, \
+    binary_find_left_segment_index, binary_find_right_segment_index, trim_and_combine_linelists
+from line_table import read_line_table, find_elements_in_table
+
+# symbols of the atoms used for the synthetic linelists, atomic number is the position + 3
+ATOM_SYMBOLS: list[str] = ["Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K",
+                           "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn"]
+# names and codes of the molecules used for the synthetic linelists
+MOLECULES: list[tuple[str, str]] = [("CN", "0607.012014"), ("CH", "0106.001012"), ("C2", "0606.012012"),
+                                    ("OH", "0108.001016"), ("TiO", "0822.016048")]
+
+
+def write_element_block(linelist_file, element_header: str, element_name: str, wavelengths: np.ndarray,
+                        random_generator: np.random.Generator):
+    """
+    Writes one element block in the Turbospectrum format
+    :param linelist_file: Opened linelist file
+    :param element_header: First line of the element without the number of lines
+    :param element_name: Second line of the element, e.g. 'Fe I    LTE'
+    :param wavelengths: Sorted wavelengths of the lines
+    :param random_generator: Generator of the other columns
+    """
+    number_of_lines: int = len(wavelengths)
+    excitation: np.ndarray = random_generator.uniform(0, 10, number_of_lines)
+    loggf: np.ndarray = random_generator.uniform(-6, 1, number_of_lines)
+    line_format: str = "  {:10.3f} {:6.3f} {:7.3f}  7.500  {:4.1f} 1.00e+08 'x' 'x'  0.0  1.0\n"
+    linelist_file.write(f"{element_header}    {number_of_lines}\n'{element_name}'\n")
+    linelist_file.write("".join(line_format.format(wavelength, chi, gf, 2 * (line_index % 5) + 1)
+                                for line_index, (wavelength, chi, gf) in enumerate(zip(wavelengths, excitation, loggf))))
+
+
+def get_wavelengths(random_generator: np.random.Generator, number_of_lines: int, wavelength_minimum: float,
+                    wavelength_maximum: float) -> np.ndarray:
+    # rounded like in the linelists, so that there are repeated wavelengths too
+    return np.sort(np.round(random_generator.uniform(wavelength_minimum, wavelength_maximum, number_of_lines), 3))
+
+
+def generate_linelists(path: str, number_of_elements: int = 10, lines_per_element: int = 1000,
+                       number_of_molecules: int = 1, lines_per_molecule: int = 10000, hydrogen: bool = True,
+                       wavelength_minimum: float = 4000, wavelength_maximum: float = 7000, seed: int = 0) -> list[str]:
+    """
+    Writes a folder of synthetic linelists in the Turbospectrum format: one file per atom (neutral and ionised block),
+    one file per molecule (few isotopologue blocks) and one hydrogen file
+    :param path: Folder to write the linelists into
+    :param number_of_elements: Number of atom files
+    :param lines_per_element: Number of lines of each ionisation stage of each atom
+    :param number_of_molecules: Number of molecule files
+    :param lines_per_molecule: Number of lines of each molecule file
+    :param hydrogen: If True, then a hydrogen file is written
+    :param wavelength_minimum: Smallest wavelength of the lines
+    :param wavelength_maximum: Largest wavelength of the lines
+    :param seed: Seed of the random generator
+    :return: Paths to the linelists
+    """
+    random_generator: np.random.Generator = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+    linelist_paths: list[str] = []
+    for element_index in range(number_of_elements):
+        symbol: str = ATOM_SYMBOLS[element_index % len(ATOM_SYMBOLS)]
+        atomic_number: int = element_index % len(ATOM_SYMBOLS) + 3
+        linelist_paths.append(os.path.join(path, f"atom_{element_index}_{symbol}.bsyn"))
+        with open(linelist_paths[-1], "w") as linelist_file:
+            for ionization, roman_numeral in ((1, "I"), (2, "II")):
+                write_element_block(linelist_file, f"'{atomic_number:4d}.000            '    {ionization}",
+                                    f"{symbol} {roman_numeral}    LTE",
+                                    get_wavelengths(random_generator, lines_per_element, wavelength_minimum,
+                                                    wavelength_maximum), random_generator)
+    for molecule_index in range(number_of_molecules):
+        molecule_name, molecule_code = MOLECULES[molecule_index % len(MOLECULES)]
+        linelist_paths.append(os.path.join(path, f"molecule_{molecule_index}_{molecule_name}.bsyn"))
+        number_of_blocks: int = 3
+        with open(linelist_paths[-1], "w") as linelist_file:
+            for _ in range(number_of_blocks):
+                write_element_block(linelist_file, f"'{molecule_code} '    1", f"{molecule_name}    LTE",
+                                    get_wavelengths(random_generator, lines_per_molecule // number_of_blocks,
+                                                    wavelength_minimum, wavelength_maximum), random_generator)
+    if hydrogen:
+        linelist_paths.append(os.path.join(path, "hydrogen.bsyn"))
+        with open(linelist_paths[-1], "w") as linelist_file:
+            write_element_block(linelist_file, "'01.000000 '    1", "H I    LTE",
+                                get_wavelengths(random_generator, 100, wavelength_minimum, wavelength_maximum),
+                                random_generator)
+    return linelist_paths
+
+
+def generate_spectrum(path: str, wavelength_minimum: float = 4000, wavelength_maximum: float = 7000,
+                      step: float = 0.01, number_of_lines: int = 2000, seed: int = 0) -> str:
+    """
+    Writes a synthetic normalised spectrum (wavelength, flux) with Gaussian absorption lines, like a Turbospectrum .spec
+    :param path: Path of the spectrum
+    :param wavelength_minimum: First wavelength
+    :param wavelength_maximum: Last wavelength
+    :param step: Wavelength step
+    :param number_of_lines: Number of absorption lines
+    :param seed: Seed of the random generator
+    :return: Path of the spectrum
+    """
+    random_generator: np.random.Generator = np.random.default_rng(seed)
+    wavelengths: np.ndarray = np.arange(wavelength_minimum, wavelength_maximum, step)
+    flux: np.ndarray = np.ones_like(wavelengths)
+    line_centers: np.ndarray = random_generator.uniform(wavelength_minimum, wavelength_maximum, number_of_lines)
+    line_depths: np.ndarray = random_generator.uniform(0.05, 0.8, number_of_lines)
+    line_widths: np.ndarray = random_generator.uniform(0.03, 0.2, number_of_lines)
+    for line_center, line_depth, line_width in zip(line_centers, line_depths, line_widths):
+        # only the points within 5 widths of the line matter
+        start, end = np.searchsorted(wavelengths, (line_center - 5 * line_width, line_center + 5 * line_width))
+        flux[start:end] *= 1 - line_depth * np.exp(-0.5 * ((wavelengths[start:end] - line_center) / line_width) ** 2)
+    np.savetxt(path, np.column_stack((wavelengths, flux)), fmt="%.4f %.6f")
+    return path
+
+
+def get_segments(number_of_segments: int, wavelength_minimum: float, wavelength_maximum: float,
+                 segment_width: float = 2.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Segments spread evenly over the wavelength range, like the windows around the fitted lines
+    """
+    seg_begins: np.ndarray = np.linspace(wavelength_minimum, wavelength_maximum - segment_width, number_of_segments)
+    return seg_begins, seg_begins + segment_width
+
+
+def time_stage(stage_function, repeat: int = 3, setup_function=None) -> tuple[float, int]:
+    """
+    Runs the stage repeat times and measures the best time, then once more to measure the peak memory
+    :param stage_function: Function to time, called without arguments
+    :param repeat: Number of timed runs
+    :param setup_function: Called before each run, not timed (e.g. to remove the output of the previous run)
+    :return: Best time in seconds and peak memory in bytes
+    """
+    best_time: float = float("inf")
+    for _ in range(repeat):
+        if setup_function is not None:
+            setup_function()
+        start_time: float = time.perf_counter()
+        stage_function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    # tracemalloc slows down every allocation, so the memory is measured in a separate run that is not timed
+    if setup_function is not None:
+        setup_function()
+    tracemalloc.start()
+    stage_function()
+    peak_memory: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best_time, peak_memory
+
+
+def make_result(stage: str, parameters: dict, seconds: float, peak_memory: int, work_amount: float,
+                work_unit: str) -> dict:
+    return {"stage": stage, **parameters, "seconds": seconds, "peak_memory_mb": peak_memory / 1024 ** 2,
+            "throughput": work_amount / seconds if seconds > 0 else float("inf"), "throughput_unit": f"{work_unit}/s"}
+
+
+def run_benchmarks(lines_per_element_sweep: list[int], segments_sweep: list[int], repeat: int = 3,
+                   number_of_elements: int = 10, number_of_molecules: int = 1,
+                   readers: tuple = ("readlines", "index", "mmap", "seek"),
+                   work_dir: str = None) -> list[dict]:
+    """
+    Times all stages of the pipeline for each linelist size and number of segments
+    :param lines_per_element_sweep: Numbers of lines per element (molecules get 10 times more)
+    :param segments_sweep: Numbers of segments
+    :param repeat: Number of runs of each stage, the best time is kept
+    :param number_of_elements: Number of atom files
+    :param number_of_molecules: Number of molecule files
+    :param readers: Linelist readers of create_window_linelist to time
+    :param work_dir: Folder for the synthetic files. If None, then a temporary folder that is removed at the end
+    :return: List of results, one per stage and parameters
+    """
+    results: list[dict] = []
+    temporary_dir: str = tempfile.mkdtemp(dir=work_dir)
+    try:
+        spectrum_path: str = generate_spectrum(os.path.join(temporary_dir, "synthetic.spec"))
+        spectrum_megabytes: float = os.path.getsize(spectrum_path) / 1024 ** 2
+        seconds, peak_memory = time_stage(lambda: synt_grab(spectrum_path), repeat)
+        results.append(make_result("synt_grab", {}, seconds, peak_memory, spectrum_megabytes, "MB"))
+        # first load writes the binary copy, the next ones only load it
+        load_spectrum(spectrum_path, mmap_mode=None)
+        seconds, peak_memory = time_stage(lambda: load_spectrum(spectrum_path, mmap_mode=None), repeat)
+        results.append(make_result("load_spectrum_cached", {}, seconds, peak_memory, spectrum_megabytes, "MB"))
+
+        for lines_per_element in lines_per_element_sweep:
+            old_path_name: str = os.path.join(temporary_dir, f"linelists_{lines_per_element}")
+            generate_linelists(old_path_name, number_of_elements, lines_per_element, number_of_molecules,
+                               lines_per_element * 10)
+            linelist_megabytes: float = sum(entry.stat().st_size for entry in os.scandir(old_path_name)) / 1024 ** 2
+            with open(os.path.join(old_path_name, "atom_0_Li.bsyn")) as linelist_file:
+                # first element block: header lines and then lines_per_element lines
+                lines_file: list[str] = linelist_file.readlines()
+            size_parameters: dict = {"lines_per_element": lines_per_element}
+
+            # binary searches over one element block, as the trimmer does them
+            search_wavelengths: np.ndarray = np.linspace(4000, 7000, 100)
+            def search_all():
+                wavelength_dictionary: dict = {}
+                for wavelength in search_wavelengths:
+                    index_start = binary_find_left_segment_index(lines_file, wavelength_dictionary, 0,
+                                                                 lines_per_element, 2, wavelength)
+                    binary_find_right_segment_index(lines_file, wavelength_dictionary, index_start, lines_per_element,
+                                                    2, wavelength + 2)
+            seconds, peak_memory = time_stage(search_all, repeat)
+            results.append(make_result("binary_search", size_parameters, seconds, peak_memory,
+                                       len(search_wavelengths), "searches"))
+
+            output_path: str = os.path.join(temporary_dir, "write_lines")
+            def reset_write_lines():
+                shutil.rmtree(output_path, ignore_errors=True)
+                os.makedirs(os.path.join(output_path, "0"))
+            seconds, peak_memory = time_stage(lambda: write_lines({0: [(2, lines_per_element + 2)]}, lines_file,
+                                                                  "'   3.000            '    1", "'Li I    LTE'\n",
+                                                                  output_path, 0), repeat, reset_write_lines)
+            results.append(make_result("write_lines", size_parameters, seconds, peak_memory, lines_per_element,
+                                       "lines"))
+
+            for number_of_segments in segments_sweep:
+                seg_begins, seg_ends = get_segments(number_of_segments, 4000, 7000)
+                for reader in readers:
+                    new_path_name: str = os.path.join(temporary_dir, "trimmed")
+                    # the index of 'index' and the manifest of 'seek' are built by the first run, only the runs that
+                    # use them are timed
+                    shutil.rmtree(new_path_name, ignore_errors=True)
+                    create_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, True, reader=reader)
+                    shutil.rmtree(new_path_name, ignore_errors=True)
+                    for lbl in (False, True):
+                        parameters: dict = {**size_parameters, "segments": number_of_segments, "reader": reader,
+                                            "lbl": lbl}
+                        seconds, peak_memory = time_stage(
+                            lambda: create_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, True,
+                                                           lbl, reader=reader), repeat,
+                            lambda: shutil.rmtree(new_path_name, ignore_errors=True))
+                        results.append(make_result("create_window_linelist", parameters, seconds, peak_memory,
+                                                   linelist_megabytes, "MB"))
+                        if lbl:
+                            continue
+                        # combine_linelists removes the trimmed linelists, so they are trimmed again before each run
+                        seconds, peak_memory = time_stage(
+                            lambda: combine_linelists(new_path_name), repeat,
+                            lambda: (shutil.rmtree(new_path_name, ignore_errors=True),
+                                     create_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, True,
+                                                            reader=reader)))
+                        results.append(make_result("combine_linelists", parameters, seconds, peak_memory,
+                                                   linelist_megabytes, "MB"))
+                        with open(os.path.join(new_path_name, "0", "combined_linelist.bsyn")) as combined_file:
+                            combined_lines: list[str] = combined_file.readlines()
+                        # otherwise the stages below would time an empty linelist
+                        assert combined_lines, "The combined linelist is empty"
+                        seconds, peak_memory = time_stage(lambda: read_element_data(combined_lines), repeat)
+                        results.append(make_result("read_element_data", parameters, seconds, peak_memory,
+                                                   len(combined_lines), "lines"))
+                        elements_data: list = read_element_data(combined_lines)
+                        seconds, peak_memory = time_stage(lambda: find_elements(elements_data, 4000, 7000, -1), repeat)
+                        results.append(make_result("find_elements", parameters, seconds, peak_memory,
+                                                   len(elements_data), "lines"))
+                        seconds, peak_memory = time_stage(lambda: find_elements_in_table(
+                            read_line_table(combined_lines), 4000, 7000, -1), repeat)
+                        results.append(make_result("read_line_table+find_elements", parameters, seconds, peak_memory,
+                                                   len(combined_lines), "lines"))
+                        seconds, peak_memory = time_stage(lambda: trim_and_combine_linelists(
+                            seg_begins, seg_ends, old_path_name, True, reader=reader), repeat)
+                        results.append(make_result("trim_and_combine_linelists", parameters, seconds, peak_memory,
+                                                   linelist_megabytes, "MB"))
+                shutil.rmtree(os.path.join(temporary_dir, "trimmed"), ignore_errors=True)
+    finally:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+    return results
+
+
+def print_results(results: list[dict]):
+    parameter_names: list[str] = ["lines_per_element", "segments", "reader", "lbl"]
+    print(f"{'stage':<32}{'lines':>8}{'segs':>6}{'reader':>11}{'lbl':>6}{'seconds':>10}{'throughput':>24}{'peak MB':>10}")
+    for result in results:
+        parameters: list[str] = [str(result.get(parameter_name, "")) for parameter_name in parameter_names]
+        print(f"{result['stage']:<32}{parameters[0]:>8}{parameters[1]:>6}{parameters[2]:>11}{parameters[3]:>6}"
+              f"{result['seconds']:>10.4f}{result['throughput']:>14.1f} {result['throughput_unit']:<9}"
+              f"{result['peak_memory_mb']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the linelist trimming pipeline on synthetic data")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000], help="lines per element to sweep")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 10, 100], help="numbers of segments to sweep")
+    parser.add_argument("--elements", type=int, default=10, help="number of atom linelists")
+    parser.add_argument("--molecules", type=int, default=1, help="number of molecule linelists")
+    parser.add_argument("--readers", nargs="+", default=["readlines", "index", "mmap", "seek"], help="linelist readers to time")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage, the best is kept")
+    parser.add_argument("--output", help="JSON file to save the results into, to compare between versions")
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.lines, arguments.segments, arguments.repeat, arguments.elements,
+                                       arguments.molecules, tuple(arguments.readers))
+    print_results(benchmark_results)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(benchmark_results, output_file, indent=1)
@@ -2,7 +2,16 @@
 A small module of various functions for working with dech20/95 output files
 """
 
-from numpy import genfromtxt, concatenate, column_stack, savetxt, ndarray
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from numpy import column_stack, ndarray, argsort, take_along_axis, isfinite, nanmin, nanmax, inf, interp, \
+    concatenate, load
+from file_processor import read_spectrum_text, write_spectrum_text, get_spectrum_cache_path, get_spectrum_cache_prefix, \
+    save_spectrum_cache
+from file_utils import get_biggest_first_order
+
+OVERLAP_MODES = ("keep", "average", "trim")
 
 
 """
@@ -10,27 +19,111 @@ There in Dech is an option to choose to save all orders at once into one file,
 but in this case all orders will not be saved in order,
 but written down in a column, which creates a little confusion
 """
-def tab_spectra(filepath: str, save=False) -> ndarray:
-    data = genfromtxt(filepath)
-    all_wave = []
-    all_flux = []
-    
-    for i in range(0, len(data[0]), 2):
-        all_wave.append(data[:, i])
-
-    for i in range(1, len(data[0]), 2):
-        all_flux.append(data[:, i])
-
-    conc_wave = concatenate(all_wave)
-    conc_flux = concatenate(all_flux)
-    output =  column_stack((conc_wave, conc_flux))
-    
+def tab_spectra(filepath: str, save=False, overlap="keep") -> ndarray:
+    """
+    Merges all orders of the Dech file into one spectrum sorted by wavelength.
+    :param filepath: Dech file with the orders as pairs of columns (wavelength, flux)
+    :param save: If True, then the spectrum is also saved as text into filepath + ".concat.txt"
+    :param overlap: What to do where neighbouring orders overlap. 'keep' keeps the points of both orders, 'trim' cuts
+    both orders in the middle of the overlap, 'average' keeps the points of the bluer order with the mean flux of both
+    orders (the redder one interpolated) and drops the points of the redder order there
+    :return: Array with wavelength and flux columns
+    """
+    if overlap not in OVERLAP_MODES:
+        raise ValueError(f"Unknown overlap mode {overlap}, should be one of {OVERLAP_MODES}")
+    data = read_spectrum_text(filepath)
+    number_of_orders = data.shape[1] // 2
+    # every order is a column, rows are the points of the orders
+    all_wave = data[:, 0:2 * number_of_orders:2]
+    all_flux = data[:, 1:2 * number_of_orders:2]
+    # sort points within each order and the orders by their first wavelength
+    point_order = argsort(all_wave, axis=0, kind="stable")
+    all_wave = take_along_axis(all_wave, point_order, axis=0)
+    all_flux = take_along_axis(all_flux, point_order, axis=0)
+    order_sequence = argsort(nanmin(all_wave, axis=0), kind="stable")
+    all_wave = all_wave[:, order_sequence]
+    all_flux = all_flux[:, order_sequence]
+    # missing values (shorter orders) are not part of the spectrum
+    points_to_keep = isfinite(all_wave)
+
+    if overlap == "trim" and number_of_orders > 1:
+        # each order keeps the points between the middles of its overlaps with the neighbours. If the orders do not
+        # overlap, then the middle is between them and nothing is cut
+        cuts = (nanmax(all_wave, axis=0)[:-1] + nanmin(all_wave, axis=0)[1:]) / 2
+        lower_cuts = concatenate(([-inf], cuts))
+        upper_cuts = concatenate((cuts, [inf]))
+        points_to_keep &= (all_wave >= lower_cuts) & (all_wave < upper_cuts)
+    elif overlap == "average" and number_of_orders > 1:
+        all_flux = all_flux.copy()
+        order_minimums = nanmin(all_wave, axis=0)
+        order_maximums = nanmax(all_wave, axis=0)
+        for order_index in range(number_of_orders - 1):
+            next_points = points_to_keep[:, order_index + 1]
+            next_wave = all_wave[next_points, order_index + 1]
+            next_flux = all_flux[next_points, order_index + 1]
+            # points of this order that the next order covers too
+            in_overlap = points_to_keep[:, order_index] & (all_wave[:, order_index] >= order_minimums[order_index + 1])
+            if not in_overlap.any():
+                continue
+            all_flux[in_overlap, order_index] = (all_flux[in_overlap, order_index] +
+                                                 interp(all_wave[in_overlap, order_index], next_wave, next_flux)) / 2
+            points_to_keep[:, order_index + 1] &= all_wave[:, order_index + 1] > order_maximums[order_index]
+
+    # columns one after another, like concatenating the orders
+    conc_wave = all_wave.T[points_to_keep.T]
+    conc_flux = all_flux.T[points_to_keep.T]
+    wavelength_order = argsort(conc_wave, kind="stable")
+    output = column_stack((conc_wave[wavelength_order], conc_flux[wavelength_order]))
+
     if save:
-        savetxt("filepath" + "concat.txt", output)
-    else:
-        return output
+        write_spectrum_text(f"{filepath}.concat.txt", output)
+    return output
+
+
+def load_tab_spectra(filepath: str, overlap="keep", cache_dir=None, mmap_mode="r") -> ndarray:
+    """
+    Same as tab_spectra, but the merged spectrum is saved as a binary copy (see file_processor.load_spectrum), so that
+    the next loads only memory-map it
+    """
+    cache_tag = f"dech-{overlap}-"
+    cache_path = get_spectrum_cache_path(filepath, cache_dir=cache_dir, cache_tag=cache_tag)
+    if os.path.isfile(cache_path):
+        return load(cache_path, mmap_mode=mmap_mode)
+    output = tab_spectra(filepath, overlap=overlap)
+    save_spectrum_cache(output, cache_path, get_spectrum_cache_prefix(filepath, cache_tag=cache_tag))
+    return output
+
+
+def convert_tab_spectra(filepath: str, overlap="keep", cache_dir=None) -> str:
+    """
+    Merges the Dech file into its binary copy, if there is none yet
+    :return: Path to the binary copy
+    """
+    load_tab_spectra(filepath, overlap=overlap, cache_dir=cache_dir)
+    return get_spectrum_cache_path(filepath, cache_dir=cache_dir, cache_tag=f"dech-{overlap}-")
+
+
+def tab_spectra_batch(folder: str, pattern="*.tab", overlap="keep", cache_dir=None, workers=None) -> dict:
+    """
+    Merges all Dech files of the folder into binary copies in parallel. Load them later with load_tab_spectra (with the
+    same overlap and cache_dir) or numpy.load of the returned paths.
+    :param folder: Folder with the Dech files
+    :param pattern: Which files of the folder to merge
+    :param overlap: See tab_spectra
+    :param cache_dir: Where to save the binary copies. If None, then a hidden folder next to the files
+    :param workers: Number of processes, None for the number of processors
+    :return: Dictionary Dech file: path to its binary copy
+    """
+    filepaths = sorted(glob.glob(os.path.join(folder, pattern)))
+    filepaths = [filepaths[file_index] for file_index in get_biggest_first_order(filepaths)]
+    if workers == 1 or len(filepaths) <= 1:
+        return {filepath: convert_tab_spectra(filepath, overlap, cache_dir) for filepath in filepaths}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        cache_paths = executor.map(convert_tab_spectra, filepaths, [overlap] * len(filepaths),
+                                   [cache_dir] * len(filepaths))
+        return dict(zip(filepaths, cache_paths))
 
 
 if __name__ == "__main__":
     data = tab_spectra("dech30.tab")
-    print(data)
\ No newline at end of file
+    print(data)
@@ -1,13 +1,153 @@
-from numpy import genfromtxt, ndarray
+import os
+import hashlib
+from numpy import genfromtxt, loadtxt, load, save, ndarray, float32, float64
+from file_utils import atomic_write
 
-def synt_grab(path2data: str) -> ndarray:
-    return genfromtxt(path2data, comments="#")
+# name of the folder next to the spectra where the binary copies are saved
+SPECTRUM_CACHE_DIR_NAME = ".spectrum_cache"
 
 
-def obs_grab(path2data: str) -> ndarray:
-    return genfromtxt(path2data)
+def synt_grab(path2data: str, cache=False, use_float32=False) -> ndarray:
+    return load_spectrum(path2data, comments="#", cache=cache, use_float32=use_float32)
+
+
+def obs_grab(path2data: str, cache=False, use_float32=False) -> ndarray:
+    return load_spectrum(path2data, cache=cache, use_float32=use_float32)
+
+
+def read_spectrum_text(path2data: str, comments="#", dtype=float64) -> ndarray:
+    """
+    Reads a text spectrum with loadtxt (much faster than genfromtxt). If the file has missing values, which loadtxt
+    cannot read, then genfromtxt is used.
+    """
+    try:
+        return loadtxt(path2data, comments=comments, dtype=dtype)
+    except ValueError:
+        return genfromtxt(path2data, comments=comments, dtype=dtype)
+
+
+def read_spectrum_range(path2data: str, comments="#", block_size=4096) -> tuple[float, float]:
+    """
+    First and last wavelength of a text spectrum sorted by wavelength. Only its first and last data lines are read, not
+    the whole spectrum.
+    :param path2data: Path to the spectrum
+    :param comments: Lines starting with this are skipped
+    :param block_size: Bytes read at once from the end of the file
+    :return: First and last wavelength
+    """
+    with open(path2data, "rb") as spectrum_file:
+        first_wavelength = None
+        for line in spectrum_file:
+            first_wavelength = get_line_wavelength(line, comments)
+            if first_wavelength is not None:
+                break
+        if first_wavelength is None:
+            raise ValueError(f"The spectrum {path2data} is empty")
+        block_start = spectrum_file.seek(0, os.SEEK_END)
+        tail = b""
+        while block_start > 0:
+            read_size = min(block_size, block_start)
+            block_start -= read_size
+            spectrum_file.seek(block_start)
+            tail = spectrum_file.read(read_size) + tail
+            tail_lines = tail.splitlines()
+            # the first line of the tail can be cut in the middle, unless the tail starts the file
+            for line in reversed(tail_lines if block_start == 0 else tail_lines[1:]):
+                last_wavelength = get_line_wavelength(line, comments)
+                if last_wavelength is not None:
+                    return first_wavelength, last_wavelength
+    return first_wavelength, first_wavelength
+
+
+def get_line_wavelength(line: bytes, comments="#"):
+    """
+    :return: Wavelength (first column) of a line of a text spectrum, None for empty and comment lines
+    """
+    if comments:
+        line = line.split(comments.encode(), 1)[0]
+    fields = line.split(None, 1)
+    return float(fields[0]) if fields else None
+
+
+def get_spectrum_cache_path(path2data: str, use_float32=False, cache_dir=None, cache_tag="") -> str:
+    """
+    Path of the binary copy of the spectrum. The name depends on the path, size and modification time of the spectrum,
+    so a changed spectrum never uses an old copy. cache_tag separates different copies of the same file (e.g. processed
+    in different ways).
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path2data)), SPECTRUM_CACHE_DIR_NAME)
+    stat_result = os.stat(path2data)
+    cache_key = f"{os.path.abspath(path2data)}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return os.path.join(cache_dir, f"{get_spectrum_cache_prefix(path2data, use_float32, cache_tag)}"
+                                   f"{hashlib.sha1(cache_key.encode()).hexdigest()[:16]}.npy")
+
+
+def get_spectrum_cache_prefix(path2data: str, use_float32=False, cache_tag="") -> str:
+    return f"{os.path.basename(path2data)}.{cache_tag}{'f4' if use_float32 else 'f8'}."
+
+
+def load_spectrum(path2data: str, comments="#", cache=True, use_float32=False, cache_dir=None, mmap_mode="r") -> ndarray:
+    """
+    Loads a text spectrum. If cache is True, then the first load saves a binary .npy copy (in a hidden folder next to
+    the spectrum, or in cache_dir) and the next loads only memory-map it, so they are almost free and the spectrum does
+    not need to fit into memory. Copies of older versions of the spectrum are removed.
+    :param path2data: Path to the spectrum
+    :param comments: Lines starting with this are skipped
+    :param cache: If True, then the binary copy is used
+    :param use_float32: If True, then the spectrum is kept as float32 (half of the memory)
+    :param cache_dir: Where to save the binary copies. If None, then a hidden folder next to the spectrum
+    :param mmap_mode: Passed to numpy.load for the binary copy. 'r' gives a read-only memory map, None loads it
+    :return: Spectrum as array, like genfromtxt gives it
+    """
+    dtype = float32 if use_float32 else float64
+    if not cache:
+        return read_spectrum_text(path2data, comments=comments, dtype=dtype)
+    cache_path = get_spectrum_cache_path(path2data, use_float32, cache_dir)
+    if os.path.isfile(cache_path):
+        return load(cache_path, mmap_mode=mmap_mode)
+    data = read_spectrum_text(path2data, comments=comments, dtype=dtype)
+    if not save_spectrum_cache(data, cache_path, get_spectrum_cache_prefix(path2data, use_float32)) or mmap_mode is None:
+        return data
+    return load(cache_path, mmap_mode=mmap_mode)
+
+
+def save_spectrum_cache(data: ndarray, cache_path: str, old_cache_prefix: str) -> bool:
+    """
+    Saves the binary copy of the spectrum and removes the copies of its older versions (same prefix, other key)
+    :return: False if the copy could not be saved
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # remove copies of the older versions of this spectrum
+        for old_cache_file in os.listdir(os.path.dirname(cache_path)):
+            if old_cache_file.startswith(old_cache_prefix) and old_cache_file.count(".") == old_cache_prefix.count(".") + 1:
+                os.remove(os.path.join(os.path.dirname(cache_path), old_cache_file))
+        with atomic_write(cache_path, "wb") as cache_file:
+            save(cache_file, data)
+    except OSError as error:
+        # e.g. read-only folder, the spectrum is still loaded
+        print(f"SPECTRUM WARNING! Could not save the binary copy of {cache_path}: {error}")
+        return False
+    return True
+
+
+def write_spectrum_text(path2data: str, data: ndarray, fmt="%.17g", rows_per_chunk=100000):
+    """
+    Writes the spectrum as text, like numpy.savetxt, but formats many rows at once instead of one by one
+    :param path2data: Where to save the spectrum
+    :param data: 2D array with the spectrum
+    :param fmt: Format of one value, the default keeps all digits of float64
+    :param rows_per_chunk: How many rows are formatted at once
+    """
+    data = data.reshape(len(data), -1)
+    row_format = " ".join([fmt] * data.shape[1]) + "\n"
+    with open(path2data, "w") as spectrum_file:
+        for chunk_start in range(0, len(data), rows_per_chunk):
+            chunk = data[chunk_start:chunk_start + rows_per_chunk]
+            spectrum_file.write((row_format * len(chunk)) % tuple(chunk.ravel().tolist()))
 
 
 if __name__ == "__main__":
     data = synt_grab("0.spec")
-    print(data)
\ No newline at end of file
+    print(data)
@@ -0,0 +1,49 @@
+"""
+Helpers for files that several processes work on: writing shared files (indices, manifests, caches) so that no process
+ever sees a half written one, and the order in which a process pool goes through files
+"""
+import os
+from contextlib import contextmanager
+
+
+def get_temporary_path(path: str) -> str:
+    """
+    Path to write a file or folder to before it is renamed to path. It is unique for each process, so that processes
+    saving the same file at the same time do not write into each other's temporary file.
+    :param path: Final path of the file or folder
+    :return: Temporary path next to it
+    """
+    return f"{path}.{os.getpid()}.tmp"
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w"):
+    """
+    Opens a temporary file for writing and renames it to path when the block ends, so that other processes (or the next
+    run after a crash) either see the old file or the whole new one. If the block raises, then the temporary file is
+    removed and path is not changed.
+    :param path: Path of the file to write
+    :param mode: Mode to open the temporary file with, 'w' or 'wb'
+    :return: Yields the open temporary file
+    """
+    temporary_path: str = get_temporary_path(path)
+    try:
+        with open(temporary_path, mode) as temporary_file:
+            yield temporary_file
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_biggest_first_order(file_paths: list[str]) -> list[int]:
+    """
+    Order in which a process pool should work on the files: the biggest first, so that the pool is not waiting for one
+    big file at the end
+    :param file_paths: Paths to the files
+    :return: Indices into file_paths, of the biggest file first
+    """
+    return sorted(range(len(file_paths)), key=lambda file_index: os.path.getsize(file_paths[file_index]), reverse=True)
@@ -0,0 +1,128 @@
+"""
+Matching of the lines (e.g. from find_elements) against a spectrum (e.g. from obs_grab or synt_grab): for all lines at
+once, the pixels of the window around each line, the nearest pixel, the nearest flux minimum and the depth of the line.
+Everything is done with np.searchsorted on the sorted wavelengths of the spectrum, without a loop over the lines, so
+tens of thousands of lines take about as long as reading the spectrum.
+"""
+import numpy as np
+from line_table import LineTable
+
+
+class LineMatches:
+    """
+    Lines matched against one spectrum, each attribute is an array with one value per line (in the order of the lines)
+    """
+    __slots__ = ("spectrum", "line_wavelengths", "window_starts", "window_ends", "nearest_pixels", "minimum_pixels",
+                 "depths")
+
+    def __init__(self, spectrum: np.ndarray, line_wavelengths: np.ndarray, window_starts: np.ndarray,
+                 window_ends: np.ndarray, nearest_pixels: np.ndarray, minimum_pixels: np.ndarray, depths: np.ndarray):
+        self.spectrum: np.ndarray = spectrum
+        self.line_wavelengths: np.ndarray = line_wavelengths
+        # pixels of the window of each line are spectrum[window_starts[i]:window_ends[i]] (can be empty)
+        self.window_starts: np.ndarray = window_starts
+        self.window_ends: np.ndarray = window_ends
+        # pixel with the wavelength closest to the line
+        self.nearest_pixels: np.ndarray = nearest_pixels
+        # local flux minimum closest to the line, -1 if there is none within the window
+        self.minimum_pixels: np.ndarray = minimum_pixels
+        # 1 - flux at the minimum (the spectrum is normalised), NaN if there is no minimum
+        self.depths: np.ndarray = depths
+
+    def __len__(self) -> int:
+        return len(self.line_wavelengths)
+
+    def __repr__(self) -> str:
+        return f"LineMatches({len(self)} lines, {int(np.count_nonzero(self.minimum_pixels >= 0))} with minimum)"
+
+    def window(self, line_index: int) -> np.ndarray:
+        """
+        :param line_index: Index of the line
+        :return: Pixels of the spectrum within the window of the line (view)
+        """
+        return self.spectrum[self.window_starts[line_index]:self.window_ends[line_index]]
+
+    def extract_windows(self, max_pixels: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        See extract_windows
+        """
+        return extract_windows(self.spectrum, self.window_starts, self.window_ends, max_pixels)
+
+
+def match_lines(lines, spectrum: np.ndarray, window_half_width: float) -> LineMatches:
+    """
+    Matches all lines against the spectrum at once
+    :param lines: LineTable or array of line wavelengths
+    :param spectrum: Spectrum as array of (wavelength, flux, ...) rows, sorted by wavelength
+    :param window_half_width: Half of the width of the window around each line, in the units of the wavelengths. The
+    nearest flux minimum must be within the window too
+    :return: Windows, nearest pixels, nearest minima and depths of the lines
+    """
+    line_wavelengths: np.ndarray = np.asarray(lines.wavelengths if isinstance(lines, LineTable) else lines,
+                                              dtype=np.float64)
+    wavelengths: np.ndarray = np.asarray(spectrum[:, 0], dtype=np.float64)
+    flux: np.ndarray = np.asarray(spectrum[:, 1], dtype=np.float64)
+    if len(wavelengths) == 0:
+        raise ValueError("The spectrum is empty")
+    if np.any(wavelengths[1:] < wavelengths[:-1]):
+        raise ValueError("The wavelengths of the spectrum must be sorted")
+    window_starts: np.ndarray = np.searchsorted(wavelengths, line_wavelengths - window_half_width, side="left")
+    window_ends: np.ndarray = np.searchsorted(wavelengths, line_wavelengths + window_half_width, side="right")
+    nearest_pixels: np.ndarray = find_nearest_indices(wavelengths, line_wavelengths)
+    minima: np.ndarray = find_local_minima(flux)
+    if len(minima) > 0:
+        minimum_pixels: np.ndarray = minima[find_nearest_indices(wavelengths[minima], line_wavelengths)]
+        # a minimum outside of the window belongs to another line
+        minimum_pixels[(minimum_pixels < window_starts) | (minimum_pixels >= window_ends)] = -1
+    else:
+        minimum_pixels: np.ndarray = np.full(len(line_wavelengths), -1, dtype=np.intp)
+    depths: np.ndarray = np.full(len(line_wavelengths), np.nan)
+    has_minimum: np.ndarray = minimum_pixels >= 0
+    depths[has_minimum] = 1 - flux[minimum_pixels[has_minimum]]
+    return LineMatches(spectrum, line_wavelengths, window_starts, window_ends, nearest_pixels, minimum_pixels, depths)
+
+
+def find_nearest_indices(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    :param sorted_values: Sorted array, not empty
+    :param values: Values to look for
+    :return: Index of the closest sorted value for each value (the left one if both are as close)
+    """
+    if len(sorted_values) == 1:
+        return np.zeros(len(values), dtype=np.intp)
+    right_indices: np.ndarray = np.clip(np.searchsorted(sorted_values, values), 1, len(sorted_values) - 1)
+    left_indices: np.ndarray = right_indices - 1
+    return np.where(values - sorted_values[left_indices] <= sorted_values[right_indices] - values, left_indices,
+                    right_indices)
+
+
+def find_local_minima(flux: np.ndarray) -> np.ndarray:
+    """
+    :param flux: Flux of the spectrum
+    :return: Indices of the pixels lower than the one before and not higher than the one after (the first pixel of a
+    flat bottom), without the first and last pixel
+    """
+    return np.flatnonzero((flux[1:-1] < flux[:-2]) & (flux[1:-1] <= flux[2:])) + 1
+
+
+def extract_windows(spectrum: np.ndarray, window_starts: np.ndarray, window_ends: np.ndarray,
+                    max_pixels: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cuts out all windows at once into 2D arrays, one row per window, so they can be fitted together
+    :param spectrum: Spectrum as array of (wavelength, flux, ...) rows
+    :param window_starts: First pixel of each window
+    :param window_ends: Pixel after the last one of each window
+    :param max_pixels: Number of columns. If None, then the length of the longest window, longer windows are cut
+    :return: Wavelengths and fluxes of the windows, padded with NaN after the end of each window
+    """
+    window_starts = np.asarray(window_starts, dtype=np.intp)
+    window_lengths: np.ndarray = np.asarray(window_ends, dtype=np.intp) - window_starts
+    if max_pixels is None:
+        max_pixels = int(np.max(window_lengths)) if len(window_lengths) > 0 else 0
+    pixel_indices: np.ndarray = window_starts[:, None] + np.arange(max_pixels)
+    in_window: np.ndarray = np.arange(max_pixels) < window_lengths[:, None]
+    pixel_indices = np.where(in_window, pixel_indices, 0)
+    window_wavelengths: np.ndarray = np.where(in_window, np.asarray(spectrum[:, 0], dtype=np.float64)[pixel_indices],
+                                              np.nan)
+    window_flux: np.ndarray = np.where(in_window, np.asarray(spectrum[:, 1], dtype=np.float64)[pixel_indices], np.nan)
+    return window_wavelengths, window_flux
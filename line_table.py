@@ -0,0 +1,343 @@
+"""
+Columnar table of spectral lines, used instead of the list of (wavelength, element name, loggf) tuples when the
+linelist has millions of lines
+"""
+import re
+import numpy as np
+from linelist_writer import LinelistElement
+
+
+class LineTable:
+    """
+    Lines as separate numpy arrays: wavelength (float64), loggf (float32), species code (int16) and ionization (int8).
+    The species code is the index of the element name in species_names, which is shared between a table and all tables
+    made from it. Slicing with table[start:end] gives views of the arrays, not copies.
+    """
+    def __init__(self, wavelengths: np.ndarray, loggf: np.ndarray, species_codes: np.ndarray, ionization: np.ndarray,
+                 species_names: list[str], species_lookup: dict = None):
+        self.wavelengths: np.ndarray = wavelengths
+        self.loggf: np.ndarray = loggf
+        self.species_codes: np.ndarray = species_codes
+        self.ionization: np.ndarray = ionization
+        # element names as read_element_data gives them, e.g. 'Fe I    '
+        self.species_names: list[str] = species_names
+        # normalized element name (e.g. 'Fe I'): species codes with that name. Made once per species, not per line
+        if species_lookup is None:
+            species_lookup = build_species_lookup(species_names)
+        self.species_lookup: dict = species_lookup
+        # made on the first use of get_species_index
+        self.species_index = None
+
+    def __len__(self) -> int:
+        return len(self.wavelengths)
+
+    def __getitem__(self, item):
+        """
+        Slices, index arrays and boolean masks give a new LineTable (slices without copying), an integer gives
+        (wavelength, element name, loggf) like the tuples of read_element_data
+        """
+        if isinstance(item, (int, np.integer)):
+            return float(self.wavelengths[item]), self.species_names[self.species_codes[item]], \
+                   float(str(self.loggf[item]))
+        return LineTable(self.wavelengths[item], self.loggf[item], self.species_codes[item], self.ionization[item],
+                         self.species_names, self.species_lookup)
+
+    def __iter__(self):
+        for wavelength, element_name, loggf in self.to_list():
+            yield wavelength, element_name, loggf
+
+    def __repr__(self) -> str:
+        return f"LineTable({len(self)} lines, {len(self.species_names)} species)"
+
+    def element_names(self) -> np.ndarray:
+        """
+        :return: Element name of each line
+        """
+        return np.asarray(self.species_names, dtype=object)[self.species_codes]
+
+    def get_species_index(self):
+        """
+        :return: SpeciesIndex of this table, made once and then kept
+        """
+        if self.species_index is None:
+            self.species_index = SpeciesIndex(self)
+        return self.species_index
+
+    def sort_by_wavelength(self):
+        """
+        :return: New table sorted by wavelength (lines with the same wavelength keep their order)
+        """
+        return self[np.argsort(self.wavelengths, kind="stable")]
+
+    def to_list(self) -> list[list]:
+        """
+        Same as the output of find_elements: list of [wavelength, element name, loggf]
+        """
+        # float32 as string gives the shortest representation, e.g. -1.234 instead of -1.2339999675750732
+        loggf_values: list[float] = self.loggf.astype(str).astype(np.float64).tolist()
+        return [[wavelength, self.species_names[species_code], loggf] for wavelength, species_code, loggf
+                in zip(self.wavelengths.tolist(), self.species_codes.tolist(), loggf_values)]
+
+
+def read_line_table(lines) -> LineTable:
+    """
+    Same as read_element_data, but gives a LineTable. Each line is split only once.
+    :param lines: Lines of the linelist (like for read_element_data) or list of LinelistElement from
+    trim_and_combine_linelists
+    :return: Table with all lines
+    """
+    wavelengths: list[float] = []
+    loggf: list[float] = []
+    species_codes: list[int] = []
+    ionization: list[int] = []
+    species_names: list[str] = []
+    species_name_codes: dict = {}
+    for element_header, element_name_line, data_lines in iter_elements(lines):
+        element_name = element_name_line.strip().replace("'", "").replace("NLTE", "").replace("LTE", "")
+        if element_name not in species_name_codes:
+            species_name_codes[element_name] = len(species_names)
+            species_names.append(element_name)
+        number_of_lines: int = len(data_lines)
+        species_codes.extend([species_name_codes[element_name]] * number_of_lines)
+        ionization.extend([int(element_header.split()[-2])] * number_of_lines)
+        for data_line in data_lines:
+            data_fields: list[str] = data_line.split(None, 3)
+            wavelengths.append(float(data_fields[0]))
+            loggf.append(float(data_fields[2]))
+    return LineTable(np.asarray(wavelengths, dtype=np.float64), np.asarray(loggf, dtype=np.float32),
+                     np.asarray(species_codes, dtype=np.int16), np.asarray(ionization, dtype=np.int8), species_names)
+
+
+def iter_elements(lines):
+    """
+    Goes through the elements of the linelist
+    :param lines: Lines of the linelist or list of LinelistElement
+    :return: Yields first line of the element, second line of the element and the lines of the element
+    """
+    if lines and isinstance(lines[0], LinelistElement):
+        for linelist_element in lines:
+            yield linelist_element.elem_line_1, linelist_element.elem_line_2, linelist_element.lines
+        return
+    i = 0
+    while i < len(lines):
+        if not lines[i].strip():
+            i += 1
+            continue
+        num_lines = int(lines[i].split()[-1])
+        yield lines[i], lines[i + 1], lines[i + 2:i + 2 + num_lines]
+        i += 2 + num_lines
+
+
+def find_elements_in_table(line_table: LineTable, left_wavelength: float, right_wavelength: float,
+                           loggf_threshold: float) -> LineTable:
+    """
+    Same as find_elements, but for a LineTable
+    :param line_table: Table with the lines
+    :param left_wavelength: Minimum wavelength
+    :param right_wavelength: Maximum wavelength
+    :param loggf_threshold: Minimum loggf
+    :return: Table with the lines within the wavelengths and with loggf >= loggf_threshold, sorted by wavelength
+    """
+    # loggf is float32, so the threshold must be float32 too (otherwise e.g. -0.1 would not pass -0.1)
+    line_mask: np.ndarray = (line_table.wavelengths >= left_wavelength) & (line_table.wavelengths <= right_wavelength) & \
+                            (line_table.loggf >= np.float32(loggf_threshold))
+    return line_table[line_mask].sort_by_wavelength()
+
+
+def find_element_in_table(line_table: LineTable, element_name: str) -> LineTable:
+    """
+    Same as find_element, but for a LineTable. The element names are compared once per species instead of once per line
+    :param line_table: Table with the lines
+    :param element_name: Element name like 'Fe II'
+    :return: Table with the lines of the element
+    """
+    return line_table.get_species_index().find(species=element_name)
+
+
+class SpeciesIndex:
+    """
+    Rows of the table grouped by species, so that the lines of a species are found without looking at any other line.
+    rows_by_species holds the rows of species 0, then of species 1 and so on (each in the order of the table), and
+    species_offsets tells where each species starts.
+    """
+    def __init__(self, line_table: LineTable):
+        self.line_table: LineTable = line_table
+        self.rows_by_species: np.ndarray = np.argsort(line_table.species_codes, kind="stable")
+        self.species_offsets: np.ndarray = np.concatenate(
+            ([0], np.cumsum(np.bincount(line_table.species_codes, minlength=len(line_table.species_names)))))
+        # element symbol (e.g. 'Fe' for 'Fe II'): species codes of that element
+        self.element_lookup: dict = {}
+        for species_name, species_codes in line_table.species_lookup.items():
+            element_symbol: str = species_name.split(" ", 1)[0]
+            self.element_lookup[element_symbol] = self.element_lookup.get(element_symbol, []) + species_codes
+
+    def species_rows(self, species_code: int) -> np.ndarray:
+        """
+        :param species_code: Species code
+        :return: Rows of the species (view)
+        """
+        return self.rows_by_species[self.species_offsets[species_code]:self.species_offsets[species_code + 1]]
+
+    def get_species_codes(self, species=None, element=None) -> list[int]:
+        """
+        :param species: Element name like 'Fe II' or species code, or list of them
+        :param element: Element symbol like 'Fe' (all its ionization stages), or list of them
+        :return: Species codes, each once
+        """
+        species_codes: list[int] = []
+        for one_species in as_list(species):
+            if isinstance(one_species, str):
+                species_codes.extend(self.line_table.species_lookup.get(normalize_species_name(one_species), []))
+            else:
+                species_codes.append(int(one_species))
+        for element_symbol in as_list(element):
+            species_codes.extend(self.element_lookup.get(element_symbol.strip(), []))
+        return sorted(set(species_codes))
+
+    def find_rows(self, species=None, element=None, ionization=None) -> np.ndarray:
+        """
+        Rows of the lines of the given species/elements, in the order of the table
+        :param species: Element name like 'Fe II' or species code, or list of them
+        :param element: Element symbol like 'Fe' (all its ionization stages), or list of them
+        :param ionization: If not None, then only lines with this ionization (or one of the list) are kept
+        :return: Rows of the lines
+        """
+        species_codes: list[int] = self.get_species_codes(species, element)
+        if len(species_codes) == 1:
+            rows: np.ndarray = self.species_rows(species_codes[0])
+        else:
+            # only the rows of the wanted species are sorted, not the whole table
+            rows: np.ndarray = np.sort(np.concatenate([self.species_rows(species_code) for species_code in species_codes]
+                                                      + [np.empty(0, dtype=self.rows_by_species.dtype)]))
+        if ionization is not None:
+            rows = rows[np.isin(self.line_table.ionization[rows], as_list(ionization))]
+        return rows
+
+    def find(self, species=None, element=None, ionization=None) -> LineTable:
+        """
+        Same as find_rows, but gives the table with the lines
+        """
+        return self.line_table[self.find_rows(species, element, ionization)]
+
+
+def build_species_lookup(species_names: list[str]) -> dict:
+    """
+    :param species_names: Element names of the species codes
+    :return: Dictionary normalized element name: list of species codes
+    """
+    species_lookup: dict = {}
+    for species_code, species_name in enumerate(species_names):
+        species_lookup.setdefault(normalize_species_name(species_name), []).append(species_code)
+    return species_lookup
+
+
+def as_list(values) -> list:
+    """
+    :param values: None, one value or list of values
+    :return: List of the values
+    """
+    if values is None:
+        return []
+    if isinstance(values, (str, int, np.integer)):
+        return [values]
+    return list(values)
+
+
+class LineQuery:
+    """
+    Lines sorted by wavelength once, so that each window is found with np.searchsorted instead of going through all
+    lines. Optionally keeps the lines of each species separately, so that queries for one species only look at its lines.
+    """
+    def __init__(self, line_table: LineTable, species_index: bool = True):
+        """
+        :param line_table: Table with the lines, does not need to be sorted
+        :param species_index: If True, then the rows of each species are indexed too (needed for strongest_lines)
+        """
+        self.line_table: LineTable = line_table.sort_by_wavelength()
+        # rows of each species of the sorted table (so sorted by wavelength as well)
+        self.species_index: SpeciesIndex = self.line_table.get_species_index() if species_index else None
+
+    def window_bounds(self, left_wavelengths, right_wavelengths) -> tuple[np.ndarray, np.ndarray]:
+        """
+        First row and row after the last one of each window (left <= wavelength <= right)
+        :param left_wavelengths: Minimum wavelength of each window (or one value)
+        :param right_wavelengths: Maximum wavelength of each window (or one value)
+        :return: Rows where the windows start and end
+        """
+        return np.searchsorted(self.line_table.wavelengths, left_wavelengths, side="left"), \
+               np.searchsorted(self.line_table.wavelengths, right_wavelengths, side="right")
+
+    def query(self, left_wavelength: float, right_wavelength: float, loggf_threshold: float) -> LineTable:
+        """
+        Same as find_elements_in_table
+        :param left_wavelength: Minimum wavelength
+        :param right_wavelength: Maximum wavelength
+        :param loggf_threshold: Minimum loggf
+        :return: Table with the lines within the window and with loggf >= loggf_threshold, sorted by wavelength
+        """
+        row_start, row_end = self.window_bounds(left_wavelength, right_wavelength)
+        lines_in_window: LineTable = self.line_table[int(row_start):int(row_end)]
+        return lines_in_window[lines_in_window.loggf >= np.float32(loggf_threshold)]
+
+    def query_windows(self, left_wavelengths: np.ndarray, right_wavelengths: np.ndarray,
+                      loggf_threshold) -> list[LineTable]:
+        """
+        Same as query, but for many windows at once
+        :param left_wavelengths: Minimum wavelength of each window
+        :param right_wavelengths: Maximum wavelength of each window
+        :param loggf_threshold: Minimum loggf, one value or one per window
+        :return: Table for each window
+        """
+        row_starts, row_ends = self.window_bounds(left_wavelengths, right_wavelengths)
+        loggf_thresholds: np.ndarray = np.broadcast_to(np.asarray(loggf_threshold, dtype=np.float32), row_starts.shape)
+        lines_in_windows: list[LineTable] = []
+        for row_start, row_end, window_threshold in zip(row_starts.tolist(), row_ends.tolist(), loggf_thresholds):
+            lines_in_window: LineTable = self.line_table[row_start:row_end]
+            lines_in_windows.append(lines_in_window[lines_in_window.loggf >= window_threshold])
+        return lines_in_windows
+
+    def count_windows(self, left_wavelengths: np.ndarray, right_wavelengths: np.ndarray,
+                      loggf_threshold: float) -> np.ndarray:
+        """
+        Number of lines with loggf >= loggf_threshold in each window, without making the tables
+        :param left_wavelengths: Minimum wavelength of each window
+        :param right_wavelengths: Maximum wavelength of each window
+        :param loggf_threshold: Minimum loggf
+        :return: Number of lines in each window
+        """
+        row_starts, row_ends = self.window_bounds(left_wavelengths, right_wavelengths)
+        strong_lines_before: np.ndarray = np.concatenate(
+            ([0], np.cumsum(self.line_table.loggf >= np.float32(loggf_threshold))))
+        return strong_lines_before[row_ends] - strong_lines_before[row_starts]
+
+    def strongest_lines(self, species, left_wavelength: float, right_wavelength: float,
+                        number_of_lines: int) -> LineTable:
+        """
+        The number_of_lines lines of the species with the largest loggf within the window. Only the lines of the species
+        are looked at.
+        :param species: Species code or element name like 'Fe II', or list of them
+        :param left_wavelength: Minimum wavelength
+        :param right_wavelength: Maximum wavelength
+        :param number_of_lines: How many lines to give at most
+        :return: Table with the lines, strongest first
+        """
+        if self.species_index is None:
+            raise ValueError("LineQuery was created without species_index")
+        species_rows: np.ndarray = self.species_index.find_rows(species)
+        species_wavelengths: np.ndarray = self.line_table.wavelengths[species_rows]
+        rows_in_window: np.ndarray = species_rows[np.searchsorted(species_wavelengths, left_wavelength, side="left"):
+                                                  np.searchsorted(species_wavelengths, right_wavelength, side="right")]
+        loggf_in_window: np.ndarray = self.line_table.loggf[rows_in_window]
+        if len(rows_in_window) > number_of_lines:
+            strongest: np.ndarray = np.argpartition(-loggf_in_window, number_of_lines - 1)[:number_of_lines]
+            rows_in_window, loggf_in_window = rows_in_window[strongest], loggf_in_window[strongest]
+        return self.line_table[rows_in_window[np.argsort(-loggf_in_window, kind="stable")]]
+
+
+def normalize_species_name(species_name: str) -> str:
+    """
+    Element name as find_element compares it, e.g. 'Fe  II  ' -> 'Fe II'
+    :param species_name: Element name
+    :return: Element name without repeated and trailing spaces
+    """
+    return re.sub(r'\s+', ' ', species_name.strip())
@@ -0,0 +1,159 @@
+"""
+Binary form of a linelist folder: the lines of each linelist kept as one blob of text together with columns of
+wavelengths, loggf and positions of the lines in the blob. The trimmer and read_line_table use the columns, so the
+text is never parsed again, and only the text of the selected lines is copied into the new linelists. The blobs are the
+linelist files byte for byte, so converting back gives exactly the same files for Turbospectrum.
+
+Layout of the binary folder:
+    /binary_path_name/{linelist}                                          text of the linelist
+    /binary_path_name/.linelist_index/{linelist}.json                     element headers and block positions
+    /binary_path_name/.linelist_index/{linelist}.wavelengths.npy          wavelength of each line
+    /binary_path_name/.linelist_index/{linelist}.offsets.npy              position of each line in the text
+    /binary_path_name/.linelist_index/{linelist}.loggf.npy                loggf of each line
+    /binary_path_name/.linelist_index/linelist_order.json                 linelists in the order of the old folder
+The columns are the same as the sidecar index of the 'index' reader, so the binary folder can be given to
+create_window_linelist as old_path_name with any reader, and 'index' never reads the text except for the new lines.
+
+The binary folder is not smaller than the linelists: it is the whole text plus 20 bytes per line of columns (float64
+wavelength, int64 offset, float32 loggf), roughly a fifth more than the text for the usual 100 byte lines. That space
+buys trimming and reading the line table without parsing. loggf is kept as float32, the same as in LineTable.
+"""
+import os
+import json
+import shutil
+import numpy as np
+from file_utils import atomic_write
+from linelist_index import DEFAULT_INDEX_DIR_NAME, LINELIST_ORDER_FILE_NAME, INDEX_VERSION, LinelistIndex, \
+    build_linelist_index, save_linelist_index, load_linelist_index, get_index_paths
+from line_table import LineTable
+from trimmer import get_linelist_files
+
+
+def get_loggf_path(linelist_path: str) -> str:
+    """
+    :param linelist_path: Path to the text of the linelist in the binary folder
+    :return: Path of its loggf column
+    """
+    return get_index_paths(linelist_path)[0][:-len(".json")] + ".loggf.npy"
+
+
+def read_loggf_column(linelist_index: LinelistIndex) -> np.ndarray:
+    """
+    Parses the loggf (third column) of all lines, found through the positions in the index
+    :param linelist_index: Index of the linelist
+    :return: loggf of each line as float32, in the order of the index
+    """
+    with open(linelist_index.linelist_path, "rb") as linelist_file:
+        text: bytes = linelist_file.read()
+    loggf: np.ndarray = np.empty(len(linelist_index.wavelengths), dtype=np.float32)
+    for block_index in range(linelist_index.number_of_blocks):
+        block_start: int = int(linelist_index.block_line_starts[block_index])
+        block_end: int = int(linelist_index.block_line_starts[block_index + 1])
+        line_ends: list[int] = linelist_index.line_offsets[block_start + 1:block_end].tolist() + \
+            [int(linelist_index.block_end_offsets[block_index])]
+        for line_index, (line_start, line_end) in enumerate(zip(linelist_index.line_offsets[block_start:block_end].tolist(),
+                                                                line_ends)):
+            loggf[block_start + line_index] = float(text[line_start:line_end].split(None, 3)[2])
+    return loggf
+
+
+def convert_linelists_to_binary(old_path_name: str, binary_path_name: str) -> list[str]:
+    """
+    Converts all linelists of the folder into the binary folder. Files that are not linelists (empty or not text) are
+    kept as they are, without columns, so that converting back still gives all files. The binary folder takes more
+    space than the old one, see the module docstring.
+    :param old_path_name: Path to the folder with the linelists
+    :param binary_path_name: Path to the new binary folder
+    :return: Paths to the linelists in the binary folder
+    """
+    os.makedirs(os.path.join(binary_path_name, DEFAULT_INDEX_DIR_NAME), exist_ok=True)
+    binary_linelist_paths: list[str] = []
+    for line_list_file in get_linelist_files(old_path_name):
+        binary_linelist_path: str = os.path.join(binary_path_name, os.path.basename(line_list_file))
+        shutil.copyfile(line_list_file, binary_linelist_path)
+        binary_linelist_paths.append(binary_linelist_path)
+        stat_result = os.stat(binary_linelist_path)
+        try:
+            linelist_index: LinelistIndex = build_linelist_index(binary_linelist_path)
+            loggf: np.ndarray = read_loggf_column(linelist_index)
+        except (UnicodeDecodeError, ValueError, IndexError):
+            print(f"LINELIST WARNING! File {line_list_file} is not a valid linelist file, it is copied without columns")
+            continue
+        save_linelist_index(linelist_index, stat_result=stat_result)
+        with atomic_write(get_loggf_path(binary_linelist_path), "wb") as loggf_file:
+            np.save(loggf_file, loggf)
+    # the order goes last, because it is what makes the folder a binary folder
+    with atomic_write(os.path.join(binary_path_name, DEFAULT_INDEX_DIR_NAME, LINELIST_ORDER_FILE_NAME)) as order_file:
+        json.dump({"version": INDEX_VERSION,
+                   "files": [os.path.basename(binary_linelist_path) for binary_linelist_path in binary_linelist_paths]},
+                  order_file)
+    return binary_linelist_paths
+
+
+def convert_binary_to_linelists(binary_path_name: str, new_path_name: str) -> list[str]:
+    """
+    Writes the linelists of the binary folder back as text, byte for byte the same as the converted ones
+    :param binary_path_name: Path to the binary folder
+    :param new_path_name: Path to the folder where the linelists will be saved
+    :return: Paths to the new linelists
+    """
+    os.makedirs(new_path_name, exist_ok=True)
+    new_linelist_paths: list[str] = []
+    for binary_linelist_path in get_linelist_files(binary_path_name):
+        new_linelist_paths.append(os.path.join(new_path_name, os.path.basename(binary_linelist_path)))
+        shutil.copyfile(binary_linelist_path, new_linelist_paths[-1])
+    return new_linelist_paths
+
+
+def read_binary_line_table(binary_path_name: str, molecules_flag: bool = True, do_hydrogen: bool = True,
+                           mmap_mode: str = "r") -> LineTable:
+    """
+    Same as read_line_table of all linelists of the binary folder, but from the columns, without parsing any text
+    :param binary_path_name: Path to the binary folder
+    :param molecules_flag: If False, then the molecules are left out
+    :param do_hydrogen: If False, then hydrogen is left out
+    :param mmap_mode: Passed to np.load for the columns
+    :return: Table with all lines, in the order of the linelists
+    """
+    wavelengths: list[np.ndarray] = []
+    loggf: list[np.ndarray] = []
+    species_codes: list[np.ndarray] = []
+    ionization: list[np.ndarray] = []
+    species_names: list[str] = []
+    species_name_codes: dict = {}
+    for binary_linelist_path in get_linelist_files(binary_path_name):
+        if not os.path.isfile(get_loggf_path(binary_linelist_path)):
+            # not a linelist, see convert_linelists_to_binary
+            continue
+        linelist_index: LinelistIndex = load_linelist_index(binary_linelist_path, mmap_mode=mmap_mode)
+        if linelist_index.number_of_blocks == 0:
+            continue
+        # same as the trimmer decides from the first line of the file
+        header_fields: list[str] = linelist_index.element_lines_1[0].split()
+        element: str = header_fields[0] + header_fields[1]
+        if len(element.split(".", 1)[0]) > 3 and not molecules_flag:
+            continue
+        if element == "'01.000000'" and not do_hydrogen:
+            continue
+        linelist_loggf: np.ndarray = np.load(get_loggf_path(binary_linelist_path), mmap_mode=mmap_mode)
+        if len(linelist_loggf) != len(linelist_index.wavelengths):
+            raise ValueError(f"Columns of {binary_linelist_path} do not match, convert the linelists again")
+        block_codes: list[int] = []
+        for elem_line_2 in linelist_index.element_lines_2:
+            element_name = elem_line_2.strip().replace("'", "").replace("NLTE", "").replace("LTE", "")
+            if element_name not in species_name_codes:
+                species_name_codes[element_name] = len(species_names)
+                species_names.append(element_name)
+            block_codes.append(species_name_codes[element_name])
+        lines_per_block: np.ndarray = np.diff(linelist_index.block_line_starts)
+        wavelengths.append(np.asarray(linelist_index.wavelengths, dtype=np.float64))
+        loggf.append(np.asarray(linelist_loggf, dtype=np.float32))
+        species_codes.append(np.repeat(np.asarray(block_codes, dtype=np.int16), lines_per_block))
+        ionization.append(np.repeat(np.asarray([int(elem_line_1.split()[-1])
+                                                for elem_line_1 in linelist_index.element_lines_1], dtype=np.int8),
+                                    lines_per_block))
+    if not wavelengths:
+        return LineTable(np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int16),
+                         np.empty(0, dtype=np.int8), species_names)
+    return LineTable(np.concatenate(wavelengths), np.concatenate(loggf), np.concatenate(species_codes),
+                     np.concatenate(ionization), species_names)
@@ -0,0 +1,293 @@
+"""
+Cache of trimmed linelists. The same (or narrower) windows of the same linelist folder are asked for again and again
+when fitting, so the trimmed linelists are kept and given out again instead of trimming the whole linelist every time
+"""
+import os
+import json
+import shutil
+import mmap
+import hashlib
+import numpy as np
+from file_utils import get_temporary_path
+from linelist_mmap import iter_mmap_blocks, find_line_start, get_wavelength_at
+from linelist_writer import LinelistWriter, link_or_copy
+from trimmer import create_window_linelist, trim_linelist_file, get_linelist_files, sort_segments
+
+# name of the file in each cached entry that describes it
+CACHE_META_FILE_NAME: str = "meta.json"
+# bump if the layout of the cache changes, old entries are then never used
+CACHE_VERSION: int = 1
+
+
+class SegmentFolderWriter(LinelistWriter):
+    """
+    LinelistWriter that writes everything into one folder, whatever segment index it is given. Used to trim one segment
+    of a cached linelist into its own segment folder.
+    """
+    def get_linelist_name(self, key: int) -> str:
+        return os.path.join(f"{self.new_path_name}", f"linelist-{self.line_list_number}.bsyn")
+
+
+class TrimmedLinelistCache:
+    """
+    Trimmed linelists saved in cache_dir, one folder per (linelist folder snapshot, segments, flags). A snapshot is
+    the names, sizes and modification times of the linelist files, so the cache is not used once any linelist changes.
+    If the cache gets larger than max_bytes, then the least recently used entries are removed.
+
+    Requests that were trimmed before are linked (or copied) from the cache. Requests whose segments all lie within the
+    segments of a cached entry are trimmed from that entry, which is much smaller than the whole linelist. The new
+    linelists are hard links to the cache where possible, so they should be removed or replaced, not changed in place
+    (combine_linelists is fine).
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 10 * 1024 * 1024 * 1024):
+        """
+        :param cache_dir: Folder where the trimmed linelists are saved
+        :param max_bytes: Maximum size of the cache
+        """
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+
+    def create_window_linelist(self, seg_begins: np.ndarray[float], seg_ends: np.ndarray[float], old_path_name: str,
+                               new_path_name: str, molecules_flag: bool, lbl=False, do_hydrogen=True, **trim_kwargs):
+        """
+        Same as trimmer.create_window_linelist, but uses the cache
+        :param trim_kwargs: Other arguments of trimmer.create_window_linelist, used only if the linelist is trimmed
+        :return: 'hit' if the trimmed linelist was in the cache, 'subset' if it was trimmed from a cached one, 'miss' if
+        it was trimmed from the old linelist
+        """
+        segment_to_use_begins, segment_to_use_ends = sort_segments(seg_begins, seg_ends)
+        snapshot_key: str = get_linelist_snapshot_key(old_path_name)
+        meta: dict = {"version": CACHE_VERSION, "snapshot_key": snapshot_key,
+                      "segment_begins": [float(seg_begin) for seg_begin in segment_to_use_begins],
+                      "segment_ends": [float(seg_end) for seg_end in segment_to_use_ends],
+                      "molecules_flag": bool(molecules_flag), "lbl": bool(lbl), "do_hydrogen": bool(do_hydrogen)}
+        entry_key: str = hashlib.sha1(json.dumps(meta, sort_keys=True).encode()).hexdigest()
+        entry_path: str = os.path.join(self.cache_dir, entry_key)
+        if os.path.isfile(os.path.join(entry_path, CACHE_META_FILE_NAME)):
+            self.touch_entry(entry_path)
+            link_tree(entry_path, new_path_name)
+            return "hit"
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # the entry is complete once its folder is renamed, see file_utils.atomic_write
+        temporary_entry_path: str = get_temporary_path(entry_path)
+        shutil.rmtree(temporary_entry_path, ignore_errors=True)
+        superset_entry_path: str = self.find_superset_entry(meta)
+        if superset_entry_path is not None:
+            self.touch_entry(superset_entry_path)
+            trim_cached_linelist(superset_entry_path, segment_to_use_begins, segment_to_use_ends,
+                                 temporary_entry_path, molecules_flag, lbl, do_hydrogen)
+            result: str = "subset"
+        else:
+            create_window_linelist(segment_to_use_begins, segment_to_use_ends, old_path_name, temporary_entry_path,
+                                   molecules_flag, lbl, do_hydrogen, **trim_kwargs)
+            result: str = "miss"
+        meta["size"] = get_tree_size(temporary_entry_path)
+        with open(os.path.join(temporary_entry_path, CACHE_META_FILE_NAME), "w") as meta_file:
+            json.dump(meta, meta_file)
+        try:
+            os.rename(temporary_entry_path, entry_path)
+        except OSError:
+            # another process saved the same entry meanwhile
+            shutil.rmtree(temporary_entry_path, ignore_errors=True)
+        link_tree(entry_path, new_path_name)
+        self.evict()
+        return result
+
+    def iter_entries(self):
+        """
+        :return: Yields path and metadata of all entries in the cache
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.endswith(".tmp"):
+                continue
+            try:
+                with open(os.path.join(entry.path, CACHE_META_FILE_NAME)) as meta_file:
+                    yield entry.path, json.load(meta_file)
+            except (OSError, ValueError):
+                continue
+
+    def find_superset_entry(self, meta: dict) -> str:
+        """
+        Finds the smallest cached entry of the same linelist snapshot, from which the requested linelist can be trimmed:
+        each requested segment must be within one cached segment. The cached segments must not overlap (otherwise
+        lines would be repeated in the cached elements) and the cached entry must not have left out anything that is
+        requested (molecules, or hydrogen trimmed differently). No requested segment may begin at the last wavelength
+        of a cached element, see begins_at_block_ends.
+        :param meta: Metadata of the requested entry
+        :return: Path to the cached entry or None
+        """
+        candidate_entries: list = []
+        for entry_path, entry_meta in self.iter_entries():
+            if entry_meta.get("version") != CACHE_VERSION or entry_meta["snapshot_key"] != meta["snapshot_key"] or \
+                    entry_meta["do_hydrogen"] != meta["do_hydrogen"] or \
+                    (meta["molecules_flag"] and not entry_meta["molecules_flag"]) or \
+                    (entry_meta["lbl"] and not meta["lbl"]):
+                # one combined element cannot be put together from elements of separate segments
+                continue
+            cached_begins: np.ndarray = np.asarray(entry_meta["segment_begins"])
+            cached_ends: np.ndarray = np.asarray(entry_meta["segment_ends"])
+            if np.any(cached_ends[:-1] >= cached_begins[1:]):
+                continue
+            source_segments: np.ndarray = find_containing_segments(meta["segment_begins"], meta["segment_ends"],
+                                                                   cached_begins, cached_ends)
+            if source_segments is None:
+                continue
+            candidate_entries.append((entry_meta["size"], entry_path,
+                                      source_segments if entry_meta["lbl"] else np.zeros_like(source_segments)))
+        # the elements of the cached linelists are only read for the entries that fit otherwise, smallest first
+        for _, entry_path, source_segments in sorted(candidate_entries, key=lambda candidate: candidate[:2]):
+            if not begins_at_block_ends(entry_path, meta["segment_begins"], source_segments):
+                return entry_path
+        return None
+
+    def touch_entry(self, entry_path: str):
+        # the modification time of the metadata is the last use of the entry
+        try:
+            os.utime(os.path.join(entry_path, CACHE_META_FILE_NAME))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is not larger than max_bytes
+        """
+        entries: list = []
+        for entry_path, entry_meta in self.iter_entries():
+            try:
+                last_used: float = os.stat(os.path.join(entry_path, CACHE_META_FILE_NAME)).st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, entry_meta.get("size", 0), entry_path))
+        entries.sort()
+        total_size: int = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        for entry_path, _ in self.iter_entries():
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def get_linelist_snapshot_key(old_path_name: str) -> str:
+    """
+    Key that changes whenever a linelist file of the folder is added, removed or changed
+    :param old_path_name: Path to the folder with the linelists
+    :return: Hash of the names, sizes and modification times of the linelist files
+    """
+    snapshot: list = [os.path.abspath(old_path_name)]
+    for line_list_file in sorted(get_linelist_files(old_path_name)):
+        stat_result = os.stat(line_list_file)
+        snapshot.append((os.path.basename(line_list_file), stat_result.st_size, stat_result.st_mtime_ns))
+    return hashlib.sha1(json.dumps(snapshot).encode()).hexdigest()
+
+
+def find_containing_segments(seg_begins: list[float], seg_ends: list[float], cached_begins: np.ndarray,
+                             cached_ends: np.ndarray) -> np.ndarray:
+    """
+    :param seg_begins: Requested segment beginnings
+    :param seg_ends: Requested segment ends
+    :param cached_begins: Sorted, not overlapping cached segment beginnings
+    :param cached_ends: Cached segment ends
+    :return: Index of the cached segment that contains each requested segment, or None if any is not contained
+    """
+    containing_segments: np.ndarray = np.searchsorted(cached_begins, seg_begins, side="right") - 1
+    if np.any(containing_segments < 0):
+        return None
+    if np.any(np.asarray(seg_ends) > cached_ends[containing_segments]):
+        return None
+    return containing_segments
+
+
+def begins_at_block_ends(entry_path: str, seg_begins: list[float], source_segments: np.ndarray) -> bool:
+    """
+    Whether any requested segment begins exactly at the last wavelength of an element of the cached linelists it would
+    be trimmed from. If a segment begins at or after the last line of an element, then the trimmer keeps only that
+    last line (see find_segment_indices). A cached element can end before the element of the old linelist does, so
+    its last line is not always the last line of the old element, and trimming from the cache would then leave out the
+    other lines with the same wavelength. Segments that begin after the last line get nothing either way.
+    :param entry_path: Path to the cached entry
+    :param seg_begins: Requested segment beginnings
+    :param source_segments: Cached segment folder that each requested segment would be trimmed from
+    :return: True if the requested linelist must be trimmed from the old linelist instead
+    """
+    for source_segment in np.unique(source_segments).tolist():
+        folder_begins: set[float] = {float(seg_begin) for seg_begin, segment in zip(seg_begins, source_segments)
+                                     if segment == source_segment}
+        source_folder: str = os.path.join(entry_path, f"{source_segment}")
+        for file_name in os.listdir(source_folder):
+            linelist_path: str = os.path.join(source_folder, file_name)
+            if os.path.getsize(linelist_path) == 0:
+                continue
+            with open(linelist_path, "rb") as linelist_file, \
+                    mmap.mmap(linelist_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                for _, _, data_start, data_end in iter_mmap_blocks(mapped_file):
+                    if data_end > data_start and get_wavelength_at(
+                            mapped_file, find_line_start(mapped_file, data_end - 1, data_start), data_end) in \
+                            folder_begins:
+                        return True
+    return False
+
+
+def trim_cached_linelist(entry_path: str, segment_to_use_begins: np.ndarray, segment_to_use_ends: np.ndarray,
+                         new_path_name: str, molecules_flag: bool, lbl: bool, do_hydrogen: bool):
+    """
+    Trims the cached linelist the same way as the old linelist would be trimmed. The names of the new linelists are
+    the same as in the cached one, so they are the same as if the old linelist was trimmed.
+    :param entry_path: Path to the cached entry
+    :param segment_to_use_begins: Sorted array of segment beginnings, each within one cached segment
+    :param segment_to_use_ends: Array of segment ends, in the same order as segment_to_use_begins
+    :param new_path_name: Path to the folder where the new linelists will be saved
+    """
+    with open(os.path.join(entry_path, CACHE_META_FILE_NAME)) as meta_file:
+        entry_meta: dict = json.load(meta_file)
+    if entry_meta["lbl"]:
+        source_segments: np.ndarray = find_containing_segments(segment_to_use_begins, segment_to_use_ends,
+                                                               np.asarray(entry_meta["segment_begins"]),
+                                                               np.asarray(entry_meta["segment_ends"]))
+    else:
+        source_segments: np.ndarray = np.zeros(len(segment_to_use_begins), dtype=int)
+    if lbl:
+        # each segment is trimmed from the folder of the cached segment that contains it
+        trim_jobs: list = [(source_segments[seg_index], segment_to_use_begins[seg_index:seg_index + 1],
+                            segment_to_use_ends[seg_index:seg_index + 1], seg_index)
+                           for seg_index in range(len(segment_to_use_begins))]
+    else:
+        trim_jobs: list = [(0, segment_to_use_begins, segment_to_use_ends, 0)]
+    for source_segment, begins, ends, seg_index in trim_jobs:
+        source_folder: str = os.path.join(entry_path, f"{source_segment}")
+        new_folder: str = os.path.join(new_path_name, f"{seg_index}")
+        os.makedirs(new_folder)
+        for file_name in sorted(os.listdir(source_folder)):
+            # linelist-{line_list_number}.bsyn
+            line_list_number: int = int(file_name[len("linelist-"):-len(".bsyn")])
+            trim_linelist_file(os.path.join(source_folder, file_name), line_list_number, begins, ends, "",
+                               molecules_flag, False, do_hydrogen, "mmap",
+                               linelist_writer=SegmentFolderWriter(new_folder, line_list_number, binary=True))
+
+
+def link_tree(source_path: str, destination_path: str):
+    """
+    Recreates the folder tree of the cached entry (without its metadata) in destination_path with hard links to the
+    files
+    """
+    for root, _, file_names in os.walk(source_path):
+        new_root: str = os.path.join(destination_path, os.path.relpath(root, source_path))
+        os.makedirs(new_root, exist_ok=True)
+        for file_name in file_names:
+            if root == source_path and file_name == CACHE_META_FILE_NAME:
+                continue
+            link_or_copy(os.path.join(root, file_name), os.path.join(new_root, file_name))
+
+
+def get_tree_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(path)
+               for file_name in file_names)
@@ -0,0 +1,217 @@
+"""
+Sidecar wavelength index for Turbospectrum linelists, so that the trimmer does not need to parse the text of a
+linelist every time it is cut into windows
+"""
+import os
+import json
+import numpy as np
+from file_utils import atomic_write
+
+# bump if the layout of the index changes, old indices are then rebuilt
+INDEX_VERSION: int = 1
+# name of the folder inside the linelist folder where the indices are saved. os.scandir in the trimmer only takes files,
+# so the folder is not mistaken for a linelist
+DEFAULT_INDEX_DIR_NAME: str = ".linelist_index"
+# file in the index folder with the names of the linelist files in their order, for folders made by linelist_binary
+# (the files are numbered in this order when trimmed, like in the folder they were converted from)
+LINELIST_ORDER_FILE_NAME: str = "linelist_order.json"
+# indices that could not be saved (e.g. read-only linelist folder), so that they are built only once per process.
+# Path of the index metadata: size and modification time of the linelist when the index was built, and the index
+UNSAVED_INDICES: dict[str, tuple[int, int, "LinelistIndex"]] = {}
+
+
+def parse_element_header(line: str) -> tuple[str, int]:
+    """
+    Parses the first line of an element block, e.g. '   3.000            '    1	13
+    Gives back the line as it is written into the trimmed linelist (without the number of lines) and the number of lines
+    of the element.
+    :param line: First line of the element block
+    :return: First line of the element to save and number of lines of the element
+    """
+    fields: list[str] = line.strip().split()
+    if len(fields[0]) > 1:
+        return f"{fields[0]} {fields[1]}  {fields[2]}", int(fields[3])
+    return f"{fields[0]}   {fields[1]}            {fields[2]}    {fields[3]}", int(fields[4])
+
+
+class LinelistIndex:
+    """
+    Wavelengths and byte offsets of all lines of one linelist file, split into element blocks.
+    Wavelengths and offsets of all blocks are saved one after another, block_line_starts tells where each block starts.
+    """
+    def __init__(self, linelist_path: str, element_lines_1: list[str], element_lines_2: list[str],
+                 block_line_starts: np.ndarray, block_end_offsets: np.ndarray, wavelengths: np.ndarray,
+                 line_offsets: np.ndarray):
+        self.linelist_path: str = linelist_path
+        # first line of each element as it is saved in the new linelist (without the number of lines)
+        self.element_lines_1: list[str] = element_lines_1
+        # second line of each element as it is in the file, e.g. 'Li I    LTE'
+        self.element_lines_2: list[str] = element_lines_2
+        # index of the first line of each block in wavelengths/line_offsets, last value is the total number of lines
+        self.block_line_starts: np.ndarray = block_line_starts
+        # byte offset just after the last line of each block
+        self.block_end_offsets: np.ndarray = block_end_offsets
+        self.wavelengths: np.ndarray = wavelengths
+        # byte offset of the beginning of each line
+        self.line_offsets: np.ndarray = line_offsets
+
+    @property
+    def number_of_blocks(self) -> int:
+        return len(self.element_lines_1)
+
+    def block_wavelengths(self, block_index: int) -> np.ndarray:
+        """
+        Wavelengths of one element block (view, not a copy)
+        :param block_index: Index of the element block
+        :return: Wavelengths of the block
+        """
+        return self.wavelengths[self.block_line_starts[block_index]:self.block_line_starts[block_index + 1]]
+
+    def block_byte_range(self, block_index: int, index_start: int, index_end: int) -> tuple[int, int]:
+        """
+        Byte range in the linelist file of the lines index_start to index_end (both included) of one block
+        :param block_index: Index of the element block
+        :param index_start: Index of the first line within the block
+        :param index_end: Index of the last line within the block
+        :return: Byte where to start reading and byte where to stop reading
+        """
+        block_start: int = int(self.block_line_starts[block_index])
+        byte_start: int = int(self.line_offsets[block_start + index_start])
+        if block_start + index_end + 1 < self.block_line_starts[block_index + 1]:
+            byte_end: int = int(self.line_offsets[block_start + index_end + 1])
+        else:
+            byte_end: int = int(self.block_end_offsets[block_index])
+        return byte_start, byte_end
+
+
+def build_linelist_index(linelist_path: str) -> LinelistIndex:
+    """
+    Reads the linelist file once and creates the index of all its element blocks.
+    :param linelist_path: Path to the linelist file
+    :return: Index of the linelist
+    """
+    element_lines_1: list[str] = []
+    element_lines_2: list[str] = []
+    block_line_starts: list[int] = [0]
+    block_end_offsets: list[int] = []
+    wavelengths: list[float] = []
+    line_offsets: list[int] = []
+    with open(linelist_path, "rb") as fp:
+        byte_offset: int = 0
+        while True:
+            line: bytes = fp.readline()
+            if not line:
+                break
+            byte_offset += len(line)
+            if not line.strip():
+                continue
+            elem_line_1_to_save, number_of_lines_element = parse_element_header(line.decode())
+            elem_line_2_to_save: bytes = fp.readline()
+            byte_offset += len(elem_line_2_to_save)
+            for _ in range(number_of_lines_element):
+                data_line: bytes = fp.readline()
+                if not data_line:
+                    break
+                line_offsets.append(byte_offset)
+                # float accepts bytes, so no need to decode the line
+                wavelengths.append(float(data_line.split(None, 1)[0]))
+                byte_offset += len(data_line)
+            element_lines_1.append(elem_line_1_to_save)
+            element_lines_2.append(elem_line_2_to_save.decode())
+            block_line_starts.append(len(wavelengths))
+            block_end_offsets.append(byte_offset)
+    return LinelistIndex(linelist_path, element_lines_1, element_lines_2, np.asarray(block_line_starts, dtype=np.int64),
+                         np.asarray(block_end_offsets, dtype=np.int64), np.asarray(wavelengths, dtype=np.float64),
+                         np.asarray(line_offsets, dtype=np.int64))
+
+
+def get_index_paths(linelist_path: str, index_dir: str = None) -> tuple[str, str, str]:
+    """
+    Paths of the files where the index of the linelist is saved
+    :param linelist_path: Path to the linelist file
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME next to the linelist is used
+    :return: Paths to the metadata, wavelengths and line offsets files
+    """
+    if index_dir is None:
+        index_dir = os.path.join(os.path.dirname(os.path.abspath(linelist_path)), DEFAULT_INDEX_DIR_NAME)
+    base_name: str = os.path.join(index_dir, os.path.basename(linelist_path))
+    return f"{base_name}.json", f"{base_name}.wavelengths.npy", f"{base_name}.offsets.npy"
+
+
+def save_linelist_index(linelist_index: LinelistIndex, index_dir: str = None,
+                        stat_result: os.stat_result = None):
+    """
+    Saves the index next to the linelist (or in index_dir). Together with the index the size and modification time of
+    the linelist are saved, so that the index is rebuilt if the linelist changes.
+    :param linelist_index: Index to save
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME next to the linelist is used
+    :param stat_result: os.stat of the linelist taken before the index was built. If None, then it is taken now, which
+    is only right if the linelist cannot have changed since the index was built
+    """
+    meta_path, wavelengths_path, offsets_path = get_index_paths(linelist_index.linelist_path, index_dir)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    if stat_result is None:
+        stat_result = os.stat(linelist_index.linelist_path)
+    meta: dict = {"version": INDEX_VERSION, "size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns,
+                  "element_lines_1": linelist_index.element_lines_1,
+                  "element_lines_2": linelist_index.element_lines_2,
+                  "block_line_starts": linelist_index.block_line_starts.tolist(),
+                  "block_end_offsets": linelist_index.block_end_offsets.tolist()}
+    # metadata goes last, because it is the one that is checked for validity
+    for path, array in ((wavelengths_path, linelist_index.wavelengths), (offsets_path, linelist_index.line_offsets)):
+        with atomic_write(path, "wb") as array_file:
+            np.save(array_file, array)
+    with atomic_write(meta_path) as meta_file:
+        json.dump(meta, meta_file)
+
+
+def load_linelist_index(linelist_path: str, index_dir: str = None, mmap_mode: str = None) -> LinelistIndex:
+    """
+    Loads the index of the linelist. If there is no index yet, or the linelist was changed since the index was saved
+    (different size or modification time), then the index is built and saved. If it cannot be saved, then it is kept
+    in memory for the rest of the process instead.
+    :param linelist_path: Path to the linelist file
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME next to the linelist is used
+    :param mmap_mode: Passed to np.load, e.g. 'r' to not load the arrays into memory
+    :return: Index of the linelist
+    """
+    meta_path, wavelengths_path, offsets_path = get_index_paths(linelist_path, index_dir)
+    stat_result = os.stat(linelist_path)
+    try:
+        with open(meta_path) as meta_file:
+            meta: dict = json.load(meta_file)
+        if meta["version"] == INDEX_VERSION and meta["size"] == stat_result.st_size and \
+                meta["mtime_ns"] == stat_result.st_mtime_ns:
+            return LinelistIndex(linelist_path, meta["element_lines_1"], meta["element_lines_2"],
+                                 np.asarray(meta["block_line_starts"], dtype=np.int64),
+                                 np.asarray(meta["block_end_offsets"], dtype=np.int64),
+                                 np.load(wavelengths_path, mmap_mode=mmap_mode),
+                                 np.load(offsets_path, mmap_mode=mmap_mode))
+    except (OSError, ValueError, KeyError):
+        # no index or broken index, so we just rebuild it
+        pass
+    unsaved_index: tuple = UNSAVED_INDICES.get(meta_path)
+    if unsaved_index is not None and unsaved_index[:2] == (stat_result.st_size, stat_result.st_mtime_ns):
+        return unsaved_index[2]
+    # the stat from before the build is saved, so that a change of the linelist during the build rebuilds the index
+    linelist_index: LinelistIndex = build_linelist_index(linelist_path)
+    try:
+        save_linelist_index(linelist_index, index_dir, stat_result)
+        UNSAVED_INDICES.pop(meta_path, None)
+    except OSError as error:
+        print(f"LINELIST WARNING! Could not save the index of {linelist_path}, it is kept in memory: {error}")
+        UNSAVED_INDICES[meta_path] = (stat_result.st_size, stat_result.st_mtime_ns, linelist_index)
+    return linelist_index
+
+
+def load_linelist_order(old_path_name: str) -> list[str]:
+    """
+    Names of the linelist files in the order saved in the index folder of the linelist folder
+    :param old_path_name: Path to the folder with the linelists
+    :return: List of file names, or None if the folder has no saved order
+    """
+    try:
+        with open(os.path.join(old_path_name, DEFAULT_INDEX_DIR_NAME, LINELIST_ORDER_FILE_NAME)) as order_file:
+            return json.load(order_file)["files"]
+    except (OSError, ValueError, KeyError):
+        return None
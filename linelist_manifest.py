@@ -0,0 +1,251 @@
+"""
+Manifest of a whole linelist folder: for each linelist file whether it is a molecule or hydrogen, its species and the
+wavelength range of the file and of each of its element blocks, with the positions of the blocks in the file. With it
+the trimmer can skip files and element blocks outside of the segments without opening the files.
+"""
+import os
+import json
+import mmap
+from file_utils import atomic_write
+from linelist_index import DEFAULT_INDEX_DIR_NAME
+from linelist_mmap import iter_mmap_blocks, find_line_start, find_line_end, get_wavelength_at, count_lines
+
+# bump if the layout of the manifest changes, old manifests are then rebuilt
+MANIFEST_VERSION: int = 2
+MANIFEST_FILE_NAME: str = "manifest.json"
+
+
+class LinelistManifestEntry:
+    """
+    What the trimmer needs to know about one linelist file without opening it. Element blocks without lines are left
+    out, because nothing is ever written for them.
+    """
+    def __init__(self, linelist_path: str, size: int, mtime_ns: int, status: str, element: str = "",
+                 is_molecule: bool = False, is_hydrogen: bool = False, element_lines_1: list[str] = None,
+                 element_lines_2: list[str] = None, block_data_starts: list[int] = None,
+                 block_data_ends: list[int] = None, block_last_line_starts: list[int] = None,
+                 block_wavelength_minimums: list[float] = None, block_wavelength_maximums: list[float] = None,
+                 block_line_counts: list[int] = None):
+        self.linelist_path: str = linelist_path
+        # size and modification time of the file when the entry was made, to know when it is outdated
+        self.size: int = size
+        self.mtime_ns: int = mtime_ns
+        # 'ok', 'empty' (nothing in the file) or 'invalid' (not a text linelist)
+        self.status: str = status
+        # first two fields of the first line joined, e.g. '26.000000', like the trimmer checks it
+        self.element: str = element
+        self.is_molecule: bool = is_molecule
+        self.is_hydrogen: bool = is_hydrogen
+        # first line of each element as it is saved in the new linelist (without the number of lines)
+        self.element_lines_1: list[str] = element_lines_1 or []
+        # second line of each element as it is in the file, e.g. 'Li I    LTE'
+        self.element_lines_2: list[str] = element_lines_2 or []
+        # byte position of the first line of each block, just after its last line, and of its last line
+        self.block_data_starts: list[int] = block_data_starts or []
+        self.block_data_ends: list[int] = block_data_ends or []
+        self.block_last_line_starts: list[int] = block_last_line_starts or []
+        # wavelengths of the first and last line of each block
+        self.block_wavelength_minimums: list[float] = block_wavelength_minimums or []
+        self.block_wavelength_maximums: list[float] = block_wavelength_maximums or []
+        # number of lines of each block
+        self.block_line_counts: list[int] = block_line_counts or []
+
+    @property
+    def number_of_blocks(self) -> int:
+        return len(self.element_lines_1)
+
+    @property
+    def number_of_lines(self) -> int:
+        return sum(self.block_line_counts)
+
+    @property
+    def species(self) -> list[str]:
+        """
+        Species of the blocks, e.g. ['Fe I', 'Fe II']
+        """
+        species: list[str] = []
+        for elem_line_2 in self.element_lines_2:
+            species_name: str = elem_line_2.strip().replace("'", "").replace("NLTE", "").replace("LTE", "").strip()
+            if species_name not in species:
+                species.append(species_name)
+        return species
+
+    @property
+    def wavelength_minimum(self) -> float:
+        return min(self.block_wavelength_minimums, default=None)
+
+    @property
+    def wavelength_maximum(self) -> float:
+        return max(self.block_wavelength_maximums, default=None)
+
+    def is_in_range(self, wavelength_minimum: float, wavelength_maximum: float) -> bool:
+        """
+        Whether any block of the file has lines between wavelength_minimum and wavelength_maximum
+        """
+        return any(self.block_in_range(block_index, wavelength_minimum, wavelength_maximum)
+                   for block_index in range(self.number_of_blocks))
+
+    def block_in_range(self, block_index: int, wavelength_minimum: float, wavelength_maximum: float) -> bool:
+        # same check as the trimmer does for each element
+        return not (self.block_wavelength_maximums[block_index] < wavelength_minimum or
+                    self.block_wavelength_minimums[block_index] > wavelength_maximum)
+
+    def blocks_in_range(self, wavelength_minimum: float, wavelength_maximum: float) -> list[int]:
+        """
+        :return: Indices of the blocks that have lines between wavelength_minimum and wavelength_maximum
+        """
+        return [block_index for block_index in range(self.number_of_blocks)
+                if self.block_in_range(block_index, wavelength_minimum, wavelength_maximum)]
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "LinelistManifestEntry":
+        return cls(**entry)
+
+
+class LinelistManifest:
+    """
+    Entries of all linelist files of one folder, by path of the file
+    """
+    def __init__(self, old_path_name: str, entries: dict = None):
+        self.old_path_name: str = old_path_name
+        self.entries: dict[str, LinelistManifestEntry] = entries or {}
+
+    def get(self, linelist_path: str) -> LinelistManifestEntry:
+        return self.entries.get(linelist_path)
+
+    def files_in_range(self, wavelength_minimum: float, wavelength_maximum: float, molecules_flag: bool = True,
+                       do_hydrogen: bool = True) -> list[str]:
+        """
+        Linelist files that the trimmer would take lines from for these wavelengths, without opening any of them
+        :return: List of paths to the linelist files
+        """
+        linelist_paths: list[str] = []
+        for linelist_path, entry in self.entries.items():
+            if entry.status != "ok" or (entry.is_molecule and not molecules_flag):
+                continue
+            if entry.is_hydrogen:
+                if do_hydrogen:
+                    linelist_paths.append(linelist_path)
+            elif entry.is_in_range(wavelength_minimum, wavelength_maximum):
+                linelist_paths.append(linelist_path)
+        return linelist_paths
+
+    def files_with_species(self, species_name: str) -> list[str]:
+        """
+        :param species_name: Species as written in the linelist, e.g. 'Fe II'
+        :return: List of paths to the linelist files that have this species
+        """
+        species_name = " ".join(species_name.split())
+        return [linelist_path for linelist_path, entry in self.entries.items()
+                if species_name in (" ".join(species.split()) for species in entry.species)]
+
+
+def build_manifest_entry(linelist_path: str) -> LinelistManifestEntry:
+    """
+    Reads the linelist file once (memory-mapped, only the headers and the first and last line of each block are
+    decoded) and makes its manifest entry
+    :param linelist_path: Path to the linelist file
+    :return: Manifest entry of the file
+    """
+    stat_result = os.stat(linelist_path)
+    if stat_result.st_size == 0:
+        return LinelistManifestEntry(linelist_path, stat_result.st_size, stat_result.st_mtime_ns, "empty")
+    entry: LinelistManifestEntry = LinelistManifestEntry(linelist_path, stat_result.st_size, stat_result.st_mtime_ns,
+                                                         "ok")
+    try:
+        with open(linelist_path, "rb") as linelist_file, \
+                mmap.mmap(linelist_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            # same as the trimmer decides from the first line
+            first_line: bytes = mapped_file[:find_line_end(mapped_file, 0, len(mapped_file))]
+            fields: list[str] = first_line.decode().strip().split()
+            entry.element = fields[0] + fields[1]
+            entry.is_molecule = len(entry.element.split(".", 1)[0]) > 3
+            entry.is_hydrogen = entry.element == "'01.000000'"
+            for elem_line_1_to_save, elem_line_2_to_save, data_start, data_end in iter_mmap_blocks(mapped_file):
+                if data_start >= data_end:
+                    continue
+                last_line_start: int = find_line_start(mapped_file, data_end - 1, data_start)
+                entry.element_lines_1.append(elem_line_1_to_save)
+                entry.element_lines_2.append(elem_line_2_to_save)
+                entry.block_data_starts.append(data_start)
+                entry.block_data_ends.append(data_end)
+                entry.block_last_line_starts.append(last_line_start)
+                entry.block_wavelength_minimums.append(get_wavelength_at(mapped_file, data_start, data_end))
+                entry.block_wavelength_maximums.append(get_wavelength_at(mapped_file, last_line_start, data_end))
+                entry.block_line_counts.append(count_lines(mapped_file, data_start, data_end))
+    except (UnicodeDecodeError, ValueError, IndexError):
+        # not a linelist, the trimmer warns about it when it opens the file
+        return LinelistManifestEntry(linelist_path, stat_result.st_size, stat_result.st_mtime_ns, "invalid")
+    return entry
+
+
+def get_manifest_path(old_path_name: str, index_dir: str = None) -> str:
+    """
+    :param old_path_name: Path to the folder with the linelists
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME in the linelist folder is used
+    :return: Path of the manifest
+    """
+    if index_dir is None:
+        index_dir = os.path.join(os.path.abspath(old_path_name), DEFAULT_INDEX_DIR_NAME)
+    return os.path.join(index_dir, MANIFEST_FILE_NAME)
+
+
+def save_linelist_manifest(linelist_manifest: LinelistManifest, index_dir: str = None):
+    """
+    Saves the manifest into the index folder of the linelist folder (or index_dir)
+    :param linelist_manifest: Manifest to save
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME in the linelist folder is used
+    """
+    manifest_path: str = get_manifest_path(linelist_manifest.old_path_name, index_dir)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    # files are saved by name, so that the manifest still works if the folder is moved
+    manifest: dict = {"version": MANIFEST_VERSION,
+                      "files": {os.path.basename(linelist_path): entry.to_dict()
+                                for linelist_path, entry in linelist_manifest.entries.items()}}
+    for entry in manifest["files"].values():
+        del entry["linelist_path"]
+    with atomic_write(manifest_path) as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def load_linelist_manifest(old_path_name: str, linelist_paths: list[str], index_dir: str = None) -> LinelistManifest:
+    """
+    Loads the manifest of the linelist folder. Entries of files that are new or changed since the manifest was saved
+    (different size or modification time) are rebuilt, entries of removed files are dropped, and the manifest is saved
+    again if anything changed.
+    :param old_path_name: Path to the folder with the linelists
+    :param linelist_paths: Paths to the linelist files of the folder
+    :param index_dir: Folder with the indices. If None, then DEFAULT_INDEX_DIR_NAME in the linelist folder is used
+    :return: Manifest of the linelist folder
+    """
+    saved_entries: dict = {}
+    try:
+        with open(get_manifest_path(old_path_name, index_dir)) as manifest_file:
+            manifest: dict = json.load(manifest_file)
+        if manifest["version"] == MANIFEST_VERSION:
+            saved_entries = manifest["files"]
+    except (OSError, ValueError, KeyError):
+        # no manifest or broken manifest, so we just rebuild it
+        pass
+    linelist_manifest: LinelistManifest = LinelistManifest(old_path_name)
+    manifest_changed: bool = len(saved_entries) != len(linelist_paths)
+    for linelist_path in linelist_paths:
+        saved_entry: dict = saved_entries.get(os.path.basename(linelist_path))
+        stat_result = os.stat(linelist_path)
+        if saved_entry is not None and saved_entry["size"] == stat_result.st_size and \
+                saved_entry["mtime_ns"] == stat_result.st_mtime_ns:
+            linelist_manifest.entries[linelist_path] = LinelistManifestEntry.from_dict({**saved_entry,
+                                                                                       "linelist_path": linelist_path})
+        else:
+            linelist_manifest.entries[linelist_path] = build_manifest_entry(linelist_path)
+            manifest_changed = True
+    if manifest_changed:
+        try:
+            save_linelist_manifest(linelist_manifest, index_dir)
+        except OSError as error:
+            # read-only linelist folder, we can still use the manifest for this run
+            print(f"LINELIST WARNING! Could not save the manifest of {old_path_name}: {error}")
+    return linelist_manifest
@@ -0,0 +1,312 @@
+"""
+Helpers to walk a Turbospectrum linelist that is memory-mapped, without reading it into a list of lines.
+Only the lines that are needed (element headers, lines touched by the searches) are decoded, so the memory used does
+not depend on the size of the linelist.
+"""
+import os
+from collections import OrderedDict
+import numpy as np
+from linelist_index import parse_element_header
+
+# how many bytes are checked for new lines at once when skipping or counting lines
+NEWLINE_CHUNK_BYTES: int = 16 * 1024 * 1024
+
+
+def find_line_end(mapped_file, line_start: int, high: int) -> int:
+    """
+    Position just after the end of the line (after its new line character), but not further than high
+    :param mapped_file: Memory-mapped linelist
+    :param line_start: Position of the beginning of the line
+    :param high: Position not to go past
+    :return: Position of the beginning of the next line
+    """
+    newline_position: int = mapped_file.find(b"\n", line_start, high)
+    if newline_position == -1:
+        return high
+    return newline_position + 1
+
+
+def find_line_start(mapped_file, position: int, low: int) -> int:
+    """
+    Position of the beginning of the line that contains position, but not before low
+    :param mapped_file: Memory-mapped linelist
+    :param position: Any position within the line
+    :param low: Position not to go before
+    :return: Position of the beginning of the line
+    """
+    return mapped_file.rfind(b"\n", low, position) + 1 or low
+
+
+def get_wavelength_at(mapped_file, line_start: int, high: int) -> float:
+    """
+    Wavelength of the line (first column) that starts at line_start
+    :param mapped_file: Memory-mapped linelist
+    :param line_start: Position of the beginning of the line
+    :param high: Position not to go past
+    :return: Wavelength of the line
+    """
+    return float(mapped_file[line_start:find_line_end(mapped_file, line_start, high)].split(None, 1)[0])
+
+
+def skip_lines(mapped_file, position: int, number_of_lines: int) -> int:
+    """
+    Skips number_of_lines lines, counting the new lines with numpy in chunks
+    :param mapped_file: Memory-mapped linelist
+    :param position: Position of the beginning of the first line to skip
+    :param number_of_lines: How many lines to skip
+    :return: Position of the beginning of the line after the skipped ones (or the end of the file)
+    """
+    file_size: int = len(mapped_file)
+    while number_of_lines > 0 and position < file_size:
+        chunk_size: int = min(NEWLINE_CHUNK_BYTES, file_size - position)
+        newlines: np.ndarray = np.frombuffer(mapped_file, dtype=np.uint8, count=chunk_size, offset=position) == 10
+        newlines_in_chunk: int = int(np.count_nonzero(newlines))
+        if newlines_in_chunk < number_of_lines:
+            number_of_lines -= newlines_in_chunk
+            position += chunk_size
+        else:
+            position += int(np.flatnonzero(newlines)[number_of_lines - 1]) + 1
+            number_of_lines = 0
+    return min(position, file_size)
+
+
+def count_lines(mapped_file, low: int, high: int) -> int:
+    """
+    Number of lines between two positions. The last line is counted even if it does not end with a new line.
+    :param mapped_file: Memory-mapped linelist (or bytes)
+    :param low: Position of the beginning of the first line
+    :param high: Position just after the last line
+    :return: Number of lines
+    """
+    if isinstance(mapped_file, SeekableLinelistFile):
+        return count_lines(mapped_file[low:high], 0, high - low)
+    number_of_lines: int = 0
+    for chunk_start in range(low, high, NEWLINE_CHUNK_BYTES):
+        chunk_size: int = min(NEWLINE_CHUNK_BYTES, high - chunk_start)
+        number_of_lines += int(np.count_nonzero(np.frombuffer(mapped_file, dtype=np.uint8, count=chunk_size,
+                                                              offset=chunk_start) == 10))
+    if high > low and mapped_file[high - 1:high] != b"\n":
+        number_of_lines += 1
+    return number_of_lines
+
+
+def bisect_lines(mapped_file, low: int, high: int, element_to_search: float, right: bool) -> int:
+    """
+    Binary search over the bytes of sorted lines. Gives the beginning of the first line with wavelength >=
+    element_to_search (or > element_to_search if right is True), or high if there is no such line.
+    :param mapped_file: Memory-mapped linelist
+    :param low: Beginning of the first line to search
+    :param high: Position just after the last line to search
+    :param element_to_search: Wavelength to search
+    :param right: If True, then lines with wavelength equal to element_to_search are skipped
+    :return: Position of the beginning of the line
+    """
+    while low < high:
+        middle: int = low + (high - low) // 2
+        if isinstance(mapped_file, SeekableLinelistFile):
+            line_start, line_end, line = mapped_file.get_line(middle, low, high)
+        else:
+            line_start: int = find_line_start(mapped_file, middle, low)
+            line_end: int = find_line_end(mapped_file, line_start, high)
+            line: bytes = mapped_file[line_start:line_end]
+        wavelength: float = float(line.split(None, 1)[0])
+        if wavelength < element_to_search or (right and wavelength == element_to_search):
+            low = line_end
+        else:
+            high = line_start
+    return low
+
+
+def iter_mmap_blocks(mapped_file):
+    """
+    Goes through all element blocks of the memory-mapped linelist
+    :param mapped_file: Memory-mapped linelist
+    :return: Yields first line of the element to save, second line of the element, position of the first line of the
+    element's data and position just after its last line
+    """
+    position: int = 0
+    file_size: int = len(mapped_file)
+    while position < file_size:
+        line_end: int = find_line_end(mapped_file, position, file_size)
+        line: bytes = mapped_file[position:line_end]
+        position = line_end
+        if not line.strip():
+            continue
+        elem_line_1_to_save, number_of_lines_element = parse_element_header(line.decode())
+        line_end = find_line_end(mapped_file, position, file_size)
+        elem_line_2_to_save: str = mapped_file[position:line_end].decode()
+        data_start: int = line_end
+        position = skip_lines(mapped_file, data_start, number_of_lines_element)
+        yield elem_line_1_to_save, elem_line_2_to_save, data_start, position
+
+
+def find_segment_byte_range(mapped_file, data_start: int, data_end: int, last_line_start: int,
+                            wavelength_minimum_element: float, wavelength_maximum_element: float, seg_begin: float,
+                            seg_end: float) -> tuple[int, int]:
+    """
+    Same as binary_find_left_segment_index and binary_find_right_segment_index in the trimmer, but gives positions of
+    the lines in the memory-mapped linelist instead of indices
+    :param mapped_file: Memory-mapped linelist
+    :param data_start: Position of the first line of the element
+    :param data_end: Position just after the last line of the element
+    :param last_line_start: Position of the last line of the element
+    :param wavelength_minimum_element: Wavelength of the first line of the element
+    :param wavelength_maximum_element: Wavelength of the last line of the element
+    :param seg_begin: Segment beginning
+    :param seg_end: Segment end
+    :return: Beginning of the first line within the segment and position just after the last line within the
+    segment. If there are no lines in the segment, both are -1
+    """
+    if seg_begin <= wavelength_minimum_element:
+        segment_start: int = data_start
+    elif seg_begin >= wavelength_maximum_element:
+        segment_start: int = last_line_start
+    else:
+        segment_start: int = bisect_lines(mapped_file, data_start, data_end, seg_begin, False)
+    wavelength_start: float = get_wavelength_at(mapped_file, segment_start, data_end)
+    if not seg_begin <= wavelength_start <= seg_end:
+        return -1, -1
+    if seg_end <= wavelength_start:
+        segment_end: int = find_line_end(mapped_file, segment_start, data_end)
+    elif seg_end >= wavelength_maximum_element:
+        segment_end: int = data_end
+    else:
+        segment_end: int = bisect_lines(mapped_file, segment_start, data_end, seg_end, True)
+    return segment_start, segment_end
+
+
+class SeekableLinelistFile:
+    """
+    Linelist file opened in binary mode, with the few methods of mmap used by the functions above (len, slicing, find,
+    rfind, seek, read), done with seek and read of small chunks. For file systems where memory-mapping is not possible
+    or not wanted: only the chunks touched by the searches are read, and the last read chunks are kept.
+    """
+    def __init__(self, linelist_file, chunk_bytes: int = 8 * 1024, max_chunks: int = 256):
+        """
+        :param linelist_file: File opened in binary mode
+        :param chunk_bytes: Size of the chunks read for the searches
+        :param max_chunks: How many chunks are kept
+        """
+        self.linelist_file = linelist_file
+        self.chunk_bytes: int = chunk_bytes
+        self.max_chunks: int = max_chunks
+        self.file_size: int = os.fstat(linelist_file.fileno()).st_size
+        # chunk index: bytes of the chunk, in the order of use
+        self.chunks: OrderedDict = OrderedDict()
+        # the searches mostly stay within one chunk, so the last one is kept at hand
+        self.last_chunk_index: int = -1
+        self.last_chunk: bytes = b""
+
+    def __len__(self) -> int:
+        return self.file_size
+
+    def get_chunk(self, chunk_index: int) -> bytes:
+        if chunk_index == self.last_chunk_index:
+            return self.last_chunk
+        self.last_chunk_index = chunk_index
+        if chunk_index in self.chunks:
+            self.chunks.move_to_end(chunk_index)
+            self.last_chunk = self.chunks[chunk_index]
+            return self.last_chunk
+        self.linelist_file.seek(chunk_index * self.chunk_bytes)
+        self.last_chunk = self.linelist_file.read(self.chunk_bytes)
+        self.chunks[chunk_index] = self.last_chunk
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return self.last_chunk
+
+    def __getitem__(self, item: slice) -> bytes:
+        start, stop, _ = item.indices(self.file_size)
+        if stop <= start:
+            return b""
+        first_chunk_index: int = start // self.chunk_bytes
+        if (stop - 1) // self.chunk_bytes == first_chunk_index:
+            # e.g. one line, taken from its chunk
+            chunk_start: int = first_chunk_index * self.chunk_bytes
+            return self.get_chunk(first_chunk_index)[start - chunk_start:stop - chunk_start]
+        # across chunks (a line over a chunk border, or lines to write) read as it is, without the chunks
+        self.linelist_file.seek(start)
+        return self.linelist_file.read(stop - start)
+
+    def get_line(self, position: int, low: int, high: int) -> tuple[int, int, bytes]:
+        """
+        Same as find_line_start, find_line_end and the slice of the line, but done in the chunk of position at once
+        :param position: Any position within the line
+        :param low: Position not to go before
+        :param high: Position not to go past
+        :return: Position of the beginning of the line, of the beginning of the next line, and the line
+        """
+        chunk_index: int = position // self.chunk_bytes
+        chunk_start: int = chunk_index * self.chunk_bytes
+        chunk: bytes = self.last_chunk if chunk_index == self.last_chunk_index else self.get_chunk(chunk_index)
+        newline_position: int = chunk.rfind(b"\n", low - chunk_start if low > chunk_start else 0,
+                                            position - chunk_start)
+        if newline_position != -1 or low >= chunk_start:
+            line_start_offset: int = newline_position + 1 if newline_position != -1 else low - chunk_start
+            newline_position = chunk.find(b"\n", line_start_offset, high - chunk_start)
+            if newline_position != -1 or high <= chunk_start + len(chunk):
+                line_end_offset: int = newline_position + 1 if newline_position != -1 else high - chunk_start
+                return chunk_start + line_start_offset, chunk_start + line_end_offset, \
+                    chunk[line_start_offset:line_end_offset]
+        # the line goes over a chunk border
+        line_start: int = find_line_start(self, position, low)
+        line_end: int = find_line_end(self, line_start, high)
+        return line_start, line_end, self[line_start:line_end]
+
+    def find(self, sub: bytes, start: int, end: int) -> int:
+        if end <= start:
+            return -1
+        # searched within the chunks themselves, sub across a chunk border is searched in a small window around it
+        chunk_start: int = start - start % self.chunk_bytes
+        if end <= chunk_start + self.chunk_bytes:
+            found_position: int = self.get_chunk(start // self.chunk_bytes).find(sub, start - chunk_start,
+                                                                                 end - chunk_start)
+            return -1 if found_position == -1 else chunk_start + found_position
+        position: int = start
+        while position < end:
+            chunk_index: int = position // self.chunk_bytes
+            chunk_start: int = chunk_index * self.chunk_bytes
+            chunk: bytes = self.get_chunk(chunk_index)
+            chunk_end: int = min(chunk_start + len(chunk), end)
+            found_position: int = chunk.find(sub, position - chunk_start, chunk_end - chunk_start)
+            if found_position != -1:
+                return chunk_start + found_position
+            if len(sub) > 1 and chunk_end < end:
+                border_start: int = max(chunk_end - len(sub) + 1, position)
+                found_position = self[border_start:min(chunk_end + len(sub) - 1, end)].find(sub)
+                if found_position != -1:
+                    return border_start + found_position
+            if chunk_end <= position:
+                break
+            position = chunk_end
+        return -1
+
+    def rfind(self, sub: bytes, start: int, end: int) -> int:
+        if end <= start:
+            return -1
+        chunk_start: int = start - start % self.chunk_bytes
+        if end <= chunk_start + self.chunk_bytes:
+            found_position: int = self.get_chunk(start // self.chunk_bytes).rfind(sub, start - chunk_start,
+                                                                                  end - chunk_start)
+            return -1 if found_position == -1 else chunk_start + found_position
+        position: int = min(end, self.file_size)
+        while position > start:
+            chunk_index: int = (position - 1) // self.chunk_bytes
+            chunk_start: int = chunk_index * self.chunk_bytes
+            found_position: int = self.get_chunk(chunk_index).rfind(sub, max(start - chunk_start, 0),
+                                                                    position - chunk_start)
+            if found_position != -1:
+                return chunk_start + found_position
+            if len(sub) > 1 and chunk_start > start:
+                border_start: int = max(chunk_start - len(sub) + 1, start)
+                found_position = self[border_start:min(chunk_start + len(sub) - 1, position)].rfind(sub)
+                if found_position != -1:
+                    return border_start + found_position
+            position = chunk_start
+        return -1
+
+    def seek(self, position: int):
+        self.linelist_file.seek(position)
+
+    def read(self, size: int) -> bytes:
+        return self.linelist_file.read(size)
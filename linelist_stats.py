@@ -0,0 +1,135 @@
+"""
+Opt-in statistics of the trimming pipeline: where the time went (scandir, reading, searching, writing, combining), how
+many files and element blocks were opened, skipped and kept, and how much was written. Pass a TrimStats to
+create_window_linelist, trim_and_combine_linelists, write_lines or combine_linelists to fill it.
+"""
+import json
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+# logger of the statistics records, e.g. logging.getLogger("linelist_stats").addHandler(...) to collect them
+logger = logging.getLogger("linelist_stats")
+
+COUNTER_NAMES: tuple = ("files_seen", "files_opened", "files_skipped", "blocks_scanned", "blocks_kept", "lines_written",
+                        "bytes_written")
+# prefix of the timings of the worker processes of a parallel trim. They are added together over all workers (like CPU
+# time), so they can be longer than the wall-clock time of the trim
+WORKER_TIMING_PREFIX: str = "workers_"
+
+
+class TrimStats:
+    """
+    Timings (in seconds, by stage) and counters of one or more runs. Stats of several runs or processes are added
+    together with merge.
+    """
+    def __init__(self):
+        # stage: seconds spent in it: 'scandir', 'trim' (all of trimming the files, including 'read' and 'write'),
+        # 'read', 'write' and 'combine'. A parallel trim has the wall-clock time of the pool as 'trim', and the times
+        # of its workers with WORKER_TIMING_PREFIX
+        self.timings: dict[str, float] = {}
+        # linelist files found in the folder, opened, and skipped without reading them (or their lines)
+        self.files_seen: int = 0
+        self.files_opened: int = 0
+        self.files_skipped: int = 0
+        # element blocks looked at and element blocks that had lines within the segments
+        self.blocks_scanned: int = 0
+        self.blocks_kept: int = 0
+        self.lines_written: int = 0
+        self.bytes_written: int = 0
+        # largest amount of lines kept in memory by the writers before writing them
+        self.peak_buffer_bytes: int = 0
+
+    def add_time(self, stage: str, seconds: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Adds the time spent within the with block to the stage
+        """
+        start_time: float = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def update_peak_buffer(self, buffer_bytes: int):
+        self.peak_buffer_bytes = max(self.peak_buffer_bytes, buffer_bytes)
+
+    def merge(self, other: "TrimStats", timing_prefix: str = "") -> "TrimStats":
+        """
+        Adds the timings and counters of the other stats to these (peak buffer is the larger of the two)
+        :param other: Stats to add
+        :param timing_prefix: Put before the stages of the other timings, WORKER_TIMING_PREFIX for the stats of a worker
+        :return: These stats
+        """
+        for stage, seconds in other.timings.items():
+            self.add_time(f"{timing_prefix}{stage}", seconds)
+        for counter_name in COUNTER_NAMES:
+            setattr(self, counter_name, getattr(self, counter_name) + getattr(other, counter_name))
+        self.update_peak_buffer(other.peak_buffer_bytes)
+        return self
+
+    def get_timings(self) -> dict[str, float]:
+        """
+        Timings with 'search': the time of trimming the files ('trim') that was not spent reading or writing. For a
+        parallel trim only the workers have it, because the reading and writing happens in them
+        """
+        timings: dict[str, float] = dict(self.timings)
+        prefix: str = WORKER_TIMING_PREFIX if f"{WORKER_TIMING_PREFIX}trim" in timings else ""
+        if f"{prefix}trim" in timings:
+            timings[f"{prefix}search"] = max(timings[f"{prefix}trim"] - timings.get(f"{prefix}read", 0.0) -
+                                             timings.get(f"{prefix}write", 0.0), 0.0)
+        return timings
+
+    def to_dict(self) -> dict:
+        return {"timings": self.get_timings(), "peak_buffer_bytes": self.peak_buffer_bytes,
+                **{counter_name: getattr(self, counter_name) for counter_name in COUNTER_NAMES}}
+
+    @classmethod
+    def from_dict(cls, stats_dict: dict) -> "TrimStats":
+        trim_stats: TrimStats = cls()
+        trim_stats.timings = dict(stats_dict.get("timings", {}))
+        # derived from the other timings, see get_timings
+        trim_stats.timings.pop("search", None)
+        trim_stats.timings.pop(f"{WORKER_TIMING_PREFIX}search", None)
+        trim_stats.peak_buffer_bytes = stats_dict.get("peak_buffer_bytes", 0)
+        for counter_name in COUNTER_NAMES:
+            setattr(trim_stats, counter_name, stats_dict.get(counter_name, 0))
+        return trim_stats
+
+    def log(self, operation: str, level: int = logging.INFO, **context):
+        """
+        Writes the stats as one structured record: the message is JSON, and the record has the same dictionary as
+        record.trim_stats, so that handlers can aggregate many runs without parsing the message
+        :param operation: What was run, e.g. 'create_window_linelist'
+        :param level: Logging level of the record
+        :param context: Anything else to put into the record, e.g. number of segments
+        """
+        stats_record: dict = {"operation": operation, **context, **self.to_dict()}
+        logger.log(level, json.dumps(stats_record, default=str), extra={"trim_stats": stats_record})
+
+    def __repr__(self) -> str:
+        return f"TrimStats({self.to_dict()})"
+
+
+def aggregate_stats(stats_records: list) -> TrimStats:
+    """
+    Adds together many stats, e.g. the trim_stats of collected log records
+    :param stats_records: TrimStats or dictionaries from TrimStats.to_dict
+    :return: Total stats
+    """
+    total_stats: TrimStats = TrimStats()
+    for stats_record in stats_records:
+        total_stats.merge(stats_record if isinstance(stats_record, TrimStats) else TrimStats.from_dict(stats_record))
+    return total_stats
+
+
+def stage_timer(stats: TrimStats, stage: str):
+    """
+    stats.timer(stage) if there are stats, otherwise a with block that does nothing
+    """
+    if stats is None:
+        return nullcontext()
+    return stats.timer(stage)
@@ -0,0 +1,240 @@
+"""
+Incremental trimming: keeps a trimmed linelist folder up to date with the old linelist folder, trimming again only the
+linelist files that were added or changed since the last update. Files are compared by size and modification time, and
+if only the modification time changed, by the hash of their content. The trimmed linelists of the other files are
+neither read nor written again.
+
+Each file keeps its number (linelist-{number}.bsyn) between updates and new files get new numbers, so with
+combined_linelist_name the combined linelist of each segment is the trimmed linelists in the order of their numbers.
+Adding a file then only appends to the combined linelist, and a changed file rewrites it only from its own part on.
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from file_utils import atomic_write, get_temporary_path
+from linelist_manifest import LinelistManifest, load_linelist_manifest
+from linelist_stats import TrimStats, stage_timer
+from trimmer import get_linelist_files, sort_segments, trim_linelist_file
+
+# name of the file in the new folder that describes what it was trimmed from
+UPDATE_STATE_FILE_NAME: str = ".trim_state.json"
+# folder in the new folder with the trimmed linelist of each file, if they are combined
+PIECES_DIR_NAME: str = ".trim_pieces"
+# bump if the layout of the new folder changes, old folders are then trimmed again from scratch
+UPDATE_STATE_VERSION: int = 1
+
+
+def get_file_hash(file_path: str, chunk_bytes: int = 1024 * 1024) -> str:
+    """
+    :param file_path: Path to the file
+    :param chunk_bytes: How much is read at once
+    :return: SHA-1 of the content of the file
+    """
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(chunk_bytes), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def load_update_state(new_path_name: str) -> dict:
+    """
+    :param new_path_name: Path to the trimmed linelist folder
+    :return: State saved by the last update_window_linelist, or None if there is none
+    """
+    try:
+        with open(os.path.join(new_path_name, UPDATE_STATE_FILE_NAME)) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_update_state(new_path_name: str, state: dict):
+    with atomic_write(os.path.join(new_path_name, UPDATE_STATE_FILE_NAME)) as state_file:
+        json.dump(state, state_file)
+
+
+def update_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[float], old_path_name: str,
+                           new_path_name: str, molecules_flag: bool, lbl=False, do_hydrogen=True,
+                           reader="readlines", index_dir: str = None, use_manifest: bool = False,
+                           combined_linelist_name: str = None, stats: TrimStats = None) -> dict[str, list[str]]:
+    """
+    Same as create_window_linelist (followed by combine_linelists if combined_linelist_name is given), but if
+    new_path_name was made by an earlier update with the same segments and flags, then only the added and changed
+    linelist files are trimmed, and the trimmed linelists of removed files are removed. If the segments or flags are
+    different, then everything is trimmed again.
+
+    The trimmed linelists are never changed in place, they are removed and written anew, so hard links to them (e.g.
+    from TrimmedLinelistCache) keep the old content. The combined linelists are changed in place, unless they are hard
+    linked, then they are replaced. With combined_linelist_name, the trimmed linelists are kept in a hidden folder, so
+    combine_linelists must not be called on new_path_name.
+    :param seg_begins: Array of segment beginnings
+    :param seg_ends: Array of segment ends
+    :param old_path_name: Path to the folder with the old linelists
+    :param new_path_name: Path to the folder where the new linelists are saved. Must not exist, be empty, or be made by
+    update_window_linelist
+    :param molecules_flag: If True, then the molecules are included in the new linelists.
+    :param lbl: If True, then the linelist is created for each segment separately
+    :param do_hydrogen: If False, then the linelist is not created for hydrogen.
+    :param reader: How the linelists are read, see create_window_linelist
+    :param index_dir: See create_window_linelist
+    :param use_manifest: See create_window_linelist
+    :param combined_linelist_name: If given, then the trimmed linelists of each segment are combined into
+    /new_path_name/{segment}/combined_linelist_name, like combine_linelists does
+    :param stats: If given, then it is filled like in create_window_linelist
+    :return: Names of the 'added', 'changed', 'removed' and 'unchanged' linelist files
+    """
+    segment_to_use_begins, segment_to_use_ends = sort_segments(seg_begins, seg_ends)
+    number_of_segment_folders: int = len(segment_to_use_begins) if lbl else 1
+    settings: dict = {"version": UPDATE_STATE_VERSION,
+                      "segment_begins": [float(seg_begin) for seg_begin in segment_to_use_begins],
+                      "segment_ends": [float(seg_end) for seg_end in segment_to_use_ends],
+                      "molecules_flag": bool(molecules_flag), "lbl": bool(lbl), "do_hydrogen": bool(do_hydrogen),
+                      "combined_linelist_name": combined_linelist_name}
+    state: dict = load_update_state(new_path_name)
+    pieces_path_name: str = os.path.join(new_path_name, PIECES_DIR_NAME) if combined_linelist_name else new_path_name
+    if state is None or not state.get("complete") or state.get("settings") != settings or \
+            not all(os.path.isfile(os.path.join(pieces_path_name, trimmed_linelist))
+                    for trimmed_linelist in state.get("trimmed_linelists", [])):
+        if state is None and os.path.isdir(new_path_name) and os.listdir(new_path_name):
+            raise FileExistsError(f"{new_path_name} is not empty and was not made by update_window_linelist")
+        # trimmed with other settings (or the last update did not finish, or the trimmed linelists are gone, e.g.
+        # removed by combine_linelists), so everything is trimmed again
+        shutil.rmtree(new_path_name, ignore_errors=True)
+        state = {"settings": settings, "complete": False, "files": {}, "combined": {}, "trimmed_linelists": []}
+
+    with stage_timer(stats, "scandir"):
+        line_list_files: list = get_linelist_files(old_path_name)
+    if stats is not None:
+        stats.files_seen += len(line_list_files)
+    old_files: dict = state["files"]
+    current_files: dict = {}
+    file_changes: dict[str, list[str]] = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    files_to_trim: list[str] = []
+    for line_list_file in line_list_files:
+        file_name: str = os.path.basename(line_list_file)
+        stat_result = os.stat(line_list_file)
+        old_file: dict = old_files.get(file_name)
+        if old_file is not None and old_file["size"] == stat_result.st_size and \
+                old_file["mtime_ns"] == stat_result.st_mtime_ns:
+            current_files[file_name] = old_file
+            file_changes["unchanged"].append(file_name)
+            continue
+        file_hash: str = get_file_hash(line_list_file)
+        if old_file is not None and old_file["size"] == stat_result.st_size and old_file["sha1"] == file_hash:
+            # touched, but not changed
+            current_files[file_name] = dict(old_file, mtime_ns=stat_result.st_mtime_ns)
+            file_changes["unchanged"].append(file_name)
+            continue
+        current_files[file_name] = {"size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns,
+                                    "sha1": file_hash, "line_list_number": None}
+        file_changes["added" if old_file is None else "changed"].append(file_name)
+        files_to_trim.append(line_list_file)
+    file_changes["removed"] = [file_name for file_name in old_files if file_name not in current_files]
+    if not files_to_trim and not file_changes["removed"] and state["complete"]:
+        if current_files != old_files:
+            # only the modification times of touched files, so that they are not hashed again next time
+            state["files"] = current_files
+            save_update_state(new_path_name, state)
+        return file_changes
+
+    # until the update is finished, the folder is trimmed again from scratch if anything goes wrong
+    state["complete"] = False
+    for seg_index in range(number_of_segment_folders):
+        os.makedirs(os.path.join(pieces_path_name, f"{seg_index}"), exist_ok=True)
+        os.makedirs(os.path.join(new_path_name, f"{seg_index}"), exist_ok=True)
+    save_update_state(new_path_name, state)
+
+    # trimmed linelists of changed and removed files are removed (not overwritten, in case they are hard linked)
+    for file_name in file_changes["changed"] + file_changes["removed"]:
+        remove_trimmed_linelists(pieces_path_name, number_of_segment_folders, old_files[file_name]["line_list_number"])
+    next_line_list_number: int = max([old_file["line_list_number"] for old_file in old_files.values()], default=-1) + 1
+    for file_name in file_changes["changed"]:
+        current_files[file_name]["line_list_number"] = old_files[file_name]["line_list_number"]
+    for file_name in file_changes["added"]:
+        current_files[file_name]["line_list_number"] = next_line_list_number
+        next_line_list_number += 1
+
+    with stage_timer(stats, "scandir"):
+        linelist_manifest: LinelistManifest = load_linelist_manifest(old_path_name, line_list_files, index_dir) \
+            if use_manifest or reader == "seek" else LinelistManifest(old_path_name)
+    for line_list_file in files_to_trim:
+        with stage_timer(stats, "trim"):
+            trim_linelist_file(line_list_file, current_files[os.path.basename(line_list_file)]["line_list_number"],
+                               segment_to_use_begins, segment_to_use_ends, pieces_path_name, molecules_flag, lbl,
+                               do_hydrogen, reader, index_dir, None, linelist_manifest.get(line_list_file), stats)
+
+    if combined_linelist_name:
+        changed_file_names: set = set(file_changes["changed"])
+        with stage_timer(stats, "combine"):
+            for seg_index in range(number_of_segment_folders):
+                state["combined"][f"{seg_index}"] = update_combined_linelist(
+                    os.path.join(pieces_path_name, f"{seg_index}"),
+                    os.path.join(new_path_name, f"{seg_index}", combined_linelist_name),
+                    state["combined"].get(f"{seg_index}", []), current_files, changed_file_names, stats)
+    state["files"] = current_files
+    state["trimmed_linelists"] = [os.path.join(f"{seg_index}", file_name)
+                                  for seg_index in range(number_of_segment_folders)
+                                  for file_name in sorted(os.listdir(os.path.join(pieces_path_name, f"{seg_index}")))
+                                  if file_name.startswith("linelist-") and file_name.endswith(".bsyn")]
+    state["complete"] = True
+    save_update_state(new_path_name, state)
+    if stats is not None:
+        stats.log("update_window_linelist", segments=len(segment_to_use_begins), lbl=lbl, reader=reader,
+                  **{change: len(file_names) for change, file_names in file_changes.items()})
+    return file_changes
+
+
+def remove_trimmed_linelists(pieces_path_name: str, number_of_segment_folders: int, line_list_number: int):
+    for seg_index in range(number_of_segment_folders):
+        trimmed_linelist_path: str = os.path.join(pieces_path_name, f"{seg_index}", f"linelist-{line_list_number}.bsyn")
+        if os.path.isfile(trimmed_linelist_path):
+            os.remove(trimmed_linelist_path)
+
+
+def update_combined_linelist(pieces_folder: str, combined_linelist: str, old_pieces: list, current_files: dict,
+                             changed_file_names: set, stats: TrimStats = None) -> list:
+    """
+    Brings the combined linelist of one segment up to date. The part before the first added, changed or removed
+    trimmed linelist is kept as it is, the rest is written again from the trimmed linelists.
+    :param pieces_folder: Folder with the trimmed linelists of the segment
+    :param combined_linelist: Path to the combined linelist
+    :param old_pieces: [file name, size] of each trimmed linelist in the combined linelist, in order
+    :param current_files: State of each linelist file, with its line_list_number
+    :param changed_file_names: Files that were trimmed again
+    :param stats: Where to count the bytes written
+    :return: [file name, size] of each trimmed linelist in the new combined linelist
+    """
+    new_pieces: list = []
+    for file_name, file_state in sorted(current_files.items(), key=lambda item: item[1]["line_list_number"]):
+        trimmed_linelist_path: str = os.path.join(pieces_folder, f"linelist-{file_state['line_list_number']}.bsyn")
+        if os.path.isfile(trimmed_linelist_path):
+            new_pieces.append([file_name, os.path.getsize(trimmed_linelist_path)])
+    kept_pieces: int = 0
+    while kept_pieces < min(len(old_pieces), len(new_pieces)) and old_pieces[kept_pieces] == new_pieces[kept_pieces] \
+            and new_pieces[kept_pieces][0] not in changed_file_names:
+        kept_pieces += 1
+    kept_bytes: int = sum(piece_size for _, piece_size in new_pieces[:kept_pieces])
+    old_bytes: int = sum(piece_size for _, piece_size in old_pieces)
+    if os.path.isfile(combined_linelist) and os.stat(combined_linelist).st_nlink == 1 and \
+            os.path.getsize(combined_linelist) == old_bytes:
+        combined_linelist_file = open(combined_linelist, "r+b")
+        combined_linelist_file.seek(kept_bytes)
+        combined_linelist_file.truncate()
+    else:
+        # hard linked (or not what the state says), so it is written anew from the start
+        combined_linelist_file = open(get_temporary_path(combined_linelist), "wb")
+        kept_pieces = 0
+    with combined_linelist_file:
+        for file_name, piece_size in new_pieces[kept_pieces:]:
+            trimmed_linelist_path: str = os.path.join(
+                pieces_folder, f"linelist-{current_files[file_name]['line_list_number']}.bsyn")
+            with open(trimmed_linelist_path, "rb") as trimmed_linelist_file:
+                shutil.copyfileobj(trimmed_linelist_file, combined_linelist_file)
+            if stats is not None:
+                stats.bytes_written += piece_size
+    if combined_linelist_file.name != combined_linelist:
+        os.replace(combined_linelist_file.name, combined_linelist)
+    return new_pieces
@@ -0,0 +1,248 @@
+"""
+Buffered writer of the trimmed linelists, so that each new linelist is opened once per pass over the old linelist
+instead of once per element per segment. Also a writer that combines the trimmed elements of all files into one output
+"""
+import io
+import os
+import shutil
+from collections import OrderedDict
+from linelist_stats import TrimStats, stage_timer
+
+
+class LinelistWriter:
+    """
+    Collects the trimmed elements of one old linelist for all segments and writes them into
+    /new_path_name/{segment}/linelist-{line_list_number}.bsyn. The lines are kept as the slices/bytes given to
+    add_element and only written on flush, when the buffers become larger than max_buffer_bytes or when the writer is
+    closed. At most max_open_files new linelists are open at the same time.
+    """
+    def __init__(self, new_path_name: str, line_list_number: int, binary: bool = False, max_open_files: int = 64,
+                 max_buffer_bytes: int = 64 * 1024 * 1024, stats: TrimStats = None):
+        """
+        :param new_path_name: Path to the folder where the new linelists will be saved
+        :param line_list_number: Number of the linelist
+        :param binary: If True, then the lines are given as bytes, otherwise as strings
+        :param max_open_files: Maximum number of new linelists open at the same time
+        :param max_buffer_bytes: Buffers are written once they are larger than this
+        :param stats: If given, then the bytes written, the largest buffer and the time of the last writes are added to it
+        """
+        self.new_path_name: str = new_path_name
+        self.line_list_number: int = line_list_number
+        self.binary: bool = binary
+        self.max_open_files: int = max_open_files
+        self.max_buffer_bytes: int = max_buffer_bytes
+        # segment index: list of strings/bytes to write, in order
+        self.buffers: dict = {}
+        self.buffered_bytes: int = 0
+        self.open_files: OrderedDict = OrderedDict()
+        self.stats: TrimStats = stats
+
+    def get_linelist_name(self, key: int) -> str:
+        return os.path.join(f"{self.new_path_name}", f"{key}", f"linelist-{self.line_list_number}.bsyn")
+
+    def add_element(self, key: int, elem_line_1_to_save: str, elem_line_2_to_save: str, line_length: int,
+                    lines_to_write: list):
+        """
+        Adds one element to the new linelist of the segment
+        :param key: Segment index if lbl, otherwise 0
+        :param elem_line_1_to_save: First line of the element
+        :param elem_line_2_to_save: Second line of the element
+        :param line_length: Number of lines of the element in the new linelist
+        :param lines_to_write: Lines (or bytes of several lines) to write, as strings if not binary, otherwise bytes
+        """
+        header: str = f"{elem_line_1_to_save}	{line_length}\n{elem_line_2_to_save}"
+        if self.binary:
+            header: bytes = header.encode()
+        if key not in self.buffers:
+            self.buffers[key] = []
+        self.buffers[key].append(header)
+        self.buffers[key].extend(lines_to_write)
+        self.buffered_bytes += len(header) + sum(map(len, lines_to_write))
+        if self.stats is not None:
+            self.stats.update_peak_buffer(self.buffered_bytes)
+        if self.buffered_bytes > self.max_buffer_bytes:
+            self.flush()
+
+    def get_file(self, key: int):
+        """
+        Gives the opened new linelist of the segment, closing the least recently used one if too many are open
+        :param key: Segment index if lbl, otherwise 0
+        :return: File opened for appending
+        """
+        if key in self.open_files:
+            self.open_files.move_to_end(key)
+            return self.open_files[key]
+        if len(self.open_files) >= self.max_open_files:
+            _, oldest_file = self.open_files.popitem(last=False)
+            oldest_file.close()
+        new_file_to_write = open(self.get_linelist_name(key), "ab" if self.binary else "a")
+        self.open_files[key] = new_file_to_write
+        return new_file_to_write
+
+    def add_file(self, key: int, linelist_path: str):
+        """
+        Adds the whole linelist file as it is (e.g. hydrogen), after everything added before it
+        :param key: Segment index if lbl, otherwise 0
+        :param linelist_path: Path to the linelist file
+        """
+        self.flush()
+        with open(linelist_path, "rb" if self.binary else "r") as linelist_file:
+            shutil.copyfileobj(linelist_file, self.get_file(key))
+        if self.stats is not None:
+            self.stats.bytes_written += os.path.getsize(linelist_path)
+
+    def flush(self):
+        """
+        Writes all buffers into the new linelists
+        """
+        for key, lines_to_write in self.buffers.items():
+            # writelines does not join the lines into one big string first
+            self.get_file(key).writelines(lines_to_write)
+            if self.stats is not None and not self.binary:
+                # buffered_bytes counts the characters of the strings
+                self.stats.bytes_written += sum(len(line.encode()) for line in lines_to_write)
+        if self.stats is not None and self.binary:
+            self.stats.bytes_written += self.buffered_bytes
+        self.buffers.clear()
+        self.buffered_bytes = 0
+
+    def close(self):
+        """
+        Writes the rest of the buffers and closes all new linelists
+        """
+        with stage_timer(self.stats, "write"):
+            self.flush()
+            for new_file_to_write in self.open_files.values():
+                new_file_to_write.close()
+            self.open_files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def link_or_copy(source_path: str, destination_path: str):
+    """
+    Hard links the file, or copies it if the file system does not support hard links (or they are on different
+    devices). Used for files that are the same in every segment, e.g. hydrogen.
+    :param source_path: File to link
+    :param destination_path: New file
+    """
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+
+
+class LinelistElement:
+    """
+    One element of a trimmed linelist, kept in memory instead of being written into a file
+    """
+    __slots__ = ("segment_index", "elem_line_1", "elem_line_2", "lines")
+
+    def __init__(self, segment_index: int, elem_line_1: str, elem_line_2: str, lines: list[str]):
+        # segment index if lbl, otherwise 0
+        self.segment_index: int = segment_index
+        # first line of the element, including the number of lines, without new line
+        self.elem_line_1: str = elem_line_1
+        # second line of the element as in the linelist, e.g. 'Li I    LTE'
+        self.elem_line_2: str = elem_line_2
+        # lines of the element, each with its new line
+        self.lines: list[str] = lines
+
+    def to_text(self) -> str:
+        """
+        :return: The element as it is written in the linelist
+        """
+        return f"{self.elem_line_1}\n{self.elem_line_2}" + "".join(self.lines)
+
+
+class CombinedLinelistWriter:
+    """
+    Same interface as LinelistWriter, but all elements of all linelist files are written one after another into one
+    output (like combine_linelists does with the trimmed files), or kept as LinelistElement if there is no output.
+    """
+    def __init__(self, output_file=None, stats: TrimStats = None):
+        """
+        :param output_file: File-like object to write into (text or binary). If None, then the elements are kept in
+        self.linelist_elements
+        :param stats: If given, then the bytes written are added to it
+        """
+        self.output_file = output_file
+        self.binary: bool = output_file is not None and not isinstance(output_file, io.TextIOBase)
+        self.linelist_elements: list[LinelistElement] = []
+        self.stats: TrimStats = stats
+
+    def add_element(self, key: int, elem_line_1_to_save: str, elem_line_2_to_save: str, line_length: int,
+                    lines_to_write: list):
+        """
+        Same as LinelistWriter.add_element, lines can be strings or bytes
+        """
+        if self.output_file is None:
+            self.linelist_elements.append(LinelistElement(key, f"{elem_line_1_to_save}	{line_length}",
+                                                          elem_line_2_to_save, decode_lines(lines_to_write)))
+            return
+        self.write(f"{elem_line_1_to_save}	{line_length}\n{elem_line_2_to_save}")
+        for lines in lines_to_write:
+            self.write(lines)
+
+    def add_file(self, key: int, linelist_path: str):
+        """
+        Adds the whole linelist file as it is (e.g. hydrogen)
+        :param key: Segment index if lbl, otherwise 0
+        :param linelist_path: Path to the linelist file
+        """
+        if self.output_file is None:
+            with open(linelist_path) as linelist_file:
+                lines_file: list[str] = linelist_file.readlines()
+            line_number: int = 0
+            while line_number < len(lines_file):
+                if not lines_file[line_number].strip():
+                    line_number += 1
+                    continue
+                number_of_lines: int = int(lines_file[line_number].split()[-1])
+                self.linelist_elements.append(LinelistElement(key, lines_file[line_number].rstrip("\n"),
+                                                              lines_file[line_number + 1],
+                                                              lines_file[line_number + 2:line_number + 2 + number_of_lines]))
+                line_number += 2 + number_of_lines
+            return
+        with open(linelist_path, "rb" if self.binary else "r") as linelist_file:
+            shutil.copyfileobj(linelist_file, self.output_file)
+        if self.stats is not None:
+            self.stats.bytes_written += os.path.getsize(linelist_path)
+
+    def write(self, lines):
+        if self.binary and isinstance(lines, str):
+            lines = lines.encode()
+        elif not self.binary and isinstance(lines, bytes):
+            lines = lines.decode()
+        self.output_file.write(lines)
+        if self.stats is not None:
+            self.stats.bytes_written += len(lines) if self.binary else len(lines.encode())
+
+    def close(self):
+        # the output belongs to whoever created it, so it is not closed here
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def decode_lines(lines_to_write: list) -> list[str]:
+    """
+    Lines as strings, one per line. Bytes (which can hold several lines) are decoded and split into lines.
+    :param lines_to_write: Lines as strings or bytes
+    :return: List of lines
+    """
+    lines: list[str] = []
+    for lines_chunk in lines_to_write:
+        if isinstance(lines_chunk, bytes):
+            lines.extend(lines_chunk.decode().splitlines(keepends=True))
+        else:
+            lines.append(lines_chunk)
+    return lines
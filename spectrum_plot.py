@@ -0,0 +1,161 @@
+"""
+Plots of spectra with their lines that stay fast with full-range spectra and thousands of lines: the spectrum is
+decimated to about the screen resolution keeping the minimum and maximum of each bin (so narrow lines do not
+disappear like with [::10]), all line markers are one trace with gaps between the lines, and only the strongest lines
+within the view get labels. Plotly is needed only for the figures, the decimation works without it.
+"""
+import numpy as np
+from line_table import LineTable
+
+# about the number of horizontal pixels of a plot, each bin of the decimated spectrum gives its minimum and maximum
+DEFAULT_MAX_POINTS: int = 4000
+# most labels shown at once, more are unreadable anyway
+DEFAULT_MAX_LABELS: int = 50
+
+
+def decimate_minmax(wavelengths: np.ndarray, flux: np.ndarray, max_points: int = DEFAULT_MAX_POINTS,
+                    left_wavelength: float = None, right_wavelength: float = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decimates the spectrum within the view to at most max_points points, keeping the minimum and maximum flux of each
+    bin of pixels in their order, so that the decimated spectrum looks the same as the whole one when plotted
+    :param wavelengths: Sorted wavelengths of the spectrum
+    :param flux: Flux of the spectrum
+    :param max_points: Most points to give back, at least 4 (first and last pixel, and one bin)
+    :param left_wavelength: Start of the view, if None then the whole spectrum
+    :param right_wavelength: End of the view, if None then the whole spectrum
+    :return: Wavelengths and flux of the decimated spectrum
+    """
+    if max_points < 4:
+        raise ValueError(f"max_points must be at least 4, not {max_points}")
+    pixel_start: int = 0 if left_wavelength is None else int(np.searchsorted(wavelengths, left_wavelength, side="left"))
+    pixel_end: int = len(wavelengths) if right_wavelength is None else \
+        int(np.searchsorted(wavelengths, right_wavelength, side="right"))
+    # one pixel more on both sides, so that the line goes to the edges of the view
+    pixel_start, pixel_end = max(pixel_start - 1, 0), min(pixel_end + 1, len(wavelengths))
+    view_wavelengths: np.ndarray = np.asarray(wavelengths[pixel_start:pixel_end])
+    view_flux: np.ndarray = np.asarray(flux[pixel_start:pixel_end], dtype=np.float64)
+    if len(view_flux) <= max_points:
+        return view_wavelengths, view_flux
+    # first and last pixel are kept too, so that the line goes to the edges
+    number_of_bins: int = (max_points - 2) // 2
+    bin_size: int = -(-len(view_flux) // number_of_bins)
+    number_of_bins = -(-len(view_flux) // bin_size)
+    # the last bin is padded, NaN (also within the spectrum) is never taken as minimum or maximum
+    padded_flux: np.ndarray = np.full(number_of_bins * bin_size, np.nan)
+    padded_flux[:len(view_flux)] = view_flux
+    padded_flux = padded_flux.reshape(number_of_bins, bin_size)
+    bin_offsets: np.ndarray = np.arange(number_of_bins) * bin_size
+    minimum_pixels: np.ndarray = bin_offsets + np.argmin(np.where(np.isnan(padded_flux), np.inf, padded_flux), axis=1)
+    maximum_pixels: np.ndarray = bin_offsets + np.argmax(np.where(np.isnan(padded_flux), -np.inf, padded_flux), axis=1)
+    # minimum and maximum of each bin in the order they are in the spectrum
+    kept_pixels: np.ndarray = np.concatenate(([0], np.column_stack((np.minimum(minimum_pixels, maximum_pixels),
+                                                                    np.maximum(minimum_pixels, maximum_pixels))).ravel(),
+                                              [len(view_flux) - 1]))
+    kept_pixels = kept_pixels[np.concatenate(([True], kept_pixels[1:] != kept_pixels[:-1]))]
+    return view_wavelengths[kept_pixels], view_flux[kept_pixels]
+
+
+def get_line_segments(line_wavelengths: np.ndarray, bottom: float, top: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vertical markers of all lines as one polyline: bottom, top and a gap (NaN) for each line
+    :param line_wavelengths: Wavelengths of the lines
+    :param bottom: Lower end of the markers
+    :param top: Upper end of the markers
+    :return: x and y of the polyline
+    """
+    line_wavelengths = np.asarray(line_wavelengths, dtype=np.float64)
+    segments_x: np.ndarray = np.column_stack((line_wavelengths, line_wavelengths,
+                                              np.full(len(line_wavelengths), np.nan))).ravel()
+    segments_y: np.ndarray = np.tile(np.asarray([bottom, top, np.nan]), len(line_wavelengths))
+    return segments_x, segments_y
+
+
+def select_labels(lines: LineTable, left_wavelength: float = None, right_wavelength: float = None,
+                  max_labels: int = DEFAULT_MAX_LABELS, loggf_threshold: float = None) -> np.ndarray:
+    """
+    Lines that get a label: within the view, with loggf >= loggf_threshold, and at most max_labels of the strongest
+    :param lines: Table with the lines
+    :param left_wavelength: Start of the view, if None then no limit
+    :param right_wavelength: End of the view, if None then no limit
+    :param max_labels: Most labels
+    :param loggf_threshold: Minimum loggf of the labelled lines, if None then no limit
+    :return: Rows of the labelled lines, sorted by wavelength
+    """
+    labelled: np.ndarray = np.ones(len(lines), dtype=bool)
+    if left_wavelength is not None:
+        labelled &= lines.wavelengths >= left_wavelength
+    if right_wavelength is not None:
+        labelled &= lines.wavelengths <= right_wavelength
+    if loggf_threshold is not None:
+        labelled &= lines.loggf >= np.float32(loggf_threshold)
+    label_rows: np.ndarray = np.flatnonzero(labelled)
+    if len(label_rows) > max_labels:
+        strongest: np.ndarray = np.argpartition(-lines.loggf[label_rows], max_labels - 1)[:max_labels]
+        label_rows = label_rows[strongest]
+    return label_rows[np.argsort(lines.wavelengths[label_rows], kind="stable")]
+
+
+def get_label_texts(lines: LineTable, label_rows: np.ndarray) -> list[str]:
+    element_names: np.ndarray = lines.element_names()[label_rows]
+    return [f"{element_name.strip()} (log gf={loggf})" for element_name, loggf
+            in zip(element_names, lines.loggf[label_rows].astype(str))]
+
+
+def plot_spectrum(spectrum: np.ndarray, lines: LineTable = None, left_wavelength: float = None,
+                  right_wavelength: float = None, max_points: int = DEFAULT_MAX_POINTS,
+                  max_labels: int = DEFAULT_MAX_LABELS, loggf_threshold: float = None, title: str = "Spectrum",
+                  xaxis_title: str = "Wavelength", yaxis_title: str = "Flux", widget: bool = False):
+    """
+    Plotly figure of the spectrum with the lines. The figure has three traces: the decimated spectrum, all line
+    markers together and the labels. With widget=True it is a FigureWidget (for Jupyter, needs ipywidgets) that
+    decimates the spectrum and picks the labels again whenever it is zoomed, see update_view.
+    :param spectrum: Spectrum as array of (wavelength, flux, ...) rows, sorted by wavelength
+    :param lines: Table with the lines, e.g. from find_elements
+    :param left_wavelength: Start of the view, if None then the whole spectrum
+    :param right_wavelength: End of the view, if None then the whole spectrum
+    :param max_points: Most points of the decimated spectrum
+    :param max_labels: Most labels
+    :param loggf_threshold: Minimum loggf of the labelled lines (all lines get a marker)
+    :return: plotly Figure or FigureWidget
+    """
+    import plotly.graph_objects as go
+
+    figure = (go.FigureWidget if widget else go.Figure)()
+    figure.add_trace(go.Scattergl(x=[], y=[], mode="lines", name="Spectrum", line=dict(color="black")))
+    if lines is not None and len(lines) > 0:
+        flux = np.asarray(spectrum[:, 1], dtype=np.float64)
+        bottom, top = float(np.nanmin(flux)), max(float(np.nanmax(flux)), 1.0) * 1.05
+        markers_x, markers_y = get_line_segments(lines.wavelengths, bottom, top)
+        figure.add_trace(go.Scattergl(x=markers_x, y=markers_y, mode="lines", name="Lines", hoverinfo="x",
+                                      line=dict(color="gray", dash="dash", width=1)))
+        figure.add_trace(go.Scatter(x=[], y=[], mode="text", name="Labels", textposition="top center",
+                                    textfont=dict(color="black"), showlegend=False))
+    figure.update_layout(title=title, xaxis_title=xaxis_title, yaxis_title=yaxis_title)
+    update_view(figure, spectrum, lines, left_wavelength, right_wavelength, max_points, max_labels, loggf_threshold)
+    if widget:
+        def on_zoom(layout, xaxis_range):
+            if xaxis_range is None:
+                update_view(figure, spectrum, lines, None, None, max_points, max_labels, loggf_threshold)
+            else:
+                update_view(figure, spectrum, lines, float(xaxis_range[0]), float(xaxis_range[1]), max_points,
+                            max_labels, loggf_threshold)
+        figure.layout.on_change(on_zoom, "xaxis.range")
+    return figure
+
+
+def update_view(figure, spectrum: np.ndarray, lines: LineTable = None, left_wavelength: float = None,
+                right_wavelength: float = None, max_points: int = DEFAULT_MAX_POINTS,
+                max_labels: int = DEFAULT_MAX_LABELS, loggf_threshold: float = None):
+    """
+    Decimates the spectrum for the view and picks the labels of the lines within it, in a figure from plot_spectrum.
+    The line markers are not changed, they are all in the figure already.
+    See plot_spectrum for the parameters
+    """
+    decimated_wavelengths, decimated_flux = decimate_minmax(spectrum[:, 0], spectrum[:, 1], max_points,
+                                                            left_wavelength, right_wavelength)
+    figure.data[0].x, figure.data[0].y = decimated_wavelengths, decimated_flux
+    if lines is not None and len(lines) > 0:
+        label_rows: np.ndarray = select_labels(lines, left_wavelength, right_wavelength, max_labels, loggf_threshold)
+        figure.data[2].x = lines.wavelengths[label_rows]
+        figure.data[2].y = np.full(len(label_rows), figure.data[1].y[1])
+        figure.data[2].text = get_label_texts(lines, label_rows)
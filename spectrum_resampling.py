@@ -0,0 +1,215 @@
+"""
+Resampling and broadening of many synthetic spectra (e.g. from synt_grab) onto the wavelengths of one observed spectrum
+(e.g. from obs_grab) at once. The synthetic spectra share one wavelength grid and are given as one 2D array (one row
+per model), the interpolation weights and the broadening kernel are computed once per pair of grids, and all models
+are then resampled and convolved together with numpy (the convolution with FFT). The resampled models can be compared
+with the observation as one array operation, see get_chi_squared.
+"""
+import numpy as np
+
+# speed of light in km/s
+SPEED_OF_LIGHT: float = 299792.458
+# the Gaussian kernel is cut at this many sigmas
+GAUSSIAN_KERNEL_SIGMAS: float = 5
+# how many values (models times pixels) are convolved at once, so that hundreds of models do not need all the memory
+MAX_CHUNK_VALUES: int = 8 * 1024 * 1024
+
+
+def get_interpolation_weights(from_wavelengths: np.ndarray, to_wavelengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Linear interpolation weights, the same as np.interp gives (including the edge values outside of the grid), so that
+    flux[..., left_indices] * (1 - right_weights) + flux[..., left_indices + 1] * right_weights is the interpolated flux
+    :param from_wavelengths: Sorted wavelengths of the flux, at least two
+    :param to_wavelengths: Wavelengths to interpolate to
+    :return: Index of the left neighbour and weight of the right neighbour of each new wavelength
+    """
+    from_wavelengths = np.asarray(from_wavelengths, dtype=np.float64)
+    to_wavelengths = np.asarray(to_wavelengths, dtype=np.float64)
+    if len(from_wavelengths) < 2:
+        raise ValueError("At least two wavelengths are needed to interpolate")
+    left_indices: np.ndarray = np.clip(np.searchsorted(from_wavelengths, to_wavelengths, side="right") - 1, 0,
+                                       len(from_wavelengths) - 2)
+    left_wavelengths: np.ndarray = from_wavelengths[left_indices]
+    steps: np.ndarray = from_wavelengths[left_indices + 1] - left_wavelengths
+    with np.errstate(divide="ignore", invalid="ignore"):
+        right_weights: np.ndarray = np.where(steps > 0, (to_wavelengths - left_wavelengths) / steps, 0.0)
+    return left_indices, np.clip(right_weights, 0.0, 1.0)
+
+
+def interpolate(flux: np.ndarray, left_indices: np.ndarray, right_weights: np.ndarray) -> np.ndarray:
+    """
+    :param flux: Flux, one row per spectrum (or one spectrum)
+    :param left_indices: From get_interpolation_weights
+    :param right_weights: From get_interpolation_weights
+    :return: Interpolated flux of each spectrum
+    """
+    return flux[..., left_indices] * (1 - right_weights) + flux[..., left_indices + 1] * right_weights
+
+
+def get_broadening_kernel(velocity_step: float, resolution: float = None, vsini: float = 0,
+                          limb_darkening: float = 0.6) -> np.ndarray:
+    """
+    Instrumental (Gaussian with FWHM of c / resolution) and rotational broadening kernel on a grid of equal velocity steps
+    :param velocity_step: Step of the grid in km/s
+    :param resolution: Resolving power of the instrument, if None then no instrumental broadening
+    :param vsini: Projected rotational velocity in km/s, if 0 then no rotational broadening
+    :param limb_darkening: Linear limb darkening coefficient of the rotational broadening
+    :return: Kernel with an odd number of values and sum of 1, centered in the middle
+    """
+    kernel: np.ndarray = np.ones(1)
+    if resolution is not None:
+        sigma: float = SPEED_OF_LIGHT / resolution / (2 * np.sqrt(2 * np.log(2)))
+        half_width: int = int(np.ceil(GAUSSIAN_KERNEL_SIGMAS * sigma / velocity_step))
+        velocities: np.ndarray = np.arange(-half_width, half_width + 1) * velocity_step
+        kernel = np.convolve(kernel, np.exp(-0.5 * (velocities / sigma) ** 2))
+    if vsini > 0:
+        half_width: int = int(np.ceil(vsini / velocity_step))
+        # 1 - (v / vsini)^2, zero outside of the disc
+        disc: np.ndarray = np.clip(1 - (np.arange(-half_width, half_width + 1) * velocity_step / vsini) ** 2, 0, None)
+        kernel = np.convolve(kernel, 2 * (1 - limb_darkening) * np.sqrt(disc) + np.pi * limb_darkening / 2 * disc)
+    if kernel.sum() <= 0:
+        # narrower than one step
+        return np.ones(1)
+    return kernel / kernel.sum()
+
+
+class SpectrumResampler:
+    """
+    Resamples spectra from the synthetic wavelength grid onto the observed one, with broadening. Everything that
+    depends only on the two grids (the interpolation weights, the kernel and its FFT) is computed once here, so each
+    call of resample only interpolates and convolves the flux.
+
+    Without broadening, the flux is interpolated straight onto the observed grid. With broadening, it is first
+    interpolated onto a grid of equal velocity steps (equal steps of log wavelength) covering the observed wavelengths
+    and the kernel, convolved there with the kernel through FFT, and then interpolated onto the observed grid.
+    """
+    def __init__(self, synthetic_wavelengths: np.ndarray, observed_wavelengths: np.ndarray, resolution: float = None,
+                 vsini: float = 0, limb_darkening: float = 0.6, velocity_step: float = None):
+        """
+        :param synthetic_wavelengths: Sorted wavelengths of the synthetic spectra
+        :param observed_wavelengths: Wavelengths of the observed spectrum
+        :param resolution: Resolving power of the instrument, if None then no instrumental broadening
+        :param vsini: Projected rotational velocity in km/s, if 0 then no rotational broadening
+        :param limb_darkening: Linear limb darkening coefficient of the rotational broadening
+        :param velocity_step: Step of the grid for the convolution in km/s. If None, then the median step of the
+        synthetic spectra, so that no detail is lost
+        """
+        self.synthetic_wavelengths: np.ndarray = np.asarray(synthetic_wavelengths, dtype=np.float64)
+        self.observed_wavelengths: np.ndarray = np.asarray(observed_wavelengths, dtype=np.float64)
+        if np.any(self.synthetic_wavelengths[1:] < self.synthetic_wavelengths[:-1]):
+            raise ValueError("The wavelengths of the synthetic spectra must be sorted")
+        self.broadened: bool = resolution is not None or vsini > 0
+        if not self.broadened:
+            self.observed_weights: tuple = get_interpolation_weights(self.synthetic_wavelengths,
+                                                                     self.observed_wavelengths)
+            return
+        if velocity_step is None:
+            velocity_step = float(np.median(np.diff(self.synthetic_wavelengths) / self.synthetic_wavelengths[:-1])) * \
+                            SPEED_OF_LIGHT
+        self.velocity_step: float = velocity_step
+        self.kernel: np.ndarray = get_broadening_kernel(velocity_step, resolution, vsini, limb_darkening)
+        # pixels of the equal velocity grid that the kernel reaches on each side
+        self.kernel_half_width: int = len(self.kernel) // 2
+        # equal velocity grid from the bluest to the reddest observed wavelength, plus the kernel on both sides
+        log_step: float = np.log1p(velocity_step / SPEED_OF_LIGHT)
+        log_start: float = np.log(np.min(self.observed_wavelengths)) - (self.kernel_half_width + 1) * log_step
+        log_end: float = np.log(np.max(self.observed_wavelengths)) + (self.kernel_half_width + 1) * log_step
+        self.uniform_wavelengths: np.ndarray = np.exp(log_start + np.arange(int(np.ceil((log_end - log_start) / log_step))
+                                                                            + 1) * log_step)
+        self.uniform_weights: tuple = get_interpolation_weights(self.synthetic_wavelengths, self.uniform_wavelengths)
+        self.observed_weights: tuple = get_interpolation_weights(self.uniform_wavelengths, self.observed_wavelengths)
+        # padded with the edge values by the width of the kernel, so that the circular convolution of the FFT does
+        # not mix the two ends
+        self.fft_length: int = get_fft_length(len(self.uniform_wavelengths) + 2 * self.kernel_half_width)
+        wrapped_kernel: np.ndarray = np.zeros(self.fft_length)
+        wrapped_kernel[:self.kernel_half_width + 1] = self.kernel[self.kernel_half_width:]
+        if self.kernel_half_width > 0:
+            wrapped_kernel[-self.kernel_half_width:] = self.kernel[:self.kernel_half_width]
+        self.kernel_fft: np.ndarray = np.fft.rfft(wrapped_kernel)
+
+    def resample(self, flux: np.ndarray) -> np.ndarray:
+        """
+        :param flux: Flux of the synthetic spectra on the synthetic wavelengths, one row per model (or one spectrum)
+        :return: Broadened flux on the observed wavelengths, one row per model (or one spectrum)
+        """
+        flux = np.asarray(flux, dtype=np.float64)
+        if flux.shape[-1] != len(self.synthetic_wavelengths):
+            raise ValueError(f"Flux has {flux.shape[-1]} values, but there are {len(self.synthetic_wavelengths)} "
+                             f"synthetic wavelengths")
+        if not self.broadened:
+            return interpolate(flux, *self.observed_weights)
+        models: np.ndarray = flux.reshape(-1, flux.shape[-1])
+        resampled: np.ndarray = np.empty((len(models), len(self.observed_wavelengths)))
+        chunk_size: int = max(MAX_CHUNK_VALUES // self.fft_length, 1)
+        for chunk_start in range(0, len(models), chunk_size):
+            resampled[chunk_start:chunk_start + chunk_size] = \
+                self.resample_chunk(models[chunk_start:chunk_start + chunk_size])
+        return resampled.reshape(flux.shape[:-1] + (len(self.observed_wavelengths),))
+
+    def resample_chunk(self, models: np.ndarray) -> np.ndarray:
+        uniform_flux: np.ndarray = interpolate(models, *self.uniform_weights)
+        padded_flux: np.ndarray = np.pad(uniform_flux, ((0, 0), (self.kernel_half_width, self.kernel_half_width)),
+                                         mode="edge")
+        convolved_flux: np.ndarray = np.fft.irfft(np.fft.rfft(padded_flux, self.fft_length, axis=1) * self.kernel_fft,
+                                                  self.fft_length, axis=1)
+        convolved_flux = convolved_flux[:, self.kernel_half_width:self.kernel_half_width + len(self.uniform_wavelengths)]
+        return interpolate(convolved_flux, *self.observed_weights)
+
+
+def get_fft_length(minimum_length: int) -> int:
+    """
+    :param minimum_length: Smallest length needed
+    :return: Smallest length of the form 2^a 3^b 5^c, which numpy FFTs quickly, not smaller than minimum_length
+    """
+    fft_length: int = 2 ** int(np.ceil(np.log2(max(minimum_length, 1))))
+    for factor_3 in (1, 3, 9, 27):
+        for factor_5 in (1, 5, 25):
+            length: int = factor_3 * factor_5
+            while length < minimum_length:
+                length *= 2
+            fft_length = min(fft_length, length)
+    return fft_length
+
+
+def stack_spectra(spectra: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Puts synthetic spectra (e.g. from synt_grab) into one 2D array. Spectra on other wavelengths than the first one are
+    interpolated onto its wavelengths.
+    :param spectra: Spectra as arrays of (wavelength, flux, ...) rows
+    :return: Wavelengths of the first spectrum and the flux of all spectra, one row per spectrum
+    """
+    wavelengths: np.ndarray = np.asarray(spectra[0][:, 0], dtype=np.float64)
+    flux: np.ndarray = np.empty((len(spectra), len(wavelengths)))
+    for spectrum_index, spectrum in enumerate(spectra):
+        if len(spectrum) == len(wavelengths) and np.array_equal(spectrum[:, 0], wavelengths):
+            flux[spectrum_index] = spectrum[:, 1]
+        else:
+            flux[spectrum_index] = np.interp(wavelengths, spectrum[:, 0], spectrum[:, 1])
+    return wavelengths, flux
+
+
+def resample_spectra(synthetic_wavelengths: np.ndarray, synthetic_flux: np.ndarray, observed_wavelengths: np.ndarray,
+                     resolution: float = None, vsini: float = 0, limb_darkening: float = 0.6) -> np.ndarray:
+    """
+    Same as SpectrumResampler(...).resample(synthetic_flux), for one stack of spectra
+    """
+    return SpectrumResampler(synthetic_wavelengths, observed_wavelengths, resolution, vsini,
+                             limb_darkening).resample(synthetic_flux)
+
+
+def get_chi_squared(model_flux: np.ndarray, observed_flux: np.ndarray, observed_errors: np.ndarray = None,
+                    mask: np.ndarray = None) -> np.ndarray:
+    """
+    Chi squared of each model against the observation, for all models at once
+    :param model_flux: Resampled flux, one row per model
+    :param observed_flux: Observed flux
+    :param observed_errors: Errors of the observed flux, if None then 1
+    :param mask: If given, then only the pixels where it is True are used
+    :return: Chi squared of each model
+    """
+    residuals: np.ndarray = np.asarray(model_flux) - observed_flux
+    if observed_errors is not None:
+        residuals = residuals / observed_errors
+    if mask is not None:
+        residuals = residuals[..., mask]
+    return np.einsum("...i,...i->...", residuals, residuals)
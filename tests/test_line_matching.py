@@ -0,0 +1,90 @@
+"""
+match_lines must give for each line the same windows, nearest pixels and minima as looking at the lines one by one
+"""
+import numpy as np
+import pytest
+from line_matching import match_lines, find_nearest_indices, find_local_minima, extract_windows
+from line_table import LineTable
+
+
+@pytest.fixture(scope="module")
+def spectrum() -> np.ndarray:
+    # uneven pixels with absorption lines and noise, so that there are minima away from the lines too
+    random_generator: np.random.Generator = np.random.default_rng(4)
+    wavelengths: np.ndarray = np.sort(random_generator.uniform(5000, 5010, 2000))
+    flux: np.ndarray = np.ones(len(wavelengths))
+    for line_center, line_depth in ((5001, 0.5), (5003.3, 0.2), (5007, 0.8)):
+        flux -= line_depth * np.exp(-0.5 * ((wavelengths - line_center) / 0.05) ** 2)
+    flux += random_generator.normal(0, 0.01, len(wavelengths))
+    return np.column_stack((wavelengths, flux))
+
+
+def match_line(line_wavelength: float, spectrum: np.ndarray, window_half_width: float) -> tuple:
+    """
+    One line at a time: window, nearest pixel and nearest local minimum within the window (-1 if none)
+    """
+    wavelengths, flux = spectrum[:, 0], spectrum[:, 1]
+    window: list[int] = [pixel for pixel in range(len(wavelengths))
+                         if abs(wavelengths[pixel] - line_wavelength) <= window_half_width]
+    distances: np.ndarray = np.abs(wavelengths - line_wavelength)
+    nearest_pixel: int = int(np.argmin(distances))
+    minima: list[int] = [pixel for pixel in range(1, len(flux) - 1)
+                         if flux[pixel] < flux[pixel - 1] and flux[pixel] <= flux[pixel + 1]]
+    minimum_pixel: int = min(minima, key=lambda pixel: (distances[pixel], pixel)) if minima else -1
+    if minimum_pixel not in window:
+        minimum_pixel = -1
+    return window, nearest_pixel, minimum_pixel
+
+
+@pytest.mark.parametrize("window_half_width", [0.001, 0.1, 2])
+def test_match_lines_matches_one_by_one(spectrum, window_half_width):
+    line_wavelengths: np.ndarray = np.array([4990, 5000.0, 5001, 5003.3, 5003.31, 5007, 5009.99, 5020])
+    line_matches = match_lines(line_wavelengths, spectrum, window_half_width)
+    assert len(line_matches) == len(line_wavelengths)
+    for line_index, line_wavelength in enumerate(line_wavelengths):
+        window, nearest_pixel, minimum_pixel = match_line(line_wavelength, spectrum, window_half_width)
+        assert list(range(line_matches.window_starts[line_index], line_matches.window_ends[line_index])) == window
+        assert np.array_equal(line_matches.window(line_index), spectrum[window])
+        assert line_matches.nearest_pixels[line_index] == nearest_pixel
+        assert line_matches.minimum_pixels[line_index] == minimum_pixel
+        if minimum_pixel >= 0:
+            assert line_matches.depths[line_index] == 1 - spectrum[minimum_pixel, 1]
+        else:
+            assert np.isnan(line_matches.depths[line_index])
+    # the lines close to the absorption lines find their minimum
+    if window_half_width >= 0.1:
+        assert abs(line_matches.depths[2] - 0.5) < 0.05 and abs(line_matches.depths[5] - 0.8) < 0.05
+
+
+def test_match_lines_of_line_table(spectrum):
+    line_table: LineTable = LineTable(np.array([5001.0, 5007.0]), np.zeros(2, dtype=np.float32),
+                                      np.zeros(2, dtype=np.int16), np.ones(2, dtype=np.int8), ["Fe I"])
+    assert np.array_equal(match_lines(line_table, spectrum, 0.1).minimum_pixels,
+                          match_lines(line_table.wavelengths, spectrum, 0.1).minimum_pixels)
+
+
+def test_match_lines_rejects_unsorted_and_empty(spectrum):
+    with pytest.raises(ValueError):
+        match_lines([5001], spectrum[::-1], 0.1)
+    with pytest.raises(ValueError):
+        match_lines([5001], spectrum[:0], 0.1)
+
+
+def test_find_nearest_indices_and_local_minima():
+    assert find_nearest_indices(np.array([1.0, 2.0, 4.0]), np.array([0, 1.5, 1.6, 3, 3.1, 9])).tolist() == \
+           [0, 0, 1, 1, 2, 2]
+    assert find_nearest_indices(np.array([3.0]), np.array([1.0, 5.0])).tolist() == [0, 0]
+    # the first pixel of a flat bottom, not the edges
+    assert find_local_minima(np.array([0.5, 1, 0.8, 0.8, 0.9, 0.7, 1, 0.2])).tolist() == [2, 5]
+
+
+def test_extract_windows(spectrum):
+    window_starts, window_ends = np.array([0, 10, 20]), np.array([3, 10, 25])
+    window_wavelengths, window_flux = extract_windows(spectrum, window_starts, window_ends)
+    assert window_flux.shape == (3, 5)
+    for window_index, (window_start, window_end) in enumerate(zip(window_starts, window_ends)):
+        window_length: int = window_end - window_start
+        assert np.array_equal(window_wavelengths[window_index, :window_length], spectrum[window_start:window_end, 0])
+        assert np.array_equal(window_flux[window_index, :window_length], spectrum[window_start:window_end, 1])
+        assert np.all(np.isnan(window_flux[window_index, window_length:]))
+    assert extract_windows(spectrum, window_starts, window_ends, max_pixels=2)[1].shape == (3, 2)
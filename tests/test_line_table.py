@@ -0,0 +1,134 @@
+"""
+LineTable and its queries must give the same lines as read_element_data and find_elements on the list of tuples
+"""
+import numpy as np
+import pytest
+from benchmark import generate_linelists
+from line_table import LineTable, LineQuery, read_line_table, find_elements_in_table, find_element_in_table, \
+    normalize_species_name
+from trimmer import get_linelist_files, read_element_data, find_elements, find_element
+
+# (left wavelength, right wavelength, loggf threshold)
+WINDOW_CASES: list = [(4000, 7000, -100), (4500, 4510, -1.5), (5000.5, 5000.5, -100), (3000, 3500, -100),
+                      (6990, 8000, 0.0), (4100, 4900, -0.1)]
+
+
+@pytest.fixture(scope="module")
+def linelist_lines(tmp_path_factory) -> list[str]:
+    old_path_name: str = str(tmp_path_factory.mktemp("linelists"))
+    generate_linelists(old_path_name, number_of_elements=4, lines_per_element=500, number_of_molecules=1,
+                       lines_per_molecule=1500, seed=3)
+    lines: list[str] = []
+    for linelist_path in get_linelist_files(old_path_name):
+        with open(linelist_path) as linelist_file:
+            lines.extend(linelist_file.readlines())
+    return lines
+
+
+@pytest.fixture(scope="module")
+def elements_data(linelist_lines) -> list:
+    return read_element_data(linelist_lines)
+
+
+@pytest.fixture(scope="module")
+def line_table(linelist_lines) -> LineTable:
+    return read_line_table(linelist_lines)
+
+
+def test_read_line_table_matches_read_element_data(elements_data, line_table):
+    assert len(line_table) == len(elements_data) > 0
+    assert line_table.to_list() == [list(element_data) for element_data in elements_data]
+    assert line_table[5] == elements_data[5]
+
+
+@pytest.mark.parametrize("left_wavelength, right_wavelength, loggf_threshold", WINDOW_CASES)
+def test_find_elements_in_table_matches_find_elements(elements_data, line_table, left_wavelength, right_wavelength,
+                                                      loggf_threshold):
+    expected_lines: list = find_elements(elements_data, left_wavelength, right_wavelength, loggf_threshold)
+    assert find_elements_in_table(line_table, left_wavelength, right_wavelength, loggf_threshold).to_list() == \
+           expected_lines
+    # find_elements hands a LineTable over to find_elements_in_table
+    assert find_elements(line_table, left_wavelength, right_wavelength, loggf_threshold).to_list() == expected_lines
+
+
+def test_loggf_threshold_equal_to_line(elements_data, line_table):
+    # a threshold equal to the loggf of a line keeps that line, although loggf is float32 in the table
+    wavelength, _, loggf = elements_data[7]
+    assert [wavelength, elements_data[7][1], loggf] in \
+           find_elements_in_table(line_table, wavelength, wavelength, loggf).to_list()
+
+
+@pytest.mark.parametrize("species_index", [False, True])
+def test_line_query_matches_find_elements(elements_data, line_table, species_index):
+    line_query: LineQuery = LineQuery(line_table, species_index=species_index)
+    for left_wavelength, right_wavelength, loggf_threshold in WINDOW_CASES:
+        assert line_query.query(left_wavelength, right_wavelength, loggf_threshold).to_list() == \
+               find_elements(elements_data, left_wavelength, right_wavelength, loggf_threshold)
+    left_wavelengths, right_wavelengths, loggf_thresholds = (np.asarray(column) for column in zip(*WINDOW_CASES))
+    # one threshold per window, and one threshold for all windows
+    assert [lines_in_window.to_list() for lines_in_window in
+            line_query.query_windows(left_wavelengths, right_wavelengths, loggf_thresholds)] == \
+           [find_elements(elements_data, *window_case) for window_case in WINDOW_CASES]
+    assert [lines_in_window.to_list() for lines_in_window in
+            line_query.query_windows(left_wavelengths, right_wavelengths, -1.0)] == \
+           [find_elements(elements_data, left_wavelength, right_wavelength, -1.0)
+            for left_wavelength, right_wavelength, _ in WINDOW_CASES]
+    assert line_query.count_windows(left_wavelengths, right_wavelengths, -1.0).tolist() == \
+           [len(find_elements(elements_data, left_wavelength, right_wavelength, -1.0))
+            for left_wavelength, right_wavelength, _ in WINDOW_CASES]
+
+
+@pytest.mark.parametrize("left_wavelength, right_wavelength, number_of_lines",
+                         [(4000, 7000, 10), (4500, 4700, 3), (4500, 4502, 50), (3000, 3500, 5)])
+def test_strongest_lines_match_sorted_find_elements(elements_data, line_table, left_wavelength, right_wavelength,
+                                                    number_of_lines):
+    line_query: LineQuery = LineQuery(line_table)
+    species_name: str = line_table.species_names[1]
+    species_lines: list = find_element(find_elements(elements_data, left_wavelength, right_wavelength, -100),
+                                       species_name.strip())
+    strongest_lines: list = line_query.strongest_lines(species_name, left_wavelength, right_wavelength,
+                                                       number_of_lines).to_list()
+    # lines with the same loggf can come in any order, so only the loggf are compared in order
+    assert [loggf for _, _, loggf in strongest_lines] == \
+           sorted((loggf for _, _, loggf in species_lines), reverse=True)[:number_of_lines]
+    assert all([wavelength, species_name.strip(), loggf] in species_lines
+               for wavelength, _, loggf in strongest_lines)
+
+
+def test_strongest_lines_need_species_index(line_table):
+    with pytest.raises(ValueError):
+        LineQuery(line_table, species_index=False).strongest_lines(0, 4000, 7000, 5)
+
+
+@pytest.mark.parametrize("species_name, normalized_name",
+                         [("Fe I", "Fe I"), ("Fe I    ", "Fe I"), ("  Fe  II ", "Fe II"), ("Fe\tII", "Fe II"),
+                          ("CN", "CN"), ("", "")])
+def test_normalize_species_name(species_name, normalized_name):
+    assert normalize_species_name(species_name) == normalized_name
+
+
+def test_find_element_in_table_matches_find_element(elements_data, line_table):
+    for species_name in line_table.species_names:
+        expected_lines: list = find_element(elements_data, normalize_species_name(species_name))
+        assert len(expected_lines) > 0
+        # the table keeps the element names as they were read, find_element gives them normalized
+        for element_name in (normalize_species_name(species_name), f" {species_name}  "):
+            assert [[wavelength, normalize_species_name(line_element_name), loggf]
+                    for wavelength, line_element_name, loggf in
+                    find_element_in_table(line_table, element_name).to_list()] == expected_lines
+    assert len(find_element_in_table(line_table, "Xx IX")) == 0
+
+
+def test_species_index_elements_and_ionization(elements_data, line_table):
+    species_index = line_table.get_species_index()
+    element_symbol, _ = normalize_species_name(line_table.species_names[0]).split(" ")
+    element_lines: list = [list(element_data) for element_data in elements_data
+                           if normalize_species_name(element_data[1]).startswith(f"{element_symbol} ")]
+    assert {normalize_species_name(element_data[1]) for element_data in element_lines} == \
+           {f"{element_symbol} I", f"{element_symbol} II"}
+    # rows are in the order of the table, for one species or several
+    assert species_index.find(element=element_symbol).to_list() == element_lines
+    assert species_index.find(species=[f"{element_symbol} II", f"{element_symbol} I"]).to_list() == element_lines
+    assert species_index.find(element=element_symbol, ionization=2).to_list() == \
+           [element_data for element_data in element_lines if normalize_species_name(element_data[1]).endswith(" II")]
+    assert species_index.get_species_codes(species=[0, line_table.species_names[0]], element="Xx") == [0]
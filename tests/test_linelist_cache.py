@@ -0,0 +1,135 @@
+"""
+Trimmed linelists from the cache (hits, and subsets trimmed from a cached entry) must be the same as trimming the old
+linelist directly
+"""
+import os
+import pytest
+from benchmark import generate_linelists
+from linelist_cache import TrimmedLinelistCache
+from test_linelist_trimming import read_tree, trim_into_tree
+
+
+@pytest.fixture(scope="module")
+def linelist_folder(tmp_path_factory) -> str:
+    old_path_name: str = str(tmp_path_factory.mktemp("linelists"))
+    generate_linelists(old_path_name, number_of_elements=3, lines_per_element=300, number_of_molecules=1,
+                       lines_per_molecule=1000, seed=2)
+    return old_path_name
+
+
+def write_element_linelist(old_path_name: str, wavelengths: list[float]):
+    os.makedirs(old_path_name)
+    with open(os.path.join(old_path_name, "fe.bsyn"), "w") as linelist_file:
+        linelist_file.write(f"'  26.000              '    1    {len(wavelengths)}\n'Fe I    LTE'\n")
+        for line_number, wavelength in enumerate(wavelengths):
+            linelist_file.write(f"  {wavelength:.3f}  1.0  -1.{line_number}  7.5  9.0  1e8 'x' 'x'  0.0  1.0\n")
+
+
+def trim_with_cache(cache: TrimmedLinelistCache, old_path_name: str, work_dir: str, seg_begins: list,
+                    seg_ends: list, molecules_flag: bool = True, lbl: bool = False,
+                    do_hydrogen: bool = True) -> tuple[str, dict[str, bytes]]:
+    new_path_name: str = os.path.join(work_dir, f"cached_{len(os.listdir(work_dir))}")
+    result: str = cache.create_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, molecules_flag,
+                                               lbl, do_hydrogen)
+    return result, read_tree(new_path_name)
+
+
+@pytest.mark.parametrize("lbl", [False, True])
+def test_hit_and_subset_match_direct_trim(linelist_folder, tmp_path, lbl):
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    requests: list = [([4000, 5000, 6000], [4600, 5600, 6600], "miss"),
+                      ([4000, 5000, 6000], [4600, 5600, 6600], "hit"),
+                      ([4100, 6050], [4300, 6400], "subset"),
+                      ([4100, 6050], [4300, 6400], "hit"),
+                      # reaches out of the cached segments
+                      ([4500], [4700], "miss")]
+    for seg_begins, seg_ends, expected_result in requests:
+        result, cached_tree = trim_with_cache(cache, linelist_folder, work_dir, seg_begins, seg_ends, lbl=lbl)
+        assert result == expected_result, (seg_begins, seg_ends)
+        assert cached_tree == trim_into_tree(linelist_folder, str(tmp_path), seg_begins, seg_ends, True, lbl, True)
+        assert sum(len(linelist) for linelist in cached_tree.values()) > 0
+
+
+def test_flags_not_in_cached_entry_miss(linelist_folder, tmp_path):
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4000], [7000], molecules_flag=False, lbl=True)[0] == \
+           "miss"
+    # the cached entry has no molecules, and its elements are split by segment
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4100], [4200], molecules_flag=True)[0] == "miss"
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4100], [4200], molecules_flag=False)[0] == "subset"
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4100], [4200], do_hydrogen=False)[0] == "miss"
+
+
+def test_changed_linelist_misses(linelist_folder, tmp_path):
+    old_path_name: str = str(tmp_path / "old")
+    write_element_linelist(old_path_name, [4001, 4002, 4003])
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    assert trim_with_cache(cache, old_path_name, work_dir, [4000], [4005])[0] == "miss"
+    os.remove(os.path.join(old_path_name, "fe.bsyn"))
+    write_element_linelist(str(tmp_path / "other"), [4001, 4004])
+    os.replace(str(tmp_path / "other" / "fe.bsyn"), os.path.join(old_path_name, "fe.bsyn"))
+    result, cached_tree = trim_with_cache(cache, old_path_name, work_dir, [4000], [4005])
+    assert result == "miss"
+    assert cached_tree == trim_into_tree(old_path_name, str(tmp_path), [4000], [4005], True, False, True)
+
+
+@pytest.mark.parametrize("seg_begin, seg_end",
+                         [(4003, 4004), (4003, 4003), (4002, 4003.5), (4004, 4005), (4003.5, 4005)])
+def test_subset_begins_at_last_cached_line(tmp_path, seg_begin, seg_end):
+    # the cached element ends at a repeated wavelength, whose lines the trimmer keeps only from the whole element
+    old_path_name: str = str(tmp_path / "old")
+    write_element_linelist(old_path_name, [4001, 4002, 4003, 4003, 4010])
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    assert trim_with_cache(cache, old_path_name, work_dir, [4000], [4005])[0] == "miss"
+    result, cached_tree = trim_with_cache(cache, old_path_name, work_dir, [seg_begin], [seg_end])
+    assert cached_tree == trim_into_tree(old_path_name, str(tmp_path), [seg_begin], [seg_end], True, False, True)
+    assert result == ("miss" if seg_begin == 4003 else "subset")
+
+
+def test_find_superset_entry_picks_smallest(linelist_folder, tmp_path):
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    trim_with_cache(cache, linelist_folder, work_dir, [4000], [7000])
+    trim_with_cache(cache, linelist_folder, work_dir, [4400], [4800])
+    # overlapping cached segments would repeat lines
+    trim_with_cache(cache, linelist_folder, work_dir, [4400, 4450], [4600, 4700])
+    entries: dict = {tuple(entry_meta["segment_begins"]): entry_path for entry_path, entry_meta in cache.iter_entries()}
+    meta: dict = next(entry_meta for _, entry_meta in cache.iter_entries() if entry_meta["segment_begins"] == [4400])
+    assert cache.find_superset_entry(dict(meta, segment_begins=[4500.0], segment_ends=[4600.0])) == entries[(4400,)]
+    assert cache.find_superset_entry(dict(meta, segment_begins=[4300.0], segment_ends=[4600.0])) == entries[(4000,)]
+    assert cache.find_superset_entry(dict(meta, segment_begins=[3000.0], segment_ends=[4600.0])) is None
+    assert cache.find_superset_entry(dict(meta, snapshot_key="other", segment_begins=[4500.0],
+                                          segment_ends=[4600.0])) is None
+
+
+def test_evict_least_recently_used(linelist_folder, tmp_path):
+    cache: TrimmedLinelistCache = TrimmedLinelistCache(str(tmp_path / "cache"))
+    work_dir: str = str(tmp_path / "work")
+    os.makedirs(work_dir)
+    for seg_begin in (4000, 5000, 6000):
+        trim_with_cache(cache, linelist_folder, work_dir, [seg_begin], [seg_begin + 500])
+    entries: dict = {entry_meta["segment_begins"][0]: entry_path for entry_path, entry_meta in cache.iter_entries()}
+    os.utime(os.path.join(entries[4000], "meta.json"), (1, 1))
+    os.utime(os.path.join(entries[5000], "meta.json"), (2, 2))
+    os.utime(os.path.join(entries[6000], "meta.json"), (3, 3))
+    # the hit makes the oldest entry the most recently used one
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4000], [4500])[0] == "hit"
+    sizes: dict = {entry_meta["segment_begins"][0]: entry_meta["size"] for _, entry_meta in cache.iter_entries()}
+    cache.max_bytes = sizes[4000] + sizes[6000]
+    cache.evict()
+    assert sorted(entry_meta["segment_begins"][0] for _, entry_meta in cache.iter_entries()) == [4000, 6000]
+    # the linelists linked from the cache are not removed with it
+    assert read_tree(os.path.join(work_dir, "cached_1")) == \
+           trim_into_tree(linelist_folder, str(tmp_path), [5000], [5500], True, False, True)
+    cache.clear()
+    assert list(cache.iter_entries()) == []
+    assert trim_with_cache(cache, linelist_folder, work_dir, [4000], [4500])[0] == "miss"
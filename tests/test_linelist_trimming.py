@@ -0,0 +1,208 @@
+"""
+The readers of create_window_linelist, the binary linelist folders and the incremental update must all give the same
+trimmed linelists as the readlines reader, byte for byte
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+import trimmer
+from benchmark import generate_linelists
+from linelist_binary import convert_linelists_to_binary, convert_binary_to_linelists
+from linelist_update import update_window_linelist
+
+SEGMENT_CASES: list = [
+    ([4500], [4600]),
+    # not sorted, the last one reaches past the last line
+    ([4100, 5000, 4700, 5999.5], [4200, 5100, 4800, 7500]),
+    # no lines at all
+    ([3000], [3500]),
+    # overlapping
+    ([4100, 4150], [4200, 4300]),
+    (list(np.linspace(4000, 6990, 40)), list(np.linspace(4000, 6990, 40) + 2)),
+]
+# (molecules_flag, do_hydrogen)
+FLAG_CASES: list = [(True, True), (False, False)]
+READER_OPTIONS: list = [
+    {"reader": "index"},
+    {"reader": "mmap"},
+    {"reader": "seek"},
+    {"reader": "readlines", "use_manifest": True},
+    {"reader": "index", "use_manifest": True},
+    {"reader": "mmap", "use_manifest": True},
+    {"reader": "readlines", "workers": 3},
+    {"reader": "index", "workers": 3},
+    {"reader": "mmap", "workers": 3, "use_manifest": True},
+    {"reader": "seek", "workers": 3},
+]
+
+
+def read_tree(path: str) -> dict[str, bytes]:
+    """
+    :return: Relative path: content of all files in the folder, without hidden files and folders
+    """
+    tree: dict[str, bytes] = {}
+    for root, folders, files in os.walk(path):
+        folders[:] = [folder for folder in folders if not folder.startswith(".")]
+        for file in files:
+            if not file.startswith("."):
+                with open(os.path.join(root, file), "rb") as tree_file:
+                    tree[os.path.relpath(os.path.join(root, file), path)] = tree_file.read()
+    return tree
+
+
+def get_element_blocks(linelist: bytes) -> list[bytes]:
+    """
+    :return: Element blocks of a linelist, sorted, to compare linelists whose blocks may be in another order
+    """
+    lines: list[bytes] = linelist.splitlines(keepends=True)
+    element_blocks: list[bytes] = []
+    line_number: int = 0
+    while line_number < len(lines):
+        number_of_lines: int = int(lines[line_number].split()[-1])
+        element_blocks.append(b"".join(lines[line_number:line_number + 2 + number_of_lines]))
+        line_number += 2 + number_of_lines
+    return sorted(element_blocks)
+
+
+def trim_into_tree(old_path_name: str, work_dir: str, seg_begins: list, seg_ends: list, molecules_flag: bool,
+                   lbl: bool, do_hydrogen: bool, **trim_kwargs) -> dict[str, bytes]:
+    new_path_name: str = os.path.join(tempfile.mkdtemp(dir=work_dir), "trimmed")
+    trimmer.create_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, molecules_flag, lbl,
+                                   do_hydrogen, **trim_kwargs)
+    return read_tree(new_path_name)
+
+
+def copy_linelists(old_path_name: str, new_path_name: str):
+    # without the indices and manifest, so that they are built for the copy
+    shutil.copytree(old_path_name, new_path_name, ignore=shutil.ignore_patterns(".*"))
+
+
+@pytest.fixture(scope="module")
+def linelist_folder(tmp_path_factory) -> str:
+    old_path_name: str = str(tmp_path_factory.mktemp("linelists"))
+    linelist_paths: list[str] = generate_linelists(old_path_name, number_of_elements=4, lines_per_element=300,
+                                                   number_of_molecules=1, lines_per_molecule=3000, seed=1)
+    # an atom and a molecule without a newline after the last line
+    for linelist_path in (linelist_paths[1], linelist_paths[-2]):
+        with open(linelist_path, "rb") as linelist_file:
+            linelist: bytes = linelist_file.read()
+        with open(linelist_path, "wb") as linelist_file:
+            linelist_file.write(linelist.rstrip(b"\n"))
+    return old_path_name
+
+
+@pytest.fixture(scope="module")
+def reference_trees(linelist_folder, tmp_path_factory) -> dict:
+    """
+    Trimmed linelists of the readlines reader for all cases: (segment case, flags, lbl): tree
+    """
+    work_dir: str = str(tmp_path_factory.mktemp("reference"))
+    return {(case_index, flags, lbl): trim_into_tree(linelist_folder, work_dir, seg_begins, seg_ends, flags[0], lbl,
+                                                     flags[1])
+            for case_index, (seg_begins, seg_ends) in enumerate(SEGMENT_CASES) for flags in FLAG_CASES
+            for lbl in (False, True)}
+
+
+@pytest.mark.parametrize("trim_kwargs", READER_OPTIONS,
+                         ids=lambda trim_kwargs: "-".join(map(str, trim_kwargs.values())))
+def test_readers_match_readlines(linelist_folder, reference_trees, tmp_path, monkeypatch, trim_kwargs):
+    # the test linelists are far too small to be trimmed in parallel otherwise
+    monkeypatch.setattr(trimmer, "PARALLEL_TRIM_MIN_BYTES", 0)
+    for (case_index, flags, lbl), reference_tree in reference_trees.items():
+        seg_begins, seg_ends = SEGMENT_CASES[case_index]
+        assert trim_into_tree(linelist_folder, str(tmp_path), seg_begins, seg_ends, flags[0], lbl, flags[1],
+                              **trim_kwargs) == reference_tree, (case_index, flags, lbl)
+
+
+def test_readers_trim_something(reference_trees):
+    # otherwise the comparisons above would pass with empty linelists
+    assert sum(len(linelist) for linelist in reference_trees[(0, (True, True), False)].values()) > 0
+    assert len(reference_trees[(4, (True, True), True)]) > 40
+
+
+def test_binary_round_trip(linelist_folder, tmp_path):
+    binary_path_name: str = str(tmp_path / "binary")
+    convert_linelists_to_binary(linelist_folder, binary_path_name)
+    convert_binary_to_linelists(binary_path_name, str(tmp_path / "text"))
+    assert read_tree(str(tmp_path / "text")) == read_tree(linelist_folder)
+
+
+@pytest.mark.parametrize("reader", ["readlines", "index", "seek"])
+def test_trim_from_binary(linelist_folder, reference_trees, tmp_path, reader):
+    binary_path_name: str = str(tmp_path / "binary")
+    convert_linelists_to_binary(linelist_folder, binary_path_name)
+    for (case_index, flags, lbl), reference_tree in reference_trees.items():
+        seg_begins, seg_ends = SEGMENT_CASES[case_index]
+        assert trim_into_tree(binary_path_name, str(tmp_path), seg_begins, seg_ends, flags[0], lbl, flags[1],
+                              reader=reader) == reference_tree, (case_index, flags, lbl)
+
+
+def test_binary_folder_with_changed_files(linelist_folder, tmp_path):
+    binary_path_name: str = str(tmp_path / "binary")
+    linelist_names: list[str] = [os.path.basename(linelist_path)
+                                 for linelist_path in convert_linelists_to_binary(linelist_folder, binary_path_name)]
+    os.remove(os.path.join(binary_path_name, linelist_names[0]))
+    for added_name in ("b_added.bsyn", "a_added.bsyn"):
+        shutil.copyfile(os.path.join(linelist_folder, linelist_names[1]), os.path.join(binary_path_name, added_name))
+    # removed files are left out of the saved order, added ones go at the end sorted by name
+    assert [os.path.basename(linelist_path) for linelist_path in trimmer.get_linelist_files(binary_path_name)] == \
+           linelist_names[1:] + ["a_added.bsyn", "b_added.bsyn"]
+    trimmed_tree: dict[str, bytes] = trim_into_tree(binary_path_name, str(tmp_path), [4000], [7000], True, False, True)
+    assert len(trimmed_tree) == len(linelist_names) + 1
+
+
+def change_linelists(old_path_name: str, step: int):
+    """
+    Touches, changes, adds or removes one linelist of the folder, depending on the step
+    """
+    linelist_paths: list[str] = sorted(entry.path for entry in os.scandir(old_path_name) if entry.is_file())
+    linelist_path: str = linelist_paths[step % len(linelist_paths)]
+    if step % 4 == 0:
+        os.utime(linelist_path)
+    elif step % 4 == 1:
+        # one line less in the first block
+        with open(linelist_path) as linelist_file:
+            lines: list[str] = linelist_file.readlines()
+        number_of_lines: int = int(lines[0].split()[-1])
+        lines[0] = f"{lines[0].rsplit(None, 1)[0]}    {number_of_lines - 1}\n"
+        del lines[1 + number_of_lines]
+        with open(linelist_path, "w") as linelist_file:
+            linelist_file.writelines(lines)
+    elif step % 4 == 2:
+        shutil.copyfile(linelist_path, os.path.join(old_path_name, f"added_{step}.bsyn"))
+    else:
+        os.remove(linelist_path)
+
+
+@pytest.mark.parametrize("lbl", [False, True])
+@pytest.mark.parametrize("combined_linelist_name", [None, "combined_linelist.bsyn"])
+def test_update_matches_full_trim(linelist_folder, tmp_path, lbl, combined_linelist_name):
+    old_path_name: str = str(tmp_path / "old")
+    new_path_name: str = str(tmp_path / "updated")
+    copy_linelists(linelist_folder, old_path_name)
+    seg_begins, seg_ends = [4100, 5000, 6100], [4400, 5600, 6500]
+    for step in range(6):
+        update_window_linelist(seg_begins, seg_ends, old_path_name, new_path_name, True, lbl,
+                               combined_linelist_name=combined_linelist_name)
+        updated_tree: dict[str, bytes] = read_tree(new_path_name)
+        full_path_name: str = str(tmp_path / f"full_{step}")
+        trimmer.create_window_linelist(seg_begins, seg_ends, old_path_name, full_path_name, True, lbl)
+        if combined_linelist_name is not None:
+            trimmer.combine_linelists(full_path_name, combined_linelist_name)
+        full_tree: dict[str, bytes] = read_tree(full_path_name)
+        if combined_linelist_name is not None:
+            # the combined linelists have the files in another order
+            assert sorted(updated_tree) == sorted(full_tree)
+            for combined_linelist in full_tree:
+                assert get_element_blocks(updated_tree[combined_linelist]) == \
+                       get_element_blocks(full_tree[combined_linelist]), (step, combined_linelist)
+        else:
+            # the trimmed linelists of added files have other numbers
+            for segment_folder in {os.path.dirname(linelist) for linelist in list(full_tree) + list(updated_tree)}:
+                assert sorted(content for linelist, content in updated_tree.items()
+                              if os.path.dirname(linelist) == segment_folder) == \
+                       sorted(content for linelist, content in full_tree.items()
+                              if os.path.dirname(linelist) == segment_folder), (step, segment_folder)
+        change_linelists(old_path_name, step)
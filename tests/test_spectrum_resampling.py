@@ -0,0 +1,109 @@
+"""
+SpectrumResampler must interpolate like np.interp without broadening, and broaden without changing the continuum or
+the equivalent width of the lines
+"""
+import numpy as np
+import pytest
+import spectrum_resampling
+from spectrum_resampling import SpectrumResampler, get_broadening_kernel, get_fft_length, resample_spectra, \
+    stack_spectra, get_chi_squared
+
+
+@pytest.fixture(scope="module")
+def synthetic_spectra() -> tuple[np.ndarray, np.ndarray]:
+    # a few models with one absorption line of different depths, on a grid of equal steps like synt_grab gives
+    wavelengths: np.ndarray = np.arange(5990, 6010, 0.01)
+    line_depths: np.ndarray = np.array([0.0, 0.2, 0.5, 0.9])
+    flux: np.ndarray = 1 - line_depths[:, None] * np.exp(-0.5 * ((wavelengths - 6000) / 0.05) ** 2)
+    return wavelengths, flux
+
+
+def get_equivalent_width(wavelengths: np.ndarray, flux: np.ndarray) -> np.ndarray:
+    return np.sum((1 - (flux[..., 1:] + flux[..., :-1]) / 2) * np.diff(wavelengths), axis=-1)
+
+
+def test_unbroadened_equals_interp(synthetic_spectra):
+    wavelengths, flux = synthetic_spectra
+    # uneven, unsorted and reaching past both ends of the synthetic spectra
+    observed_wavelengths: np.ndarray = np.concatenate((np.random.default_rng(5).uniform(5985, 6015, 500),
+                                                       wavelengths[::7]))
+    resampled: np.ndarray = SpectrumResampler(wavelengths, observed_wavelengths).resample(flux)
+    assert resampled.shape == (len(flux), len(observed_wavelengths))
+    for model_flux, resampled_flux in zip(flux, resampled):
+        np.testing.assert_allclose(resampled_flux, np.interp(observed_wavelengths, wavelengths, model_flux),
+                                   rtol=0, atol=1e-12)
+    # one spectrum instead of a stack
+    np.testing.assert_allclose(resample_spectra(wavelengths, flux[2], observed_wavelengths), resampled[2], rtol=0,
+                               atol=1e-12)
+
+
+@pytest.mark.parametrize("resolution, vsini", [(20000, 0), (None, 30), (50000, 10)])
+def test_constant_spectrum_stays_constant(synthetic_spectra, resolution, vsini):
+    wavelengths, _ = synthetic_spectra
+    observed_wavelengths: np.ndarray = np.linspace(5991, 6009, 700)
+    resampled: np.ndarray = SpectrumResampler(wavelengths, observed_wavelengths, resolution,
+                                              vsini).resample(np.full((2, len(wavelengths)), 0.7))
+    np.testing.assert_allclose(resampled, 0.7, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("vsini", [5, 30])
+@pytest.mark.parametrize("resolution", [None, 20000])
+def test_broadening_conserves_equivalent_width(synthetic_spectra, resolution, vsini):
+    wavelengths, flux = synthetic_spectra
+    observed_wavelengths: np.ndarray = np.arange(5992, 6008, 0.005)
+    broadened: np.ndarray = SpectrumResampler(wavelengths, observed_wavelengths, resolution, vsini).resample(flux)
+    unbroadened: np.ndarray = SpectrumResampler(wavelengths, observed_wavelengths).resample(flux)
+    np.testing.assert_allclose(get_equivalent_width(observed_wavelengths, broadened),
+                               get_equivalent_width(observed_wavelengths, unbroadened), rtol=1e-3, atol=1e-6)
+    # the line is shallower after broadening
+    assert np.min(broadened[3]) > np.min(unbroadened[3]) + 0.1
+
+
+def test_chunks_give_same_flux(synthetic_spectra, monkeypatch):
+    wavelengths, flux = synthetic_spectra
+    observed_wavelengths: np.ndarray = np.linspace(5991, 6009, 700)
+    resampler: SpectrumResampler = SpectrumResampler(wavelengths, observed_wavelengths, 20000, 10)
+    resampled: np.ndarray = resampler.resample(flux)
+    # one model per chunk
+    monkeypatch.setattr(spectrum_resampling, "MAX_CHUNK_VALUES", 1)
+    np.testing.assert_allclose(resampler.resample(flux), resampled, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(resampler.resample(flux[1]), resampled[1], rtol=0, atol=1e-12)
+
+
+def test_resampler_rejects_bad_input(synthetic_spectra):
+    wavelengths, flux = synthetic_spectra
+    with pytest.raises(ValueError):
+        SpectrumResampler(wavelengths[::-1], wavelengths)
+    with pytest.raises(ValueError):
+        SpectrumResampler(wavelengths, wavelengths).resample(flux[:, 1:])
+
+
+def test_broadening_kernel():
+    for resolution, vsini in ((20000, 0), (None, 30), (50000, 10)):
+        kernel: np.ndarray = get_broadening_kernel(0.5, resolution, vsini)
+        assert len(kernel) % 2 == 1 and np.isclose(kernel.sum(), 1)
+        np.testing.assert_allclose(kernel, kernel[::-1])
+    # narrower than one step, so it changes nothing
+    assert get_broadening_kernel(100, vsini=1)[np.nonzero(get_broadening_kernel(100, vsini=1))].tolist() == [1.0]
+
+
+def test_fft_length():
+    for minimum_length in (1, 7, 100, 1000, 4097):
+        fft_length: int = get_fft_length(minimum_length)
+        assert minimum_length <= fft_length <= 2 ** int(np.ceil(np.log2(minimum_length)))
+        for factor in (2, 3, 5):
+            while fft_length % factor == 0:
+                fft_length //= factor
+        assert fft_length == 1
+
+
+def test_stack_spectra_and_chi_squared(synthetic_spectra):
+    wavelengths, flux = synthetic_spectra
+    other_wavelengths: np.ndarray = wavelengths[::2] + 0.003
+    stacked_wavelengths, stacked_flux = stack_spectra([np.column_stack((wavelengths, flux[0])),
+                                                       np.column_stack((other_wavelengths, flux[1][::2]))])
+    assert np.array_equal(stacked_wavelengths, wavelengths) and np.array_equal(stacked_flux[0], flux[0])
+    np.testing.assert_allclose(stacked_flux[1], np.interp(wavelengths, other_wavelengths, flux[1][::2]))
+    chi_squared: np.ndarray = get_chi_squared(flux, flux[1], np.full(len(wavelengths), 0.5))
+    np.testing.assert_allclose(chi_squared, np.sum(((flux - flux[1]) / 0.5) ** 2, axis=1))
+    assert chi_squared[1] == 0
@@ -3,16 +3,33 @@ A set of scripts for cutting files with spectral lines
 and drawing them in a synthetic spectrum
 """
 import os
-import datetime
 import numpy as np
 import logging
 import shutil
-import re
+import mmap
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from file_processor import synt_grab, obs_grab
+from file_utils import get_biggest_first_order
+from linelist_index import parse_element_header, load_linelist_index, load_linelist_order, LinelistIndex
+from linelist_mmap import iter_mmap_blocks, find_line_start, get_wavelength_at, find_segment_byte_range, count_lines, \
+    SeekableLinelistFile
+from linelist_manifest import LinelistManifest, LinelistManifestEntry, load_linelist_manifest
+from linelist_stats import TrimStats, stage_timer, WORKER_TIMING_PREFIX
+from linelist_writer import LinelistWriter, CombinedLinelistWriter, LinelistElement, link_or_copy
+from line_table import LineTable, read_line_table, find_elements_in_table, find_element_in_table, normalize_species_name
+
+# binary search for one segment costs about this many times log2(number of lines) of parsing one line. Above that
+# it is faster to parse all wavelengths of the element and search all segments at once
+BATCHED_SEARCH_COST_RATIO: float = 4
+# below this total size of the linelists, starting the processes takes longer than trimming the files serially
+PARALLEL_TRIM_MIN_BYTES: int = 50 * 1024 * 1024
 
 
 def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[float], old_path_name: str,
-                           new_path_name: str, molecules_flag: bool, lbl=False, do_hydrogen=True):
+                           new_path_name: str, molecules_flag: bool, lbl=False, do_hydrogen=True, reader="readlines",
+                           index_dir: str = None, workers: int = 1, use_manifest: bool = False,
+                           stats: TrimStats = None) -> TrimStats:
     """
     Creates a new linelist from the old one, but only with the lines that are within the given segments. If lbl is True,
     then the linelist is created for each segment separately. If lbl is False, then the linelist is created for all
@@ -25,8 +42,82 @@ def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[f
     :param lbl: If True, then the linelist is created for each segment separately. If False, then the linelist is created
     for all segments together in the same folder. /new_path_name/0/*
     :param do_hydrogen: If False, then the linelist is not created for hydrogen.
+    :param reader: How the linelists are read. 'readlines' reads the whole file as text. 'index' uses the wavelength
+    index saved next to the linelist (built on the first use and rebuilt if the file changes) and only copies the bytes
+    of the lines within the segments. 'mmap' memory-maps the file and only decodes the lines it needs, so that the
+    memory used does not grow with the size of the linelist. 'seek' takes the element blocks from the manifest (see
+    use_manifest, it is always used with this reader) and reads only the blocks within the segments with seek and read
+    of small chunks for the binary searches, and then only the lines to write, so that the reading does not grow with
+    the size of the linelist, but with the size of the new linelist.
+    :param index_dir: Folder where the indices are saved if reader is 'index'. If None, then it is a hidden folder in
+    old_path_name
+    :param workers: Number of processes to trim the linelist files in parallel. The output is the same as with 1 worker.
+    If the linelists are smaller than PARALLEL_TRIM_MIN_BYTES in total, then they are trimmed serially anyway.
+    :param use_manifest: If True, then the manifest of the linelist folder (saved in index_dir, built on the first use and
+    updated for changed files) tells which files and element blocks are outside of the segments, so they are skipped
+    without being opened. The element blocks within the segments are then read through the memory map, only the needed
+    ones, for both 'readlines' and 'mmap' readers.
+    :param stats: If given, then the timings of the stages and the counts of files, element blocks, lines and bytes are
+    added to it, and logged as one record of the 'linelist_stats' logger
+    :return: stats
     """
+    if reader not in ("readlines", "index", "mmap", "seek"):
+        raise ValueError(f"Unknown linelist reader {reader}")
+
     # get all files in directory
+    with stage_timer(stats, "scandir"):
+        line_list_files: list = get_linelist_files(old_path_name)
+        linelist_manifest: LinelistManifest = load_linelist_manifest(old_path_name, line_list_files, index_dir) \
+            if use_manifest or reader == "seek" else LinelistManifest(old_path_name)
+    if stats is not None:
+        stats.files_seen += len(line_list_files)
+
+    segment_to_use_begins, segment_to_use_ends = sort_segments(seg_begins, seg_ends)
+
+    if not lbl:
+        # if lbl is False, then we create the linelist for all segments together in the same folder
+        os.makedirs(os.path.join(f"{new_path_name}", "0", ''))
+    else:
+        # if lbl is True, then we create the folder for each segment separately
+        for seg_idx in range(len(seg_begins)):
+            new_path_name_one_seg: str = os.path.join(f"{new_path_name}", f"{seg_idx}", '')
+            os.makedirs(new_path_name_one_seg)
+
+    # go through all files in the old linelist folder
+    trim_arguments: tuple = (segment_to_use_begins, segment_to_use_ends, new_path_name, molecules_flag, lbl, do_hydrogen,
+                             reader, index_dir)
+    if workers > 1 and len(line_list_files) > 1 and \
+            sum(os.path.getsize(line_list_file) for line_list_file in line_list_files) >= PARALLEL_TRIM_MIN_BYTES:
+        # each file writes into its own linelist-{n}.bsyn, so files can be trimmed independently
+        line_list_order: list[int] = get_biggest_first_order(line_list_files)
+        with stage_timer(stats, "trim"), \
+                ProcessPoolExecutor(max_workers=min(workers, len(line_list_files))) as executor:
+            # each worker fills its own stats, they are added together here
+            futures: list = [executor.submit(trim_linelist_file_with_stats if stats is not None else trim_linelist_file,
+                                             line_list_files[line_list_number], line_list_number, *trim_arguments,
+                                             None, linelist_manifest.get(line_list_files[line_list_number]))
+                             for line_list_number in line_list_order]
+            for future in futures:
+                # raises the exception of the worker, if there was any
+                worker_stats: TrimStats = future.result()
+                if stats is not None:
+                    stats.merge(worker_stats, WORKER_TIMING_PREFIX)
+    else:
+        for line_list_number, line_list_file in enumerate(line_list_files):
+            with stage_timer(stats, "trim"):
+                trim_linelist_file(line_list_file, line_list_number, *trim_arguments, None,
+                                   linelist_manifest.get(line_list_file), stats)
+    if stats is not None:
+        stats.log("create_window_linelist", segments=len(segment_to_use_begins), lbl=lbl, reader=reader,
+                  workers=workers)
+    return stats
+
+def get_linelist_files(old_path_name: str) -> list[str]:
+    """
+    All linelist files in the folder, without .DS_Store
+    :param old_path_name: Path to the folder with the linelists
+    :return: List of paths to the linelist files
+    """
     line_list_files: list = [entry.path for entry in os.scandir(old_path_name) if entry.is_file()]
 
     # go through all files in line_list_files and if any ends with .DS_Store, remove it
@@ -36,67 +127,191 @@ def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[f
             logging.debug(f"LINELIST WARNING! File {line_list_file} is a .DS_Store file and will be removed")
             line_list_files.remove(line_list_file)
 
+    linelist_order: list[str] = load_linelist_order(old_path_name)
+    if linelist_order is not None:
+        # folder made by linelist_binary, keep the order of the folder it was converted from. Files removed since then
+        # are left out, files added since then go after the others, sorted by name
+        present_files: set[str] = {os.path.basename(line_list_file) for line_list_file in line_list_files}
+        ordered_files: list[str] = [file_name for file_name in linelist_order if file_name in present_files]
+        new_files: list[str] = sorted(present_files.difference(linelist_order))
+        return [os.path.join(old_path_name, file_name) for file_name in ordered_files + new_files]
+    return line_list_files
+
+def sort_segments(seg_begins: np.ndarray[float], seg_ends: np.ndarray[float]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts the segments to numpy arrays and sorts them by their beginnings
+    :param seg_begins: Array of segment beginnings
+    :param seg_ends: Array of segment ends
+    :return: Sorted segment beginnings and segment ends in the same order
+    """
     # convert to numpy arrays in case they are not
     segment_to_use_begins: np.ndarray = np.asarray(seg_begins)
     segment_to_use_ends: np.ndarray = np.asarray(seg_ends)
 
     # sort the segments
     segment_index_order: np.ndarray = np.argsort(segment_to_use_begins)
-    segment_to_use_begins: np.ndarray = segment_to_use_begins[segment_index_order]
-    segment_to_use_ends: np.ndarray = segment_to_use_ends[segment_index_order]
+    return segment_to_use_begins[segment_index_order], segment_to_use_ends[segment_index_order]
+
+def trim_and_combine_linelists(seg_begins: np.ndarray[float], seg_ends: np.ndarray[float], old_path_name: str,
+                               molecules_flag: bool, output=None, lbl=False, do_hydrogen=True, reader="readlines",
+                               index_dir: str = None, use_manifest: bool = False,
+                               stats: TrimStats = None) -> list[LinelistElement]:
+    """
+    Same as create_window_linelist followed by combine_linelists, but the trimmed elements go straight into the combined
+    output without writing the trimmed linelists of each file into a temporary folder and reading them again.
+    :param seg_begins: Array of segment beginnings
+    :param seg_ends: Array of segment ends
+    :param old_path_name: Path to the folder with the old linelists
+    :param molecules_flag: If True, then the molecules are included in the new linelist.
+    :param output: Path of the combined linelist or file-like object (text or binary) to write it into. If None, then
+    the elements are returned instead (they can be given directly to read_element_data)
+    :param lbl: If True, then the elements of each segment are kept separately (LinelistElement.segment_index). Only
+    possible if output is None
+    :param do_hydrogen: If False, then hydrogen is not included.
+    :param reader: How the linelists are read, see create_window_linelist
+    :param index_dir: Folder where the indices are saved if reader is 'index'
+    :param use_manifest: If True, then files and element blocks outside of the segments are skipped without being
+    opened, see create_window_linelist
+    :param stats: If given, then it is filled like in create_window_linelist
+    :return: List of elements of the trimmed linelist if output is None, otherwise empty list
+    """
+    if lbl and output is not None:
+        raise ValueError("One combined output cannot hold separate segments, use output=None with lbl")
+    with stage_timer(stats, "scandir"):
+        line_list_files: list = get_linelist_files(old_path_name)
+        linelist_manifest: LinelistManifest = load_linelist_manifest(old_path_name, line_list_files, index_dir) \
+            if use_manifest or reader == "seek" else LinelistManifest(old_path_name)
+    if stats is not None:
+        stats.files_seen += len(line_list_files)
+    segment_to_use_begins, segment_to_use_ends = sort_segments(seg_begins, seg_ends)
+    output_file = open(output, "wb") if isinstance(output, str) else output
+    try:
+        combined_writer: CombinedLinelistWriter = CombinedLinelistWriter(output_file, stats)
+        for line_list_number, line_list_file in enumerate(line_list_files):
+            with stage_timer(stats, "trim"):
+                trim_linelist_file(line_list_file, line_list_number, segment_to_use_begins, segment_to_use_ends, "",
+                                   molecules_flag, lbl, do_hydrogen, reader, index_dir, combined_writer,
+                                   linelist_manifest.get(line_list_file), stats)
+    finally:
+        if isinstance(output, str):
+            output_file.close()
+    if stats is not None:
+        stats.log("trim_and_combine_linelists", segments=len(segment_to_use_begins), lbl=lbl, reader=reader)
+    return combined_writer.linelist_elements
+
+def trim_linelist_file(line_list_file: str, line_list_number: int, segment_to_use_begins: np.ndarray,
+                       segment_to_use_ends: np.ndarray, new_path_name: str, molecules_flag: bool, lbl: bool,
+                       do_hydrogen: bool, reader: str = "readlines", index_dir: str = None, linelist_writer=None,
+                       manifest_entry: LinelistManifestEntry = None, stats: TrimStats = None):
+    """
+    Trims one linelist file and writes the lines within the segments into linelist-{line_list_number}.bsyn in the
+    segment folders of new_path_name. The folders must already exist. See create_window_linelist for the parameters.
+    :param line_list_file: Path to the linelist file
+    :param line_list_number: Number of the linelist, used for the name of the new linelist
+    :param segment_to_use_begins: Sorted array of segment beginnings
+    :param segment_to_use_ends: Array of segment ends, in the same order as segment_to_use_begins
+    :param linelist_writer: Where to write the trimmed elements instead of new_path_name, e.g. CombinedLinelistWriter
+    :param manifest_entry: Manifest entry of the file. If given, then the file is not opened if it has no lines within
+    the segments, and only the element blocks within the segments are read
+    :param stats: Where to count the files, element blocks, lines and bytes, and time the reads and writes
+    """
     segment_min_wavelength: float = np.min(segment_to_use_begins)
     segment_max_wavelength: float = np.max(segment_to_use_ends)
-
-    if not lbl:
-        # if lbl is False, then we create the linelist for all segments together in the same folder
-        os.makedirs(os.path.join(f"{new_path_name}", "0", ''))
-    else:
-        # if lbl is True, then we create the folder for each segment separately
-        for seg_idx in range(len(seg_begins)):
-            new_path_name_one_seg: str = os.path.join(f"{new_path_name}", f"{seg_idx}", '')
-            os.makedirs(new_path_name_one_seg)
-
-    # go through all files in the old linelist folder
-    for line_list_number, line_list_file in enumerate(line_list_files):
-        with open(line_list_file) as fp:
-            # so that we dont read full file if we are not sure that we use it (if it is a molecule)
-            try:
-                first_line: str = fp.readline()
-            except UnicodeDecodeError:
-                print(f"LINELIST WARNING! File {line_list_file} is not a valid linelist file")
-                continue
-            # check if line is empty
-            if not first_line:
-                print(f"LINELIST WARNING! File {line_list_file} is empty")
-                continue
-            fields = first_line.strip().split()
-            sep = '.'
-            element = fields[0] + fields[1]
-            elements = element.split(sep, 1)[0]
-            # opens each file, reads first row, if it is long enough then it is molecule. If fitting molecules, then
-            # keep it, otherwise ignore molecules
-            if len(elements) > 3 and molecules_flag or len(elements) <= 3:
-                # keep track of the lines to write
-                lines_to_write_indices: dict = {}
-                if element == "'01.000000'" and do_hydrogen:
-                    # if it is hydrogen, then we do not read the whole file
-                    # instead we just copy the file
-                    # use shutil.copyfile instead of open and write
-                    if not lbl:
-                        # if not lbl, we just copy the file once
-                        new_linelist_name: str = os.path.join(f"{new_path_name}", "0",
+    # empty and invalid files go the usual way, so that the same warnings are printed
+    if manifest_entry is not None and manifest_entry.status == "ok":
+        if manifest_entry.is_molecule and not molecules_flag:
+            if stats is not None:
+                stats.files_skipped += 1
+            return
+        if not (manifest_entry.is_hydrogen and do_hydrogen):
+            if not manifest_entry.is_in_range(segment_min_wavelength, segment_max_wavelength):
+                if stats is not None:
+                    stats.files_skipped += 1
+                return
+            if reader != "index":
+                # the index already has the wavelengths of the blocks in memory, so it is only used to skip the files
+                if stats is not None:
+                    stats.files_opened += 1
+                with linelist_writer or LinelistWriter(new_path_name, line_list_number, binary=True,
+                                                       stats=stats) as file_writer:
+                    trim_linelist_with_manifest(manifest_entry, segment_to_use_begins, segment_to_use_ends, lbl,
+                                                file_writer, stats, reader == "seek")
+                return
+    if stats is not None:
+        stats.files_opened += 1
+    with open(line_list_file) as fp:
+        # so that we dont read full file if we are not sure that we use it (if it is a molecule)
+        try:
+            first_line: str = fp.readline()
+        except UnicodeDecodeError:
+            print(f"LINELIST WARNING! File {line_list_file} is not a valid linelist file")
+            if stats is not None:
+                stats.files_skipped += 1
+            return
+        # check if line is empty
+        if not first_line:
+            print(f"LINELIST WARNING! File {line_list_file} is empty")
+            if stats is not None:
+                stats.files_skipped += 1
+            return
+        fields = first_line.strip().split()
+        sep = '.'
+        element = fields[0] + fields[1]
+        elements = element.split(sep, 1)[0]
+        # opens each file, reads first row, if it is long enough then it is molecule. If fitting molecules, then
+        # keep it, otherwise ignore molecules
+        if len(elements) > 3 and molecules_flag or len(elements) <= 3:
+            # keep track of the lines to write
+            lines_to_write_indices: dict = {}
+            if element == "'01.000000'" and do_hydrogen and linelist_writer is not None:
+                # whole hydrogen file goes into the given writer
+                for seg_index in range(len(segment_to_use_begins) if lbl else 1):
+                    linelist_writer.add_file(seg_index, line_list_file)
+                linelist_writer.close()
+            elif element == "'01.000000'" and do_hydrogen:
+                # if it is hydrogen, then we do not read the whole file
+                # instead we just copy the file
+                # use shutil.copyfile instead of open and write
+                if not lbl:
+                    # if not lbl, we just copy the file once
+                    new_linelist_name: str = os.path.join(f"{new_path_name}", "0",
+                                                          f"linelist-{line_list_number}.bsyn")
+                    shutil.copyfile(line_list_file, new_linelist_name)
+                    if stats is not None:
+                        stats.bytes_written += os.path.getsize(new_linelist_name)
+                else:
+                    # if lbl, we copy the file once and hard link the copy into the other segments
+                    # (not the old file itself, so that the new linelists never point to the original linelist)
+                    first_linelist_name: str = os.path.join(f"{new_path_name}", "0", f"linelist-{line_list_number}.bsyn")
+                    shutil.copyfile(line_list_file, first_linelist_name)
+                    for seg_index in range(1, len(segment_to_use_begins)):
+                        new_linelist_name: str = os.path.join(f"{new_path_name}", f"{seg_index}",
                                                               f"linelist-{line_list_number}.bsyn")
-                        shutil.copyfile(line_list_file, new_linelist_name)
-                    else:
-                        # if lbl, we copy the file for each segment
-                        for seg_index in range(len(seg_begins)):
-                            new_linelist_name: str = os.path.join(f"{new_path_name}", f"{seg_index}",
-                                                                  f"linelist-{line_list_number}.bsyn")
-                            shutil.copyfile(line_list_file, new_linelist_name)
-                elif element != '01.000000':
-                    # if it is not hydrogen, and we want to read it (e.g. molecules_flag is True)
-                    # now read the whole file
+                        link_or_copy(first_linelist_name, new_linelist_name)
+                    if stats is not None:
+                        # the links are not written again, so only the copy counts
+                        stats.bytes_written += os.path.getsize(first_linelist_name)
+            elif element != '01.000000' and reader == "index":
+                # same as below, but wavelengths and positions of the lines are taken from the index
+                with stage_timer(stats, "read"):
+                    linelist_index: LinelistIndex = load_linelist_index(line_list_file, index_dir)
+                with linelist_writer or LinelistWriter(new_path_name, line_list_number, binary=True,
+                                                       stats=stats) as file_writer:
+                    trim_linelist_with_index(linelist_index, segment_to_use_begins, segment_to_use_ends, lbl,
+                                             file_writer, stats)
+            elif element != '01.000000' and reader == "mmap":
+                # same as below, but the file is walked through the memory map instead of being read into memory
+                with linelist_writer or LinelistWriter(new_path_name, line_list_number, binary=True,
+                                                       stats=stats) as file_writer:
+                    trim_linelist_with_mmap(line_list_file, segment_to_use_begins, segment_to_use_ends, lbl,
+                                            file_writer, stats)
+            elif element != '01.000000':
+                # if it is not hydrogen, and we want to read it (e.g. molecules_flag is True)
+                # now read the whole file
+                with stage_timer(stats, "read"):
                     lines_file: list[str] = fp.readlines()
+                # all elements of the file are buffered and written at the end
+                with linelist_writer or LinelistWriter(new_path_name, line_list_number, stats=stats) as file_writer:
                     # keep track of the lines read
                     line_number_read_file: int = 0
                     # since we read the first line already, we add 1 to the total number of lines in the file
@@ -118,14 +333,8 @@ def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[f
                             first_line_read: bool = False
                         # first line is e.g. '   3.000            '    1	13
                         # so element, ion, and number of lines
-                        fields: list[str] = line.strip().split()
-
-                        if len(fields[0]) > 1:  # save the first two lines of an element for the future
-                            elem_line_1_to_save: str = f"{fields[0]} {fields[1]}  {fields[2]}"  # first line of the element
-                            number_of_lines_element: int = int(fields[3])
-                        else:
-                            elem_line_1_to_save: str = f"{fields[0]}   {fields[1]}            {fields[2]}    {fields[3]}"
-                            number_of_lines_element: int = int(fields[4])
+                        # save the first two lines of an element for the future
+                        elem_line_1_to_save, number_of_lines_element = parse_element_header(line)
                         # second line is e.g. 'Li I    LTE'
                         # so element, ion, and LTE or NLTE
                         elem_line_2_to_save: str = lines_file[line_number_read_file]
@@ -141,7 +350,22 @@ def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[f
                         wavelength_maximum_element: float = get_wavelength_from_array(lines_file, element_wavelength_dictionary, number_of_lines_element - 1, line_number_read_file)
 
                         # check that ANY wavelengths are within the range at all
-                        if not (wavelength_maximum_element < segment_min_wavelength or wavelength_minimum_element > segment_max_wavelength):
+                        element_in_range: bool = not (wavelength_maximum_element < segment_min_wavelength or wavelength_minimum_element > segment_max_wavelength)
+                        if element_in_range and use_batched_segment_search(len(segment_to_use_begins), number_of_lines_element):
+                            # many segments (e.g. lbl with many windows): parse all wavelengths of the element once and
+                            # find the lines of all segments at once with numpy instead of binary searches per segment
+                            wavelengths_element: np.ndarray = get_wavelengths_from_array(lines_file, line_number_read_file,
+                                                                                         number_of_lines_element)
+                            segment_starts, segment_ends, segment_found = find_segment_indices(wavelengths_element,
+                                                                                               segment_to_use_begins,
+                                                                                               segment_to_use_ends)
+                            for seg_index in np.flatnonzero(segment_found):
+                                seg_current_index: int = int(seg_index) if lbl else 0
+                                if seg_current_index not in lines_to_write_indices:
+                                    lines_to_write_indices[seg_current_index] = []
+                                lines_to_write_indices[seg_current_index].append((int(segment_starts[seg_index]) + line_number_read_file,
+                                                                                  int(segment_ends[seg_index]) + line_number_read_file + 1))
+                        elif element_in_range:
                             # go through all segments to figure out which lines are within the segment for this element
                             for seg_index, (seg_begin, seg_end) in enumerate(zip(segment_to_use_begins, segment_to_use_ends)):
                                 # find the index of the first line within the segment
@@ -172,12 +396,211 @@ def create_window_linelist(seg_begins: np.ndarray[float], seg_ends: np.ndarray[f
                                     lines_to_write_indices[seg_current_index].append((index_seg_start + line_number_read_file, index_seg_end + line_number_read_file + 1))
                         # update the line number read in the file
                         line_number_read_file: int = number_of_lines_element + line_number_read_file
+                        if stats is not None:
+                            stats.blocks_scanned += 1
                         # if we have lines to write, then we write them
                         if lines_to_write_indices:
+                            if stats is not None:
+                                stats.blocks_kept += 1
                             write_lines(lines_to_write_indices, lines_file, elem_line_1_to_save, elem_line_2_to_save,
-                                        new_path_name, line_list_number)
+                                        new_path_name, line_list_number, file_writer, stats)
                             # clear the dictionary instead of creating new one
                             lines_to_write_indices.clear()
+        elif stats is not None:
+            # molecule, but molecules are not wanted
+            stats.files_skipped += 1
+
+def trim_linelist_file_with_stats(*trim_arguments) -> TrimStats:
+    """
+    Same as trim_linelist_file (with the same arguments, without stats), but gives back its own stats. Used by the
+    parallel trimming, where each process has its own stats
+    :return: Stats of trimming the file
+    """
+    stats: TrimStats = TrimStats()
+    with stats.timer("trim"):
+        trim_linelist_file(*trim_arguments, stats=stats)
+    return stats
+
+def trim_linelist_with_index(linelist_index: LinelistIndex, segment_to_use_begins: np.ndarray,
+                             segment_to_use_ends: np.ndarray, lbl: bool, linelist_writer: LinelistWriter,
+                             stats: TrimStats = None):
+    """
+    Same as the loop over the elements in create_window_linelist, but the wavelengths are taken from the index instead
+    of the text, and the lines are copied as bytes from the linelist.
+    :param linelist_index: Index of the linelist
+    :param segment_to_use_begins: Sorted array of segment beginnings
+    :param segment_to_use_ends: Array of segment ends, in the same order as segment_to_use_begins
+    :param lbl: If True, then the lines of each segment are saved separately
+    :param linelist_writer: Binary writer of the new linelists
+    :param stats: Where to count the element blocks, lines and bytes
+    """
+    segment_min_wavelength: float = np.min(segment_to_use_begins)
+    segment_max_wavelength: float = np.max(segment_to_use_ends)
+    with open(linelist_index.linelist_path, "rb") as linelist_file:
+        for block_index in range(linelist_index.number_of_blocks):
+            wavelengths: np.ndarray = linelist_index.block_wavelengths(block_index)
+            if len(wavelengths) == 0:
+                continue
+            if stats is not None:
+                stats.blocks_scanned += 1
+            if wavelengths[-1] < segment_min_wavelength or wavelengths[0] > segment_max_wavelength:
+                continue
+            segment_starts, segment_ends, segment_found = find_segment_indices(wavelengths, segment_to_use_begins,
+                                                                               segment_to_use_ends)
+            byte_ranges_to_write: dict = {}
+            for seg_index in np.flatnonzero(segment_found):
+                seg_current_index: int = int(seg_index) if lbl else 0
+                if seg_current_index not in byte_ranges_to_write:
+                    byte_ranges_to_write[seg_current_index] = []
+                byte_ranges_to_write[seg_current_index].append(
+                    (int(segment_ends[seg_index] - segment_starts[seg_index] + 1),
+                     linelist_index.block_byte_range(block_index, segment_starts[seg_index], segment_ends[seg_index])))
+            if byte_ranges_to_write:
+                if stats is not None:
+                    stats.blocks_kept += 1
+                write_byte_ranges(byte_ranges_to_write, linelist_file, linelist_index.element_lines_1[block_index],
+                                  linelist_index.element_lines_2[block_index], linelist_writer, stats)
+
+def trim_linelist_with_mmap(line_list_file: str, segment_to_use_begins: np.ndarray, segment_to_use_ends: np.ndarray,
+                            lbl: bool, linelist_writer: LinelistWriter,
+                            stats: TrimStats = None):
+    """
+    Same as the loop over the elements in create_window_linelist, but the linelist is memory-mapped. Element blocks are
+    found by counting new lines, and the segments are found by a binary search over the bytes, so only the lines touched
+    by the search are decoded. The lines within the segments are copied as bytes.
+    :param line_list_file: Path to the linelist file
+    :param segment_to_use_begins: Sorted array of segment beginnings
+    :param segment_to_use_ends: Array of segment ends, in the same order as segment_to_use_begins
+    :param lbl: If True, then the lines of each segment are saved separately
+    :param linelist_writer: Binary writer of the new linelists
+    :param stats: Where to count the element blocks, lines and bytes
+    """
+    segment_min_wavelength: float = np.min(segment_to_use_begins)
+    segment_max_wavelength: float = np.max(segment_to_use_ends)
+    with open(line_list_file, "rb") as linelist_file, \
+            mmap.mmap(linelist_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        for elem_line_1_to_save, elem_line_2_to_save, data_start, data_end in iter_mmap_blocks(mapped_file):
+            if stats is not None:
+                stats.blocks_scanned += 1
+            if data_start >= data_end:
+                continue
+            last_line_start: int = find_line_start(mapped_file, data_end - 1, data_start)
+            wavelength_minimum_element: float = get_wavelength_at(mapped_file, data_start, data_end)
+            wavelength_maximum_element: float = get_wavelength_at(mapped_file, last_line_start, data_end)
+            if wavelength_maximum_element < segment_min_wavelength or wavelength_minimum_element > segment_max_wavelength:
+                continue
+            byte_ranges_to_write: dict = {}
+            for seg_index, (seg_begin, seg_end) in enumerate(zip(segment_to_use_begins, segment_to_use_ends)):
+                byte_start, byte_end = find_segment_byte_range(mapped_file, data_start, data_end, last_line_start,
+                                                               wavelength_minimum_element, wavelength_maximum_element,
+                                                               seg_begin, seg_end)
+                if byte_start == -1:
+                    continue
+                seg_current_index: int = seg_index if lbl else 0
+                if seg_current_index not in byte_ranges_to_write:
+                    byte_ranges_to_write[seg_current_index] = []
+                byte_ranges_to_write[seg_current_index].append((count_lines(mapped_file, byte_start, byte_end),
+                                                                (byte_start, byte_end)))
+            if byte_ranges_to_write:
+                if stats is not None:
+                    stats.blocks_kept += 1
+                # mmap can seek and read like a file
+                write_byte_ranges(byte_ranges_to_write, mapped_file, elem_line_1_to_save, elem_line_2_to_save,
+                                  linelist_writer, stats)
+
+def trim_linelist_with_manifest(manifest_entry: LinelistManifestEntry, segment_to_use_begins: np.ndarray,
+                                segment_to_use_ends: np.ndarray, lbl: bool, linelist_writer: LinelistWriter,
+                                stats: TrimStats = None, seek: bool = False):
+    """
+    Same as trim_linelist_with_mmap, but the element blocks and their first and last wavelengths are taken from the
+    manifest, so the blocks outside of the segments are never read and the new lines are not counted to find the blocks.
+    If seek is True, then the file is read with seek and read instead of being memory-mapped.
+    :param manifest_entry: Manifest entry of the linelist file
+    :param segment_to_use_begins: Sorted array of segment beginnings
+    :param segment_to_use_ends: Array of segment ends, in the same order as segment_to_use_begins
+    :param lbl: If True, then the lines of each segment are saved separately
+    :param linelist_writer: Binary writer of the new linelists
+    :param stats: Where to count the element blocks, lines and bytes
+    """
+    segment_min_wavelength: float = np.min(segment_to_use_begins)
+    segment_max_wavelength: float = np.max(segment_to_use_ends)
+    with open(manifest_entry.linelist_path, "rb") as linelist_file, \
+            (nullcontext(SeekableLinelistFile(linelist_file)) if seek else
+             mmap.mmap(linelist_file.fileno(), 0, access=mmap.ACCESS_READ)) as mapped_file:
+        for block_index in manifest_entry.blocks_in_range(segment_min_wavelength, segment_max_wavelength):
+            if stats is not None:
+                stats.blocks_scanned += 1
+            data_start: int = manifest_entry.block_data_starts[block_index]
+            data_end: int = manifest_entry.block_data_ends[block_index]
+            byte_ranges_to_write: dict = {}
+            for seg_index, (seg_begin, seg_end) in enumerate(zip(segment_to_use_begins, segment_to_use_ends)):
+                byte_start, byte_end = find_segment_byte_range(mapped_file, data_start, data_end,
+                                                               manifest_entry.block_last_line_starts[block_index],
+                                                               manifest_entry.block_wavelength_minimums[block_index],
+                                                               manifest_entry.block_wavelength_maximums[block_index],
+                                                               seg_begin, seg_end)
+                if byte_start == -1:
+                    continue
+                seg_current_index: int = seg_index if lbl else 0
+                if seg_current_index not in byte_ranges_to_write:
+                    byte_ranges_to_write[seg_current_index] = []
+                if byte_start == data_start and byte_end == data_end:
+                    # whole block, the manifest knows how many lines it has
+                    number_of_lines: int = manifest_entry.block_line_counts[block_index]
+                else:
+                    number_of_lines: int = count_lines(mapped_file, byte_start, byte_end)
+                byte_ranges_to_write[seg_current_index].append((number_of_lines, (byte_start, byte_end)))
+            if byte_ranges_to_write:
+                if stats is not None:
+                    stats.blocks_kept += 1
+                write_byte_ranges(byte_ranges_to_write, mapped_file, manifest_entry.element_lines_1[block_index],
+                                  manifest_entry.element_lines_2[block_index], linelist_writer, stats)
+
+def use_batched_segment_search(number_of_segments: int, number_of_lines_element: int) -> bool:
+    """
+    Whether it is faster to parse all wavelengths of the element and use find_segment_indices, than to do a binary search
+    for each segment separately
+    :param number_of_segments: Number of segments
+    :param number_of_lines_element: Number of lines of the element
+    :return: True if the batched search should be used
+    """
+    return BATCHED_SEARCH_COST_RATIO * number_of_segments * np.log2(number_of_lines_element + 1) >= number_of_lines_element
+
+def get_wavelengths_from_array(array_to_search: list[str], offset_idx: int, number_of_lines: int) -> np.ndarray:
+    """
+    Parses the wavelengths of number_of_lines lines at once into an array
+    :param array_to_search: Array with all lines from the file, where first element is usually the wavelength
+    :param offset_idx: Index of the first line to parse
+    :param number_of_lines: Number of lines to parse
+    :return: Wavelengths of the lines
+    """
+    return np.fromiter((float(line.split(None, 1)[0]) for line in array_to_search[offset_idx:offset_idx + number_of_lines]),
+                       dtype=np.float64, count=number_of_lines)
+
+def find_segment_indices(wavelengths: np.ndarray, segment_to_use_begins: np.ndarray,
+                         segment_to_use_ends: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds for all segments at once the first and last line of the element within the segment. Gives the same indices as
+    binary_find_left_segment_index and binary_find_right_segment_index (including how they treat repeated wavelengths
+    at the edges), but with np.searchsorted.
+    :param wavelengths: Sorted wavelengths of the element
+    :param segment_to_use_begins: Array of segment beginnings
+    :param segment_to_use_ends: Array of segment ends
+    :return: Index of the first line in each segment, index of the last line in each segment and whether there are any
+    lines in the segment at all (if False, then the indices are meaningless)
+    """
+    last_index: int = len(wavelengths) - 1
+    # left index: first line with wavelength >= seg_begin, but the last line if seg_begin is past it
+    segment_starts: np.ndarray = np.searchsorted(wavelengths, segment_to_use_begins, side="left")
+    segment_starts = np.where((segment_to_use_begins > wavelengths[0]) & (segment_to_use_begins >= wavelengths[-1]),
+                              last_index, segment_starts)
+    wavelength_starts: np.ndarray = wavelengths[segment_starts]
+    segment_found: np.ndarray = (segment_to_use_begins <= wavelength_starts) & (wavelength_starts <= segment_to_use_ends)
+    # right index: last line with wavelength <= seg_end, but the first line of the segment if seg_end is equal to it
+    segment_ends: np.ndarray = np.searchsorted(wavelengths, segment_to_use_ends, side="right") - 1
+    segment_ends = np.where(segment_to_use_ends >= wavelengths[-1], last_index, segment_ends)
+    segment_ends = np.where(segment_to_use_ends <= wavelength_starts, segment_starts, segment_ends)
+    return segment_starts, segment_ends, segment_found
 
 def binary_search_lower_bound(array_to_search: list[str], dict_array_values: dict, low: int, high: int,
                               element_to_search: float) -> int:
@@ -312,7 +735,8 @@ def binary_find_right_segment_index(array_to_search: list[str], dict_array_value
     return left + low - 1
 
 def write_lines(indices_to_write: dict, lines_file: list[str], elem_line_1_to_save: str, elem_line_2_to_save: str,
-                new_path_name: str, line_list_number: float):
+                new_path_name: str, line_list_number: float, linelist_writer: LinelistWriter = None,
+                stats: TrimStats = None):
     """
     Writes the lines to the new linelist file based on the indices of the lines to write.
     :param indices_to_write: Dictionary with the indices of the lines to write
@@ -321,27 +745,78 @@ def write_lines(indices_to_write: dict, lines_file: list[str], elem_line_1_to_sa
     :param elem_line_2_to_save: Second line of the element
     :param new_path_name: Path to the folder where the new linelists will be saved
     :param line_list_number: Number of the linelist
+    :param linelist_writer: Writer that buffers the lines of the whole file. If None, then the lines are written
+    immediately
+    :param stats: Where to count the lines written and time the writing
+    """
+    if linelist_writer is None:
+        with LinelistWriter(new_path_name, line_list_number, stats=stats) as linelist_writer:
+            write_lines(indices_to_write, lines_file, elem_line_1_to_save, elem_line_2_to_save, new_path_name,
+                        line_list_number, linelist_writer, stats)
+        return
+    with stage_timer(stats, "write"):
+        write_lines_to_writer(indices_to_write, lines_file, elem_line_1_to_save, elem_line_2_to_save, linelist_writer,
+                              stats)
+
+def write_lines_to_writer(indices_to_write: dict, lines_file: list[str], elem_line_1_to_save: str,
+                          elem_line_2_to_save: str, linelist_writer: LinelistWriter, stats: TrimStats = None):
+    """
+    Loop of write_lines over the segments, see write_lines
     """
     for key in indices_to_write:
         # if lbl, this goes through all segments, if not lbl, this goes through only one segment
         # key would be segment index if lbl, otherwise 0
-        new_linelist_name: str = os.path.join(f"{new_path_name}", f"{key}", f"linelist-{line_list_number}.bsyn")
-        with open(new_linelist_name, "a") as new_file_to_write:
-            # now we append the lines to the new linelist. since we need to keep track of the line length, we do it here
-            line_length = 0
-            # we also keep track of the lines to write and then write them all at once
-            lines_to_write = ""
-            for index_pairs in indices_to_write[key]:
-                # now we go through all the indices of the lines to write
-                # for lbl this is just 1 pair, for not lbl this is all pairs
-                index_start, index_end = index_pairs
-                line_length += index_end - index_start
-                lines_to_write += "".join(lines_file[index_start:index_end])
-            new_file_to_write.write(f"{elem_line_1_to_save}	{line_length}\n")
-            new_file_to_write.write(f"{elem_line_2_to_save}")
-            new_file_to_write.write(lines_to_write)
-
-def combine_linelists(line_list_path_trimmed: str, combined_linelist_name: str = "combined_linelist.bsyn", return_parsed_linelist: bool = False):
+        # since we need to keep track of the line length, we do it here
+        line_length = 0
+        # we also keep track of the lines to write and then give them all at once to the writer
+        lines_to_write: list[str] = []
+        for index_pairs in indices_to_write[key]:
+            # now we go through all the indices of the lines to write
+            # for lbl this is just 1 pair, for not lbl this is all pairs
+            index_start, index_end = index_pairs
+            line_length += index_end - index_start
+            lines_to_write.extend(lines_file[index_start:index_end])
+        linelist_writer.add_element(key, elem_line_1_to_save, elem_line_2_to_save, line_length, lines_to_write)
+        if stats is not None:
+            stats.lines_written += line_length
+
+def write_byte_ranges(byte_ranges_to_write: dict, linelist_file, elem_line_1_to_save: str, elem_line_2_to_save: str,
+                      linelist_writer: LinelistWriter, stats: TrimStats = None):
+    """
+    Same as write_lines, but copies the lines as bytes from the old linelist file instead of a list of lines.
+    :param byte_ranges_to_write: Dictionary with lists of (number of lines, (byte start, byte end)) for each segment
+    :param linelist_file: Old linelist file opened in binary mode
+    :param elem_line_1_to_save: First line of the element
+    :param elem_line_2_to_save: Second line of the element
+    :param linelist_writer: Binary writer of the new linelists
+    :param stats: Where to count the lines written and time the writing
+    """
+    with stage_timer(stats, "write"):
+        for key in byte_ranges_to_write:
+            line_length: int = sum(number_of_lines for number_of_lines, _ in byte_ranges_to_write[key])
+            lines_to_write: list[bytes] = []
+            for _, (byte_start, byte_end) in byte_ranges_to_write[key]:
+                linelist_file.seek(byte_start)
+                lines_to_write.append(linelist_file.read(byte_end - byte_start))
+            linelist_writer.add_element(key, elem_line_1_to_save, elem_line_2_to_save, line_length, lines_to_write)
+            if stats is not None:
+                stats.lines_written += line_length
+
+def combine_linelists(line_list_path_trimmed: str, combined_linelist_name: str = "combined_linelist.bsyn", return_parsed_linelist: bool = False,
+                      stats: TrimStats = None):
+    with stage_timer(stats, "combine"):
+        parsed_linelist_data = combine_linelist_folders(line_list_path_trimmed, combined_linelist_name,
+                                                        return_parsed_linelist, stats)
+    if stats is not None:
+        stats.log("combine_linelists")
+    if return_parsed_linelist:
+        return parsed_linelist_data
+
+def combine_linelist_folders(line_list_path_trimmed: str, combined_linelist_name: str, return_parsed_linelist: bool,
+                             stats: TrimStats = None) -> list[str]:
+    """
+    Loop of combine_linelists over the segment folders, see combine_linelists
+    """
     parsed_linelist_data = []
     for folder in os.listdir(line_list_path_trimmed):
         if os.path.isdir(os.path.join(line_list_path_trimmed, folder)):
@@ -353,14 +828,21 @@ def combine_linelists(line_list_path_trimmed: str, combined_linelist_name: str =
                         with open(os.path.join(line_list_path_trimmed, folder, file), "r") as linelist_file:
                             read_file = linelist_file.read()
                             combined_linelist_file.write(read_file)
+                            if stats is not None:
+                                stats.files_opened += 1
                             if return_parsed_linelist:
                                 parsed_linelist_data.append(read_file)
                         # delete the file
                         os.remove(os.path.join(line_list_path_trimmed, folder, file))
-    if return_parsed_linelist:
-        return parsed_linelist_data
+            if stats is not None:
+                # size of the file and not the length of the text, which counts characters instead of bytes
+                stats.bytes_written += os.path.getsize(combined_linelist)
+    return parsed_linelist_data
 
 def read_element_data(lines):
+    if lines and isinstance(lines[0], LinelistElement):
+        # elements from trim_and_combine_linelists, no need to split the text into lines again
+        return read_element_data_from_elements(lines)
     i = 0
     elements_data = []
     while i < len(lines):
@@ -388,7 +870,23 @@ def read_element_data(lines):
 
     return elements_data
 
+def read_element_data_from_elements(linelist_elements: list[LinelistElement]) -> list[tuple[float, str, float]]:
+    """
+    Same as read_element_data, but from the elements given by trim_and_combine_linelists
+    :param linelist_elements: List of elements
+    :return: List of (wavelength, element name, loggf)
+    """
+    elements_data = []
+    for linelist_element in linelist_elements:
+        element_name = linelist_element.elem_line_2.strip().replace("'", "").replace("NLTE", "").replace("LTE", "")
+        for data_line in linelist_element.lines:
+            data_fields = data_line.split()
+            elements_data.append((float(data_fields[0]), f"{element_name}", float(data_fields[2])))
+    return elements_data
+
 def find_elements(elements_data, left_wavelength, right_wavelength, loggf_threshold):
+    if isinstance(elements_data, LineTable):
+        return find_elements_in_table(elements_data, left_wavelength, right_wavelength, loggf_threshold)
     filtered_elements = []
     for element_data in elements_data:
         wavelength, element_name, loggf = element_data
@@ -406,12 +904,16 @@ def find_elements(elements_data, left_wavelength, right_wavelength, loggf_thresh
 
 def find_element(elements_data, element_name):
     # ["wavelenght", "element name like 'FeI'", "log gf"]
+    if isinstance(elements_data, LineTable):
+        return find_element_in_table(elements_data, element_name)
     element_data = []
-    for i in range(len(elements_data)):
-        elements_data[i][1] = output_string = re.sub(r'\s+', ' ', elements_data[i][1].strip())
-        print(elements_data[i][1])
-        if elements_data[i][1] == element_name:
-            element_data.append(elements_data[i])
+    # each name is normalized only once, not once per line
+    normalized_names: dict = {}
+    for wavelength, line_element_name, loggf in elements_data:
+        if line_element_name not in normalized_names:
+            normalized_names[line_element_name] = normalize_species_name(line_element_name)
+        if normalized_names[line_element_name] == element_name:
+            element_data.append([wavelength, normalized_names[line_element_name], loggf])
 
     return element_data
 
@@ -433,29 +935,19 @@ if __name__ == "__main__":
     lmax = synth_data[:, 0][-1]
     include_molecules = True
 
-    today = datetime.datetime.now().strftime("%b-%d-%Y-%H-%M-%S")  # used to not conflict with other instances of fits
-    today = f"{today}_{np.random.random(1)[0]}"
-    temp_directory = f"../temp_directory/temp_directory_{datetime.datetime.now().strftime('%b-%d-%Y-%H-%M-%S')}__{np.random.random(1)[0]}/"
-    line_list_path_trimmed = os.path.join(f"{temp_directory}", "linelist_for_fitting_trimmed", "")
-    line_list_path_trimmed = os.path.join(line_list_path_trimmed, "all", today, '')
-
-    create_window_linelist([lmin - 4], [lmax + 4], turbospectrum_paths["line_list_path"], line_list_path_trimmed, include_molecules, False, do_hydrogen=False)
-    return_parsed_linelist = True
-    parsed_linelist_data = combine_linelists(line_list_path_trimmed, return_parsed_linelist=return_parsed_linelist)
-    parsed_elements_sorted_info = None
-    if return_parsed_linelist:
-        parsed_model_atom_data = []
-        for i in range(len(parsed_linelist_data)):
-            parsed_model_atom_data.extend(parsed_linelist_data[i].split("\n"))
-        left_wavelength = lmin  # change this to change the range of wavelengths to print
-        right_wavelength = lmax
-        loggf_threshold = -1          # change this to change the threshold for loggf
-        elements_data = read_element_data(parsed_model_atom_data)
-        parsed_elements_sorted_info = find_elements(elements_data, left_wavelength, right_wavelength, loggf_threshold)
-
-    print(parsed_elements_sorted_info)
+    # trimmed elements go straight into memory, without the temporary folder and combine_linelists
+    linelist_elements = trim_and_combine_linelists([lmin - 4], [lmax + 4], turbospectrum_paths["line_list_path"],
+                                                   include_molecules, do_hydrogen=False)
+    left_wavelength = lmin  # change this to change the range of wavelengths to print
+    right_wavelength = lmax
+    loggf_threshold = -1          # change this to change the threshold for loggf
+    # columnar table instead of the list of tuples from read_element_data
+    elements_data = read_line_table(linelist_elements)
+    parsed_elements_sorted_info = find_elements(elements_data, left_wavelength, right_wavelength, loggf_threshold)
+
+    print(parsed_elements_sorted_info.to_list())
     Fe1_list = find_element(parsed_elements_sorted_info, "Fe II")
-    print(Fe1_list)
+    print(Fe1_list.to_list())
 
 
 
@@ -465,43 +957,27 @@ if __name__ == "__main__":
     if save_graph:
         import matplotlib.pyplot as plt
         import scienceplots
-        
+        from spectrum_plot import decimate_minmax, select_labels, get_label_texts, plot_spectrum
+
         with plt.style.context('science'):
             plt.figure()
-            plt.plot(synth_data[:, 0], synth_data[:, 1], color="black")
-            for line in parsed_elements_sorted_info:
-                wl, element, log_gf = line
-                plt.axvline(x=wl, color='gray', linestyle='--')
-                plt.text(wl, 1 * 0.5, f'{element} (log gf={log_gf})', rotation=90, verticalalignment='bottom', color='black')
+            plt.plot(*decimate_minmax(synth_data[:, 0], synth_data[:, 1]), color="black")
+            # all markers as one collection, labels only for the strongest lines
+            plt.vlines(parsed_elements_sorted_info.wavelengths, 0, 1, colors='gray', linestyles='--')
+            label_rows = select_labels(parsed_elements_sorted_info)
+            for wl, label in zip(parsed_elements_sorted_info.wavelengths[label_rows],
+                                 get_label_texts(parsed_elements_sorted_info, label_rows)):
+                plt.text(wl, 1 * 0.5, label, rotation=90, verticalalignment='bottom', color='black')
             plt.show()
 
-
-        import plotly.express as px
-
-        fig = px.line(x=synth_data[:, 0][::10], y=synth_data[:, 1][::10], title='Spectrum')
+        fig = plot_spectrum(synth_data, title='Spectrum')
         fig.show()
-    
 
     if show_graph:
-        import plotly.graph_objects as go
-        
-        fig = go.Figure()
-
-        wavelengths = synth_data[:, 0][::10]
-        intensities = synth_data[:, 1][::10]
-
-        fig.add_trace(go.Scatter(x=wavelengths, y=intensities, mode='lines', name='Spectrum'))
+        from spectrum_plot import plot_spectrum
 
-        for line in parsed_elements_sorted_info:
-            wl, element, log_gf = line
-            fig.add_trace(go.Scatter(x=[wl, wl], y=[min(intensities), 1.05], mode='lines', 
-                                    line=dict(color='black', dash='dash'), name=f'{element} (log gf={log_gf})'))
-            fig.add_annotation(x=wl, y=max(intensities) * 1.05, text=f'{element} (log gf={log_gf})',
-                            showarrow=True, xshift=0, yshift=0, textangle=-90, font=dict(color='black'))
-
-        # Настройка осей и заголовка
-        fig.update_layout(title='Спектральные линии химических элементов',
-                        xaxis_title='Длина волны (нм)',
-                        yaxis_title='Интенсивность')
-
-        fig.show()
\ No newline at end of file
+        fig = plot_spectrum(synth_data, parsed_elements_sorted_info,
+                            title='Спектральные линии химических элементов',
+                            xaxis_title='Длина волны (нм)',
+                            yaxis_title='Интенсивность')
+        fig.show()